@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Хранилище подготовленных артефактов на диске
+Шаблоны после fix_html_layout, overlay PDF с печатями и уменьшенные изображения
+собираются при сборке образа (python pdf_costructor.py build-artifacts) в
+ARTIFACT_DIR/<code_version>/ и открываются через mmap только для чтения:
+страницы файлов общие у всех воркеров, а новый инстанс стартует горячим.
+Каталог версии меняется с любым изменением кода, шаблонов или ассетов
+(render_cache.code_version), ключ артефакта включает хэш его исходников.
+В рантайме хранилище только читается; нет артефакта - он собирается как раньше.
+
+   python artifact_store.py   — что лежит в хранилище текущей версии
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+
+import metrics
+from stamp_layout import BASE_DIR
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(BASE_DIR, "artifacts"))   # пусто = хранилище выключено
+
+MANIFEST = 'manifest.json'
+EXTENSIONS = {'html': '.html', 'overlay': '.pdf', 'image': '.png'}
+
+
+class MappedArtifact:
+    """Файл артефакта, отображенный в память только для чтения"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def stream(self) -> mmap.mmap:
+        """Свой поток чтения (позиция у каждого своя) поверх тех же страниц"""
+        return mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+
+    def text(self) -> str:
+        return self._map[:].decode('utf-8')
+
+
+def open_stream(payload):
+    """Поток для PdfReader/ImageReader: bytes из памяти или артефакт из хранилища"""
+    from io import BytesIO
+
+    return payload.stream() if isinstance(payload, MappedArtifact) else BytesIO(payload)
+
+
+class ArtifactStore:
+    """
+    Артефакты одной версии кода: ARTIFACT_DIR/<версия>/manifest.json и файлы
+
+    Ключ - строка 'вид/.../хэш исходников'; имя файла - хэш ключа,
+    манифест хранит ключ, файл, размер и sha256 содержимого.
+    """
+
+    def __init__(self, directory: str = ARTIFACT_DIR, version: str = None):
+        self.directory = directory
+        self._version = version
+        self._manifest = None
+        self._mapped = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            from render_cache import code_version
+            self._version = code_version()
+        return self._version
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, self.version)
+
+    def _entries(self) -> dict:
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.path, MANIFEST), encoding='utf-8') as f:
+                    self._manifest = json.load(f)['artifacts']
+                logger.info("📦 Хранилище артефактов %s: %d артефактов", self.path, len(self._manifest))
+            except (OSError, ValueError, KeyError):
+                self._manifest = {}
+        return self._manifest
+
+    def open(self) -> int:
+        """Читает манифест (при прогреве, до форка воркеров). Возвращает число артефактов"""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return len(self._entries())
+
+    def get(self, key: str):
+        """MappedArtifact по ключу или None (хранилище выключено, нет артефакта или файл битый)"""
+        if not self.enabled:
+            return None
+        kind = key.split('/', 1)[0]
+        with self._lock:
+            mapped = self._mapped.get(key)
+            if mapped is not None:
+                return mapped
+            entry = self._entries().get(key)
+            if entry is not None:
+                try:
+                    mapped = MappedArtifact(os.path.join(self.path, entry['file']))
+                except (OSError, ValueError) as e:
+                    logger.warning("⚠️ Артефакт %s не открыт: %s", key, e)
+                else:
+                    if len(mapped) != entry['size']:
+                        logger.warning("⚠️ Артефакт %s обрезан: %d из %d байт", key, len(mapped), entry['size'])
+                        mapped = None
+            if mapped is None:
+                metrics.inc('artifact_store_misses', kind=kind)
+                return None
+            self._mapped[key] = mapped
+        metrics.inc('artifact_store_hits', kind=kind)
+        return mapped
+
+    # ------------------------ сборка (build-artifacts) ------------------------
+    def put(self, key: str, payload: bytes) -> None:
+        """Записывает артефакт (только при сборке; манифест - save())"""
+        if not payload:
+            return
+        entries = self._entries()
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + EXTENSIONS.get(key.split('/', 1)[0], '')
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, f"{name}.{os.getpid()}.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, os.path.join(self.path, name))
+        entries[key] = {'file': name, 'size': len(payload), 'sha256': hashlib.sha256(payload).hexdigest()}
+
+    def save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp = os.path.join(self.path, f"{MANIFEST}.{os.getpid()}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'artifacts': self._entries()}, f, indent=1, sort_keys=True)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+    def prune(self) -> list:
+        """Удаляет каталоги других версий кода"""
+        removed = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name != self.version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(name)
+        return removed
+
+
+# Хранилище процесса: forkserver открывает его при прогреве, воркеры наследуют отображения
+artifact_store = ArtifactStore()
+
+
+def main():
+    entries = artifact_store._entries()
+    print(f"Версия {artifact_store.version}: {artifact_store.path}")
+    for key, entry in sorted(entries.items()):
+        print(f"  {entry['size']:>9} байт  {key}")
+    if not entries:
+        print("  пусто - соберите: python pdf_costructor.py build-artifacts")
+
+
+if __name__ == '__main__':
+    main()
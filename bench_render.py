@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк бэкендов рендеринга: один шаблон, одни данные, бэкенды бок о бок
+   python bench_render.py --template contratto --runs 20
+   python bench_render.py --backends weasyprint,reportlab --json bench.json
+   python bench_render.py --max-peak-ratio 4   # код 1, если пик аллокаций > 4x размера PDF
+Рендер идет в текущем процессе через render_document(..., backend=...),
+первый прогон каждого бэкенда - прогрев и в статистику не входит.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import pdf_costructor
+from pdf_costructor import BACKENDS, monthly_payment
+from stamp_layout import configure_reportlab
+
+
+BENCH_DATA = {
+    'name': 'Mario Rossi',
+    'amount': 15000.0,
+    'tan': 7.86,
+    'taeg': 8.30,
+    'duration': 36,
+    'payment': monthly_payment(15000.0, 36, 7.86),
+}
+
+
+def _render(template_name: str, backend: str) -> bytes:
+    # Пайплайн печатает прогресс на каждый документ - в бенчмарке это шум
+    with contextlib.redirect_stdout(io.StringIO()):
+        return pdf_costructor.render_document(template_name, dict(BENCH_DATA), backend=backend).getvalue()
+
+
+def _page_count(payload: bytes) -> int:
+    from PyPDF2 import PdfReader
+    return len(PdfReader(io.BytesIO(payload)).pages)
+
+
+def bench_backend(template_name: str, backend: str, runs: int, trace_malloc: bool) -> dict:
+    """Замеры одного бэкенда: время (мс), размер, страницы, пик tracemalloc"""
+    selected = pdf_costructor.select_backend(template_name, backend)
+    if selected != backend:
+        return {'backend': backend, 'error': f"шаблон {template_name} не поддерживается"}
+    try:
+        payload = _render(template_name, backend)
+    except Exception as e:
+        return {'backend': backend, 'error': f"{type(e).__name__}: {e}"}
+
+    timings = []
+    peak = 0
+    for _ in range(runs):
+        if trace_malloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+        payload = _render(template_name, backend)
+        timings.append((time.perf_counter() - started) * 1000)
+        if trace_malloc:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'backend': backend,
+        'runs': runs,
+        'mean_ms': round(statistics.mean(timings), 2),
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'min_ms': round(timings[0], 2),
+        'max_ms': round(timings[-1], 2),
+        'bytes': len(payload),
+        'pages': _page_count(payload),
+        'tracemalloc_peak_bytes': peak if trace_malloc else None,
+        'peak_ratio': round(peak / len(payload), 2) if trace_malloc else None,
+    }
+
+
+def format_table(template_name: str, results: list) -> str:
+    lines = [f"Шаблон: {template_name}",
+             f"{'бэкенд':<12} {'p50 мс':>9} {'p95 мс':>9} {'мин мс':>9} {'байт':>10} {'стр.':>5}  пик tracemalloc"]
+    fastest = min((r['p50_ms'] for r in results if 'error' not in r), default=None)
+    for r in results:
+        if 'error' in r:
+            lines.append(f"{r['backend']:<12} ❌ {r['error']}")
+            continue
+        peak = (f"{r['tracemalloc_peak_bytes'] / 1024 / 1024:.1f} МБ (x{r['peak_ratio']} от PDF)"
+                if r['tracemalloc_peak_bytes'] else '-')
+        ratio = f"  x{r['p50_ms'] / fastest:.1f}" if fastest and r['p50_ms'] != fastest else ''
+        lines.append(f"{r['backend']:<12} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['min_ms']:>9.1f} "
+                     f"{r['bytes']:>10} {r['pages']:>5}  {peak}{ratio}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение бэкендов рендеринга PDF")
+    parser.add_argument('--template', default='contratto')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help="через запятую")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--tracemalloc', action='store_true', help="пик аллокаций Python на документ")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--max-peak-ratio', type=float,
+                        help="проверка копирований: пик tracemalloc не больше N размеров PDF (включает --tracemalloc)")
+    args = parser.parse_args()
+    # Как в воркерах после warm_up: без ASCII85
+    configure_reportlab()
+
+    trace_malloc = args.tracemalloc or args.max_peak_ratio is not None
+    results = [bench_backend(args.template, backend.strip(), args.runs, trace_malloc)
+               for backend in args.backends.split(',') if backend.strip()]
+    print(format_table(args.template, results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'template': args.template, 'pid': os.getpid(), 'results': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены: {args.json}")
+    if args.max_peak_ratio is not None:
+        over = [r for r in results if 'error' not in r and r['peak_ratio'] > args.max_peak_ratio]
+        for r in over:
+            print(f"❌ {r['backend']}: пик аллокаций x{r['peak_ratio']} от PDF > x{args.max_peak_ratio:g}")
+        if over:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Несколько ботов в одном процессе
+BOTS_CONFIG - JSON со списком ботов и их настройками; все Application работают
+в одном цикле событий поверх общего прогретого пула рендеринга, кэша и архива:
+N ботов стоят памяти одного процесса, а не N копий WeasyPrint, шрифтов и кэшей.
+Без BOTS_CONFIG бот один и настраивается переменными окружения, как раньше.
+
+   [{"name": "intesa", "token_env": "BOT_TOKEN_INTESA", "brand": "default"},
+    {"name": "acme", "token": "123:abc", "brand": "acme", "admin_ids": [42]}]
+
+   python bot_hosting.py [файл]   — какие боты поднимутся (без токенов)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+from typing import NamedTuple
+
+from chat_state import STATE_DB
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+BOTS_CONFIG = os.getenv("BOTS_CONFIG", "")        # файл со списком ботов; пусто - один бот из окружения
+BOT_NAME = os.getenv("BOT_NAME", "bot")           # имя единственного бота (метки метрик)
+TOKEN = os.getenv("BOT_TOKEN", "YOUR_TOKEN_HERE")
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}  # доступ к /profile и смене /brand
+# Webhook вместо polling: несколько инстансов за балансировщиком делят состояние через STATE_DB
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")        # например https://bot.example.com/telegram
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+
+
+class BotConfig(NamedTuple):
+    """Настройки одного бота"""
+    name: str
+    token: str
+    brand: str = None              # профиль чатов без /brand (None - DEFAULT_BRAND)
+    admin_ids: frozenset = frozenset()
+    state_db: str = STATE_DB       # база состояния диалогов (пусто - в памяти)
+    base_url: str = None           # другой Bot API сервер (иначе TG_BASE_URL)
+    webhook_url: str = ''          # пусто - polling
+    webhook_port: int = WEBHOOK_PORT
+    webhook_secret: str = None
+
+
+def env_config() -> BotConfig:
+    """Единственный бот из переменных окружения"""
+    return BotConfig(BOT_NAME, TOKEN, admin_ids=frozenset(ADMIN_IDS), webhook_url=WEBHOOK_URL,
+                     webhook_secret=WEBHOOK_SECRET)
+
+
+def _state_db(name: str) -> str:
+    """База состояния бота: у каждого своя (id чатов у разных ботов совпадают)"""
+    if not STATE_DB:
+        return ''
+    root, ext = os.path.splitext(STATE_DB)
+    return f"{root}-{name}{ext}"
+
+
+def load_configs(path: str) -> list:
+    """
+    Список BotConfig из JSON файла
+
+    Raises:
+        ValueError: нет токена, повтор имени или порта webhook, неизвестное поле
+    """
+    with open(path, encoding='utf-8') as f:
+        specs = json.load(f)
+    configs, names, ports = [], set(), set()
+    for spec in specs:
+        spec = dict(spec)
+        name = spec.pop('name', None)
+        token_env = spec.pop('token_env', None)
+        token = spec.pop('token', None) or (os.getenv(token_env) if token_env else None)
+        if not name or not token:
+            raise ValueError(f"bot {name or '?'}: name and token (or token_env) are required")
+        if name in names:
+            raise ValueError(f"bot {name}: duplicate name")
+        unknown = set(spec) - set(BotConfig._fields)
+        if unknown:
+            raise ValueError(f"bot {name}: unknown settings {', '.join(sorted(unknown))}")
+        spec['admin_ids'] = frozenset(int(x) for x in spec.get('admin_ids', ()))
+        spec.setdefault('state_db', _state_db(name))
+        config = BotConfig(name, token, **spec)
+        if config.webhook_url:
+            # Каждый Updater поднимает свой веб-сервер
+            if config.webhook_port in ports:
+                raise ValueError(f"bot {name}: webhook_port {config.webhook_port} is already used")
+            ports.add(config.webhook_port)
+        names.add(name)
+        configs.append(config)
+    if not configs:
+        raise ValueError(f"{path}: no bots configured")
+    return configs
+
+
+def bot_configs() -> list:
+    return load_configs(BOTS_CONFIG) if BOTS_CONFIG else [env_config()]
+
+
+async def _start(app, config: BotConfig) -> None:
+    """Запуск одного Application - как run_polling/run_webhook, но без своего цикла событий"""
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    if config.webhook_url:
+        from urllib.parse import urlsplit
+
+        await app.updater.start_webhook(listen='0.0.0.0', port=config.webhook_port,
+                                        url_path=urlsplit(config.webhook_url).path.lstrip('/'),
+                                        webhook_url=config.webhook_url, secret_token=config.webhook_secret)
+    else:
+        await app.updater.start_polling()
+    await app.start()
+
+
+async def _stop(app) -> None:
+    """Остановка в обратном порядке; годится и для Application, запущенного не до конца"""
+    if app.updater and app.updater.running:
+        await app.updater.stop()
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+
+async def serve(bots: list, on_start=None, on_stop=None) -> None:
+    """
+    Запускает ботов [(Application, BotConfig), ...] до SIGINT/SIGTERM
+
+    on_start/on_stop - корутины общих ресурсов (пул, HTTP сервис, архив):
+    они запускаются один раз на процесс, а не на каждого бота. Бот, который
+    не поднялся (например, неверный токен), пропускается с ошибкой в логе.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    if on_start:
+        await on_start()
+    started = []
+    try:
+        for app, config in bots:
+            try:
+                await _start(app, config)
+            except Exception as e:
+                logger.error("💥 Бот %s не запустился: %s", config.name, e)
+                # initialize и post_init могли пройти: закрываем HTTPX клиенты и базу состояния
+                try:
+                    await _stop(app)
+                except Exception as stop_error:
+                    logger.error("💥 Бот %s не остановлен после ошибки запуска: %s", config.name, stop_error)
+                continue
+            started.append((app, config))
+            logger.info("🤖 Бот %s запущен (%s)", config.name, 'webhook' if config.webhook_url else 'polling')
+        if not started:
+            raise RuntimeError("no bot started")
+        await stop.wait()
+    finally:
+        for app, config in reversed(started):
+            try:
+                await _stop(app)
+            except Exception as e:
+                logger.error("💥 Бот %s остановлен с ошибкой: %s", config.name, e)
+        if on_stop:
+            await on_stop()
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else BOTS_CONFIG
+    for config in (load_configs(path) if path else [env_config()]):
+        print(f"{config.name:<16} бренд {config.brand or '-':<12} "
+              f"{'webhook ' + config.webhook_url if config.webhook_url else 'polling'}  "
+              f"состояние {config.state_db or 'в памяти'}  админов {len(config.admin_ids)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Реестр профилей брендов
+Профиль - каталог BRANDS_DIR/<имя>/ с profile.json (название, цвет рамки,
+TAN и TAEG по умолчанию) и файлами, которые заменяют общие: <шаблон>.html,
+layouts/<шаблон>.json и изображения печатей. Чего в каталоге профиля нет,
+берется из корня проекта - профиль default описывает исходный банк целиком.
+Подготовленные шаблоны, схемы печатей с уменьшенными изображениями и overlay
+PDF собираются при первом запросе профиля и живут в LRU на BRAND_CACHE_PROFILES
+профилей: один деплой обслуживает много брендов, не держа в памяти все.
+
+   python brands.py             — список профилей
+   python brands.py <профиль>   — откуда берутся файлы профиля
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple
+
+import metrics
+from stamp_layout import BASE_DIR, LAYOUTS_DIR
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+BRANDS_DIR = os.getenv("BRANDS_DIR", os.path.join(BASE_DIR, "brands"))
+DEFAULT_BRAND = os.getenv("DEFAULT_BRAND", "default")
+BRAND_CACHE_PROFILES = int(os.getenv("BRAND_CACHE_PROFILES", "4"))   # профилей с подготовленными артефактами
+
+# Цвет рамки в HTML шаблонах и CSS fix_html_layout - заменяется цветом профиля
+TEMPLATE_BORDER_COLOR = '#05aac1'
+
+# Значения, которых нет в profile.json
+PROFILE_DEFAULTS = {
+    'title': 'Intesa Sanpaolo',
+    'border_color': TEMPLATE_BORDER_COLOR,
+    'tan': 7.86,
+    'taeg': 8.30,
+}
+
+PROFILE_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+
+class UnknownBrand(ValueError):
+    """Профиля с таким именем нет"""
+
+
+class BrandProfile(NamedTuple):
+    """Профиль бренда из profile.json"""
+    name: str
+    directory: str
+    title: str
+    border_color: str
+    tan: float
+    taeg: float
+
+    def find(self, relative: str, fallback: str = None) -> str:
+        """Файл профиля, если он есть в каталоге, иначе общий (fallback или корень проекта)"""
+        path = os.path.join(self.directory, relative)
+        if os.path.exists(path):
+            return path
+        return fallback or os.path.join(BASE_DIR, relative)
+
+    def layout_path(self, template_name: str) -> str:
+        relative = os.path.join('layouts', f'{template_name}.json')
+        return self.find(relative, os.path.join(LAYOUTS_DIR, f'{template_name}.json'))
+
+    @property
+    def asset_dirs(self) -> tuple:
+        """Где искать изображения схем: каталог профиля, затем корень"""
+        return self.directory, BASE_DIR
+
+
+def brand_name(brand: str = None) -> str:
+    """Имя профиля: None - DEFAULT_BRAND, регистр не важен"""
+    return (brand or DEFAULT_BRAND).strip().lower()
+
+
+@lru_cache(maxsize=256)
+def _load_profile(name: str) -> BrandProfile:
+    directory = os.path.join(BRANDS_DIR, name)
+    path = os.path.join(directory, 'profile.json')
+    if not PROFILE_NAME.match(name) or not os.path.exists(path):
+        if name == DEFAULT_BRAND:
+            # Без каталога brands - исходный бренд из корня проекта
+            return BrandProfile(name, BASE_DIR, **PROFILE_DEFAULTS)
+        raise UnknownBrand(f"unknown brand profile: {name}")
+    with open(path, encoding='utf-8') as f:
+        spec = {**PROFILE_DEFAULTS, **json.load(f)}
+    return BrandProfile(name, directory, spec['title'], spec['border_color'].lower(),
+                        float(spec['tan']), float(spec['taeg']))
+
+
+def get_profile(brand: str = None) -> BrandProfile:
+    """
+    Профиль бренда
+
+    Raises:
+        UnknownBrand: нет каталога BRANDS_DIR/<brand> с profile.json
+    """
+    return _load_profile(brand_name(brand))
+
+
+def list_profiles() -> list:
+    try:
+        names = sorted(name for name in os.listdir(BRANDS_DIR)
+                       if PROFILE_NAME.match(name) and os.path.exists(os.path.join(BRANDS_DIR, name, 'profile.json')))
+    except OSError:
+        names = []
+    return names or [DEFAULT_BRAND]
+
+
+@lru_cache(maxsize=256)
+def profile_digest(profile: BrandProfile) -> str:
+    """
+    Хэш файлов каталога профиля - часть ключа артефактов в artifact_store
+    (общие файлы из корня учитывает версия кода)
+    """
+    h = hashlib.sha256(profile.name.encode())
+    if profile.directory == BASE_DIR:
+        return h.hexdigest()[:16]
+    for root, dirs, files in os.walk(profile.directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            h.update(os.path.relpath(path, profile.directory).encode())
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def profile_key(profile: BrandProfile, kind: str, template_name: str) -> str:
+    """Ключ артефакта профиля в artifact_store"""
+    return f"{kind}/{profile.name}/{template_name}/{profile_digest(profile)}"
+
+
+class CompiledProfile:
+    """Артефакты одного профиля: ключ -> значение, собирается при первом запросе"""
+
+    def __init__(self, profile: BrandProfile):
+        self.profile = profile
+        self._items = {}
+        # RLock: overlay собирается из схемы того же профиля
+        self._lock = threading.RLock()
+
+    def get(self, key: tuple, build):
+        with self._lock:
+            if key not in self._items:
+                metrics.inc('brand_artifact_builds', brand=self.profile.name, kind=key[0])
+                self._items[key] = build(self.profile)
+            return self._items[key]
+
+
+class BrandCache:
+    """LRU подготовленных профилей: вытесненный профиль освобождает все свои артефакты"""
+
+    def __init__(self, max_profiles: int = BRAND_CACHE_PROFILES):
+        self.max_profiles = max(max_profiles, 1)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compiled(self, profile: BrandProfile) -> CompiledProfile:
+        with self._lock:
+            item = self._items.get(profile.name)
+            if item is not None:
+                self._items.move_to_end(profile.name)
+                return item
+            item = self._items[profile.name] = CompiledProfile(profile)
+            while len(self._items) > self.max_profiles:
+                evicted, _item = self._items.popitem(last=False)
+                metrics.inc('brand_cache_evictions')
+                logger.info("♻️ Профиль %s вытеснен из кэша брендов", evicted)
+            metrics.set_gauge('brand_cache_profiles', len(self._items))
+        return item
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            metrics.set_gauge('brand_cache_profiles', 0)
+
+
+# Кэш процесса: в каждом воркере свой, прогрев заполняет его профилем по умолчанию
+brand_cache = BrandCache()
+
+
+def artifact(brand: str, key: tuple, build):
+    """
+    Подготовленный артефакт профиля (шаблон, схема, overlay)
+
+    Args:
+        brand (str): профиль (None - DEFAULT_BRAND)
+        key (tuple): (вид, шаблон), например ('overlay', 'contratto')
+        build: функция (BrandProfile) -> значение, вызывается один раз на профиль в кэше
+    """
+    return brand_cache.compiled(get_profile(brand)).get(key, build)
+
+
+def main():
+    if len(sys.argv) < 2:
+        for name in list_profiles():
+            profile = get_profile(name)
+            print(f"{name:<16} {profile.title:<30} рамка {profile.border_color}  TAN {profile.tan:.2f}%  "
+                  f"TAEG {profile.taeg:.2f}%")
+        return
+    profile = get_profile(sys.argv[1])
+    print(f"{profile.name}: {profile.title} ({profile.directory})")
+    for template_name in ('contratto', 'garanzia', 'carta'):
+        print(f"  {template_name}: {profile.find(f'{template_name}.html')}, {profile.layout_path(template_name)}")
+
+
+if __name__ == '__main__':
+    main()
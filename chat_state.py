@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Состояние диалогов бота вне процесса
+context.user_data, chat_data и шаги ConversationHandler хранятся в SQLite
+(STATE_DB) компактными JSON записями, а не только в памяти процесса. Перед
+апдейтом инстанс берет аренду чата - строку leases с владельцем и сроком:
+два апдейта одного чата не обрабатываются одновременно ни в одном процессе,
+ни в разных инстансах за балансировщиком. Под арендой данные чата
+перечитываются из базы и записываются до ее снятия, поэтому рестарт или
+соседний инстанс продолжают диалог с того же шага.
+
+   python chat_state.py   — активные аренды и число записей
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from telegram.ext import Application, BasePersistence, ConversationHandler, PersistenceInput
+
+import metrics
+from telegram_transport import ChatSerializedApplication
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+STATE_DB = os.getenv("STATE_DB", "state.sqlite3")              # пусто = состояние только в памяти процесса
+STATE_LEASE_S = float(os.getenv("STATE_LEASE_S", "60"))        # срок аренды чата (упавший инстанс ее не держит)
+STATE_LEASE_POLL_S = float(os.getenv("STATE_LEASE_POLL_S", "0.05"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    kind       TEXT NOT NULL,
+    id         INTEGER NOT NULL,
+    data       TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS conversations (
+    name       TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    chat_id    INTEGER,
+    state      TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversations_chat ON conversations (name, chat_id);
+CREATE TABLE IF NOT EXISTS leases (
+    chat_id    INTEGER PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def _dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _conversation_key(key: tuple) -> str:
+    return _dump(list(key))
+
+
+class StateStore:
+    """
+    Записи SQLite: user/chat данные, состояния диалогов и аренды чатов
+
+    Как и в DocumentArchive, все обращения идут через один поток: соединение
+    не делится между потоками, а диск не блокирует цикл событий.
+    """
+
+    def __init__(self, path: str = STATE_DB):
+        self.path = path
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='chat-state')
+        self._db = None
+
+    # ------------------------ поток состояния ---------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # isolation_level=None: транзакции аренды открываются явно (BEGIN IMMEDIATE)
+            self._db = sqlite3.connect(self.path, timeout=STATE_LEASE_S, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+        return self._db
+
+    def load(self, kind: str, record_id: int):
+        row = self._connect().execute('SELECT data FROM records WHERE kind = ? AND id = ?',
+                                      (kind, record_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, kind: str, record_id: int, data) -> None:
+        """Записывает данные; None или пустой dict удаляют запись"""
+        db = self._connect()
+        if data:
+            db.execute('INSERT OR REPLACE INTO records (kind, id, data, updated_at) VALUES (?, ?, ?, ?)',
+                       (kind, record_id, _dump(data), time.time()))
+        else:
+            db.execute('DELETE FROM records WHERE kind = ? AND id = ?', (kind, record_id))
+
+    def conversations(self, name: str, chat_id: int = None) -> dict:
+        """Состояния диалога name: все или одного чата"""
+        query, params = 'SELECT key, state FROM conversations WHERE name = ?', (name,)
+        if chat_id is not None:
+            query, params = query + ' AND chat_id = ?', (name, chat_id)
+        return {tuple(json.loads(key)): json.loads(state)
+                for key, state in self._connect().execute(query, params)}
+
+    def save_conversation(self, name: str, key: tuple, state) -> None:
+        db = self._connect()
+        if state is None:
+            db.execute('DELETE FROM conversations WHERE name = ? AND key = ?', (name, _conversation_key(key)))
+        else:
+            # Ключ ConversationHandler начинается с chat_id (per_chat=True) - по нему идет перечитывание
+            chat_id = key[0] if key and isinstance(key[0], int) else None
+            db.execute('INSERT OR REPLACE INTO conversations (name, key, chat_id, state, updated_at)'
+                       ' VALUES (?, ?, ?, ?, ?)', (name, _conversation_key(key), chat_id, _dump(state), time.time()))
+
+    def try_lease(self, chat_id: int, owner: str, ttl: float) -> bool:
+        """Берет (или продлевает свою) аренду чата, если она свободна или истекла"""
+        now = time.time()
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('INSERT INTO leases (chat_id, owner, expires_at) VALUES (?, ?, ?)'
+                       ' ON CONFLICT (chat_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at'
+                       ' WHERE leases.owner = excluded.owner OR leases.expires_at < ?',
+                       (chat_id, owner, now + ttl, now))
+            acquired = db.execute('SELECT changes()').fetchone()[0] > 0
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return acquired
+
+    def release(self, chat_id: int, owner: str) -> None:
+        self._connect().execute('DELETE FROM leases WHERE chat_id = ? AND owner = ?', (chat_id, owner))
+
+    def leases(self) -> list:
+        return self._connect().execute('SELECT chat_id, owner, expires_at FROM leases'
+                                       ' ORDER BY expires_at').fetchall()
+
+    def counts(self) -> dict:
+        db = self._connect()
+        counts = dict(db.execute('SELECT kind, COUNT(*) FROM records GROUP BY kind').fetchall())
+        counts['conversations'] = db.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+        return counts
+
+    # ------------------------ вызовы из цикла событий -------------------------
+    def call(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def close(self) -> None:
+        def _close():
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        self.executor.submit(_close)
+        self.executor.shutdown(wait=True)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistence python-telegram-bot поверх StateStore
+
+    user_data и chat_data не грузятся целиком при старте: запись читается
+    при первом апдейте пользователя (refresh_*) и перечитывается на каждом
+    апдейте - ее мог изменить другой инстанс. bot_data и callback_data не
+    хранятся: бот их не использует.
+    """
+
+    def __init__(self, path: str = STATE_DB):
+        super().__init__(PersistenceInput(bot_data=False, callback_data=False), update_interval=STATE_LEASE_S / 2)
+        self.store = StateStore(path)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._reload_unsupported = set()      # диалоги, для которых перечитывание недоступно
+
+    # ------------------------ данные пользователей и чатов --------------------
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        await self._refresh('user', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        await self._refresh('chat', chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def _refresh(self, kind: str, record_id: int, data: dict) -> None:
+        # Записи нет - данные пусты (save удаляет пустую запись) или их очистил другой инстанс
+        stored = await self.store.call(self.store.load, kind, record_id) or {}
+        if stored != data:
+            data.clear()
+            data.update(stored)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        await self.store.call(self.store.save, 'user', user_id, dict(data))
+        metrics.inc('chat_state_writes', kind='user')
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self.store.call(self.store.save, 'chat', chat_id, dict(data))
+        metrics.inc('chat_state_writes', kind='chat')
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self.store.call(self.store.save, 'user', user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self.store.call(self.store.save, 'chat', chat_id, None)
+
+    # ------------------------ состояния диалогов -------------------------------
+    async def get_conversations(self, name: str) -> dict:
+        return await self.store.call(self.store.conversations, name)
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        await self.store.call(self.store.save_conversation, name, key, new_state)
+        metrics.inc('chat_state_writes', kind='conversation')
+
+    async def reload_conversations(self, application: Application, chat_id: int) -> None:
+        """
+        Шаги диалогов чата из базы: другой инстанс мог продвинуть или закончить диалог
+
+        Публичного API для этого в python-telegram-bot нет: шаги лежат в
+        ConversationHandler._conversations. С persistent=True это TrackingDict,
+        который Application сам подставляет в initialize (20.x, версия
+        закреплена в requirements.txt); update_no_track меняет его, не помечая
+        записи к обратной записи в базу. Если устройство поменяется, перечитывание
+        отключается с предупреждением: диалоги работают по памяти процесса,
+        как без общей базы.
+        """
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if not isinstance(handler, ConversationHandler) or not handler.persistent:
+                    continue
+                conversations = getattr(handler, '_conversations', None)
+                if not hasattr(conversations, 'update_no_track'):
+                    if handler.name not in self._reload_unsupported:
+                        self._reload_unsupported.add(handler.name)
+                        logger.warning("⚠️ Диалог %s не перечитывается: другое устройство ConversationHandler", handler.name)
+                    metrics.inc('chat_state_reload_unsupported')
+                    continue
+                stored = await self.store.call(self.store.conversations, handler.name, chat_id)
+                for key in [key for key in conversations if key and key[0] == chat_id and key not in stored]:
+                    conversations.pop(key, None)
+                conversations.update_no_track(stored)
+
+    async def flush(self) -> None:
+        await self.store.call(lambda: None)
+
+    def close(self) -> None:
+        self.store.close()
+
+    # ------------------------ аренда чата --------------------------------------
+    @asynccontextmanager
+    async def lease(self, chat_id: int):
+        """
+        Аренда чата на время апдейта между инстансами - строка leases до
+        STATE_LEASE_S (дольше ждать нечего: аренда упавшего инстанса к этому
+        времени истекает). Внутри процесса апдейты чата уже идут по очереди
+        (ChatSerializedApplication): владелец аренды у процесса один. Пока апдейт
+        обрабатывается, аренда продлевается каждые STATE_LEASE_S / 3:
+        рендеринг и загрузка документа могут идти дольше ее срока.
+        """
+        started = time.perf_counter()
+        try:
+            while not await self.store.call(self.store.try_lease, chat_id, self.owner, STATE_LEASE_S):
+                metrics.inc('chat_state_lease_waits')
+                await asyncio.sleep(STATE_LEASE_POLL_S)
+            metrics.observe('chat_state_lease_seconds', time.perf_counter() - started)
+            renewal = asyncio.create_task(self._renew(chat_id))
+            try:
+                yield
+            finally:
+                renewal.cancel()
+                try:
+                    await renewal
+                except asyncio.CancelledError:
+                    pass
+        finally:
+            await self.store.call(self.store.release, chat_id, self.owner)
+
+    async def _renew(self, chat_id: int) -> None:
+        """Продлевает свою аренду, пока апдейт чата не обработан"""
+        while True:
+            await asyncio.sleep(STATE_LEASE_S / 3)
+            try:
+                renewed = await self.store.call(self.store.try_lease, chat_id, self.owner, STATE_LEASE_S)
+            except Exception as e:
+                logger.warning("⚠️ Аренда чата %s не продлена: %s", chat_id, e)
+                metrics.inc('chat_state_lease_renew_failed')
+                continue
+            if not renewed:
+                # Аренда истекла и уже у другого инстанса (цикл событий стоял дольше срока)
+                logger.warning("⚠️ Аренда чата %s перешла к другому инстансу", chat_id)
+                metrics.inc('chat_state_lease_lost')
+                return
+            metrics.inc('chat_state_lease_renewals')
+
+
+class LeasedApplication(ChatSerializedApplication):
+    """
+    ChatSerializedApplication, который обрабатывает апдейт под арендой чата:
+    перечитывает шаги диалога, обрабатывает и записывает состояние до снятия
+    аренды, не дожидаясь периодического update_persistence
+    """
+
+    async def process_chat_update(self, chat_id: int, update: object) -> None:
+        if not isinstance(self.persistence, SQLitePersistence):
+            await super().process_chat_update(chat_id, update)
+            return
+        async with self.persistence.lease(chat_id):
+            await self.persistence.reload_conversations(self, chat_id)
+            await super().process_chat_update(chat_id, update)
+            await self.update_persistence()
+
+
+def configure_state(builder, path: str = STATE_DB):
+    """
+    Подключает SQLitePersistence и LeasedApplication к ApplicationBuilder (path пусто - без изменений)
+
+    LeasedApplication - наследник ChatSerializedApplication из configure_builder:
+    очередь апдейтов чата в процессе сохраняется.
+    """
+    if not path:
+        return builder
+    return builder.persistence(SQLitePersistence(path)).application_class(LeasedApplication)
+
+
+def main():
+    store = StateStore()
+    try:
+        now = time.time()
+        print(f"Состояние {store.path}: {store.counts()}")
+        for chat_id, owner, expires_at in store.leases():
+            print(f"  чат {chat_id}: {owner}, {'истекла' if expires_at < now else f'еще {expires_at - now:.1f} с'}")
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
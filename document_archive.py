@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Архив отправленных документов
+PDF хранятся по хэшу содержимого (content-addressed) в ARCHIVE_DIR/objects,
+сжатые zstd (если установлен zstandard) или deflate. Индекс SQLite по имени
+клиента, сумме, шаблону, дате и хэшу дает выборку по индексу и на сотнях
+тысяч документов. Архив общий для ботов процесса, но каждая строка помечена
+ботом, и выборка идет только по документам своего бота. Запись идет в отдельном потоке уже после отправки, чтобы
+не задерживать ответ; file_id Telegram сохраняется для повторной отправки
+без загрузки файла.
+
+   python document_archive.py <имя>   — последние документы клиента
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")          # пусто = архив выключен
+ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "auto")         # auto | zstd | deflate
+ARCHIVE_LEVEL = int(os.getenv("ARCHIVE_LEVEL", "6"))
+ARCHIVE_RESULTS = int(os.getenv("ARCHIVE_RESULTS", "3"))   # документов на запрос /storico
+# Бот документов, сохраненных до колонки bot (архив одного бота)
+ARCHIVE_LEGACY_BOT = os.getenv("ARCHIVE_LEGACY_BOT", os.getenv("BOT_NAME", "bot"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id          INTEGER PRIMARY KEY,
+    sha256      TEXT NOT NULL,
+    template    TEXT NOT NULL,
+    client_name TEXT NOT NULL,
+    name_key    TEXT NOT NULL,
+    amount      REAL,
+    created_at  REAL NOT NULL,
+    chat_id     INTEGER,
+    filename    TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    degraded    TEXT,
+    file_id     TEXT,
+    bot         TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS documents_name ON documents (name_key, created_at);
+CREATE INDEX IF NOT EXISTS documents_chat_name ON documents (chat_id, name_key, created_at);
+CREATE INDEX IF NOT EXISTS documents_template ON documents (template, created_at);
+CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256);
+CREATE TABLE IF NOT EXISTS objects (
+    sha256      TEXT PRIMARY KEY,
+    codec       TEXT NOT NULL,
+    stored_size INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Колонка bot в архиве, созданном до нее, добавляется миграцией - индексы после нее
+BOT_SCHEMA = """
+CREATE INDEX IF NOT EXISTS documents_bot_name ON documents (bot, name_key, created_at);
+CREATE INDEX IF NOT EXISTS documents_bot_chat_name ON documents (bot, chat_id, name_key, created_at);
+CREATE INDEX IF NOT EXISTS documents_bot_name_amount ON documents (bot, name_key, amount, created_at);
+"""
+
+# Верхняя граница диапазона префикса: name_key >= p AND name_key < p || MAX_CHAR
+MAX_CHAR = '\U0010ffff'
+
+
+class ArchivedDocument(NamedTuple):
+    """Строка индекса"""
+    id: int
+    sha256: str
+    template: str
+    client_name: str
+    amount: float
+    created_at: float
+    chat_id: int
+    filename: str
+    size: int
+    degraded: str
+    file_id: str
+    bot: str
+
+
+COLUMNS = ', '.join(ArchivedDocument._fields)
+
+
+def name_key(name: str) -> str:
+    """Ключ поиска по имени: без регистра и лишних пробелов"""
+    return ' '.join(name.split()).casefold()
+
+
+def _codec() -> str:
+    if ARCHIVE_CODEC in ('zstd', 'auto'):
+        try:
+            import zstandard  # noqa: F401
+            return 'zstd'
+        except ImportError:
+            if ARCHIVE_CODEC == 'zstd':
+                logger.warning("⚠️ zstandard не установлен - архив сжимается deflate")
+    return 'deflate'
+
+
+def _compress(payload: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=ARCHIVE_LEVEL).compress(payload)
+    return zlib.compress(payload, ARCHIVE_LEVEL)
+
+
+def _decompress(blob: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+
+class DocumentArchive:
+    """
+    Архив: объекты на диске и индекс SQLite
+
+    Все обращения к SQLite идут через один поток - соединение не делится
+    между потоками, а запись не блокирует цикл событий бота.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self.codec = _codec()
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='archive')
+        self._db = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    # ------------------------ поток архива ------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.join(self.directory, 'objects'), exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'))
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.executescript(SCHEMA)
+            self._migrate(self._db)
+        return self._db
+
+    @staticmethod
+    def _migrate(db: sqlite3.Connection) -> None:
+        columns = {row[1] for row in db.execute('PRAGMA table_info(documents)')}
+        if 'bot' not in columns:
+            with db:
+                db.execute("ALTER TABLE documents ADD COLUMN bot TEXT NOT NULL DEFAULT ''")
+                db.execute('UPDATE documents SET bot = ?', (ARCHIVE_LEGACY_BOT,))
+            logger.info("🗂 Архив: документы без бота отнесены к %s", ARCHIVE_LEGACY_BOT)
+        db.executescript(BOT_SCHEMA)
+
+    def _object_path(self, sha256: str, codec: str) -> str:
+        suffix = '.zst' if codec == 'zstd' else '.z'
+        return os.path.join(self.directory, 'objects', sha256[:2], sha256 + suffix)
+
+    def _write_object(self, db: sqlite3.Connection, sha256: str, payload: bytes) -> None:
+        if db.execute('SELECT 1 FROM objects WHERE sha256 = ?', (sha256,)).fetchone():
+            metrics.inc('archive_dedup_hits')
+            return
+        blob = _compress(payload, self.codec)
+        path = self._object_path(sha256, self.codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл: оборванная запись не оставит битый объект
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        db.execute('INSERT INTO objects (sha256, codec, stored_size) VALUES (?, ?, ?)',
+                   (sha256, self.codec, len(blob)))
+        metrics.observe('archive_stored_bytes', len(blob))
+
+    def store(self, template_name: str, data: dict, payload: bytes, filename: str, chat_id: int = None,
+              file_id: str = None, degraded: str = None, bot: str = '') -> int:
+        """Сохраняет документ и строку индекса. Возвращает id строки"""
+        started = time.perf_counter()
+        sha256 = hashlib.sha256(payload).hexdigest()
+        db = self._connect()
+        with db:
+            self._write_object(db, sha256, payload)
+            cursor = db.execute(
+                'INSERT INTO documents (sha256, template, client_name, name_key, amount, created_at, chat_id,'
+                ' filename, size, degraded, file_id, bot) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (sha256, template_name, data.get('name') or '', name_key(data.get('name') or ''),
+                 data.get('amount'), time.time(), chat_id, filename, len(payload), degraded, file_id, bot),
+            )
+        metrics.observe('archive_store_seconds', time.perf_counter() - started)
+        return cursor.lastrowid
+
+    def find(self, name: str, chat_id: int = None, limit: int = ARCHIVE_RESULTS, bot: str = None,
+             amount: float = None) -> list:
+        """
+        Последние документы клиента (chat_id=None - по всем чатам, bot=None - всех ботов,
+        amount=None - на любую сумму)
+
+        Сначала точное совпадение имени - индекс (name_key, created_at) или
+        (bot, name_key, amount, created_at) отдает строки уже по дате; если
+        таких нет, ищется префикс имени.
+        """
+        key = name_key(name)
+        scope, params = ('chat_id = ? AND ', (chat_id,)) if chat_id is not None else ('', ())
+        if bot is not None:
+            scope, params = 'bot = ? AND ' + scope, (bot,) + params
+        if amount is not None:
+            scope, params = scope + 'amount = ? AND ', params + (amount,)
+        db = self._connect()
+        rows = db.execute(f'SELECT {COLUMNS} FROM documents WHERE {scope}name_key = ?'
+                          ' ORDER BY created_at DESC LIMIT ?', params + (key, limit)).fetchall()
+        if not rows:
+            rows = db.execute(f'SELECT {COLUMNS} FROM documents WHERE {scope}name_key >= ? AND name_key < ?'
+                              ' ORDER BY created_at DESC LIMIT ?', params + (key, key + MAX_CHAR, limit)).fetchall()
+        return [ArchivedDocument(*row) for row in rows]
+
+    def load(self, sha256: str) -> bytes:
+        """Байты PDF из хранилища объектов"""
+        row = self._connect().execute('SELECT codec FROM objects WHERE sha256 = ?', (sha256,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(sha256)
+        with open(self._object_path(sha256, row[0]), 'rb') as f:
+            payload = _decompress(f.read(), row[0])
+        if hashlib.sha256(payload).hexdigest() != sha256:
+            raise ValueError(f"archived object {sha256} is corrupted")
+        return payload
+
+    def set_file_id(self, document_id: int, file_id: str) -> None:
+        with self._connect() as db:
+            db.execute('UPDATE documents SET file_id = ? WHERE id = ?', (file_id, document_id))
+
+    # ------------------------ вызовы из цикла событий -------------------------
+    def _call(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def store_later(self, *args, **kwargs) -> None:
+        """Запись после отправки: не ждет диска, ошибки только в лог"""
+        if not self.enabled:
+            return
+
+        def _store():
+            try:
+                self.store(*args, **kwargs)
+            except Exception as e:
+                metrics.inc('archive_errors')
+                logger.warning("⚠️ Документ не сохранен в архив: %s", e)
+        self.executor.submit(_store)
+
+    async def find_async(self, name: str, chat_id: int = None, limit: int = ARCHIVE_RESULTS,
+                         bot: str = None, amount: float = None) -> list:
+        return await self._call(self.find, name, chat_id, limit, bot, amount)
+
+    async def load_async(self, sha256: str) -> bytes:
+        return await self._call(self.load, sha256)
+
+    async def set_file_id_async(self, document_id: int, file_id: str) -> None:
+        await self._call(self.set_file_id, document_id, file_id)
+
+    def close(self) -> None:
+        def _close():
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        self.executor.submit(_close)
+        self.executor.shutdown(wait=True)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Использование: python document_archive.py <имя клиента>")
+        return
+    archive = DocumentArchive()
+    try:
+        for doc in archive.find(' '.join(sys.argv[1:]), limit=20):
+            print(f"{time.strftime('%d/%m/%Y %H:%M', time.localtime(doc.created_at))}  {doc.template:<10} "
+                  f"{doc.bot:<10} {doc.client_name:<30} {doc.amount or 0:>12.2f}  {doc.size:>8} байт  {doc.sha256[:12]}"
+                  f"{'  ' + doc.degraded if doc.degraded else ''}")
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    main()
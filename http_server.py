@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Минимальный HTTP/1.1 сервер на asyncio streams
+Без внешних зависимостей: keep-alive, Content-Length, потоковая отдача тела.
+Используется сервисом рендеринга и заглушкой Bot API для нагрузочных тестов.
+"""
+
+import asyncio
+import json
+import logging
+from typing import NamedTuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_LINES = 100
+MAX_BODY_BYTES = 50 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+REASONS = {
+    200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 411: 'Length Required', 413: 'Payload Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+
+class Request(NamedTuple):
+    """Разобранный HTTP запрос"""
+    method: str
+    path: str
+    query: dict
+    headers: dict  # имена заголовков в нижнем регистре
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body or b'{}')
+
+
+class Response(NamedTuple):
+    """HTTP ответ; body - bytes, bytearray или memoryview"""
+    status: int = 200
+    body: object = b''
+    headers: dict = {}
+
+
+def json_response(payload, status: int = 200, headers: dict = None) -> Response:
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return Response(status, body, {'Content-Type': 'application/json; charset=utf-8', **(headers or {})})
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = ''):
+        super().__init__(message or REASONS.get(status, ''))
+        self.status = status
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    """Читает один запрос из соединения. None если клиент закрыл соединение"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _version = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, 'malformed request line')
+
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HTTPError(400, 'too many headers')
+
+    body = b''
+    if 'content-length' in headers:
+        value = headers['content-length']
+        if not (value.isascii() and value.isdigit()):   # отрицательная длина и мусор - 400, а не обрыв
+            raise HTTPError(400, 'invalid Content-Length')
+        length = int(value)
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413)
+        body = await reader.readexactly(length)
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        raise HTTPError(411, 'chunked request bodies are not supported')
+
+    parts = urlsplit(target)
+    return Request(method.upper(), unquote(parts.path), dict(parse_qsl(parts.query)), headers, body)
+
+
+async def _write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool,
+                          head_only: bool = False) -> None:
+    body = memoryview(response.body) if response.body else memoryview(b'')
+    lines = [f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}"]
+    headers = dict(response.headers)
+    if response.status != 304:
+        headers.setdefault('Content-Length', str(body.nbytes))
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    if not head_only and response.status != 304:
+        # Отдаем тело частями без копирования всего буфера
+        for offset in range(0, body.nbytes, CHUNK_SIZE):
+            writer.write(body[offset:offset + CHUNK_SIZE])
+            await writer.drain()
+    await writer.drain()
+
+
+async def serve(handler, host: str, port: int) -> asyncio.AbstractServer:
+    """
+    Запускает сервер
+
+    Args:
+        handler: async функция (Request) -> Response
+        host (str): адрес
+        port (int): порт (0 = любой свободный)
+
+    Returns:
+        asyncio.AbstractServer: сервер (порт в server.sockets[0].getsockname())
+    """
+    async def _connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HTTPError as e:
+                    await _write_response(writer, json_response({'error': str(e)}, e.status), False)
+                    break
+                if request is None:
+                    break
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                try:
+                    response = await handler(request)
+                except HTTPError as e:
+                    response = json_response({'error': str(e)}, e.status)
+                except Exception as e:
+                    logger.exception("Ошибка обработки %s %s", request.method, request.path)
+                    response = json_response({'error': f"{type(e).__name__}: {e}"}, 500)
+                await _write_response(writer, response, keep_alive, request.method == 'HEAD')
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Остановка цикла с открытым keep-alive соединением - завершаемся тихо
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(_connection, host, port)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота с заглушкой Telegram Bot API
+Поднимает локальный фейковый Bot API, направляет на него бота через base_url и
+прогоняет N пользователей по сценарию /start -> имя -> сумма -> выбор срока
+с заданной интенсивностью прихода. Отчет (JSON) можно сравнивать между релизами:
+
+    python loadtest.py --users 50 --rate 2 --out report.json
+    python loadtest.py --users 50 --rate 2 --compare report.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import subprocess
+import tempfile
+import time
+from urllib.parse import parse_qsl
+
+from http_server import Response, json_response, serve
+
+
+logger = logging.getLogger(__name__)
+
+FAKE_TOKEN = "123456:LOADTEST"
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot'}
+
+
+def _parse_multipart(body: bytes, content_type: str) -> dict:
+    """Разбирает multipart/form-data: имя поля -> (байты, имя файла)"""
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+    fields = {}
+    for part in body.split(b'--' + boundary):
+        if b'\r\n\r\n' not in part:
+            continue
+        head, content = part.split(b'\r\n\r\n', 1)
+        disposition = head.decode('latin-1')
+        name = disposition.split('name="', 1)[1].split('"', 1)[0] if 'name="' in disposition else ''
+        filename = disposition.split('filename="', 1)[1].split('"', 1)[0] if 'filename="' in disposition else None
+        fields[name] = (content[:-2] if content.endswith(b'\r\n') else content, filename)
+    return fields
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: отдает апдейты long polling и записывает ответы бота"""
+
+    def __init__(self):
+        self.updates = []
+        self.update_id = 0
+        self.message_id = 0
+        self.new_update = asyncio.Condition()
+        self.waiters = {}  # chat_id -> asyncio.Queue ответов бота
+        self.server = None
+
+    def _message(self, chat_id: int, **extra) -> dict:
+        self.message_id += 1
+        return {'message_id': self.message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private', 'first_name': f'User{chat_id}'}, **extra}
+
+    async def push_text(self, chat_id: int, text: str) -> None:
+        """Пользователь пишет боту"""
+        message = self._message(chat_id, text=text,
+                                **{'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'}})
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        async with self.new_update:
+            self.update_id += 1
+            self.updates.append({'update_id': self.update_id, 'message': message})
+            self.new_update.notify_all()
+
+    async def push_callback(self, chat_id: int, data: str) -> None:
+        """Пользователь нажимает кнопку inline-клавиатуры"""
+        user = {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'}
+        query = {'id': str(self.update_id + 1), 'from': user, 'chat_instance': str(chat_id), 'data': data,
+                 'message': self._message(chat_id, text='preview', **{'from': BOT_USER})}
+        async with self.new_update:
+            self.update_id += 1
+            self.updates.append({'update_id': self.update_id, 'callback_query': query})
+            self.new_update.notify_all()
+
+    def replies(self, chat_id: int) -> asyncio.Queue:
+        return self.waiters.setdefault(chat_id, asyncio.Queue())
+
+    def _params(self, request) -> dict:
+        content_type = request.headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            return {name: value for name, value in _parse_multipart(request.body, content_type).items()}
+        if content_type.startswith('application/json'):
+            return request.json()
+        return dict(parse_qsl(request.body.decode('utf-8')))
+
+    async def handle(self, request) -> Response:
+        method = request.path.rsplit('/', 1)[-1]
+        params = self._params(request)
+
+        if method == 'getMe':
+            return json_response({'ok': True, 'result': BOT_USER})
+        if method in ('deleteWebhook', 'setMyCommands', 'answerCallbackQuery', 'close', 'logOut'):
+            return json_response({'ok': True, 'result': True})
+        if method == 'getUpdates':
+            return json_response({'ok': True, 'result': await self._get_updates(params)})
+        if method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            message = self._message(chat_id, text=params.get('text', ''))
+            self.replies(chat_id).put_nowait(('message', time.perf_counter(), message['text'], 0))
+            return json_response({'ok': True, 'result': message})
+        if method == 'sendDocument':
+            chat_id = int(params['chat_id'][0])
+            document, filename = params['document']
+            message = self._message(chat_id, document={
+                'file_id': f'file{self.message_id}', 'file_unique_id': f'u{self.message_id}',
+                'file_name': filename, 'file_size': len(document)})
+            self.replies(chat_id).put_nowait(('document', time.perf_counter(), filename, len(document)))
+            return json_response({'ok': True, 'result': message})
+        return json_response({'ok': True, 'result': True})
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        async with self.new_update:
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self.new_update.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return list(self.updates)
+
+    async def start(self) -> str:
+        self.server = await serve(self.handle, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/bot"
+
+    async def stop(self) -> None:
+        self.server.close()
+
+
+def _rss_of(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+async def _sample_rss(samples: list, stop: asyncio.Event) -> None:
+    """RSS бота и всех воркеров рендеринга раз в 0.5 с"""
+    while not stop.is_set():
+        parent = _rss_of(os.getpid())
+        children = sum(_rss_of(p.pid) for p in multiprocessing.active_children())
+        samples.append((parent, parent + children))
+        try:
+            await asyncio.wait_for(stop.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _expect(api: FakeBotAPI, chat_id: int, kind: str, timeout: float):
+    """Ждет ответа бота нужного типа; ошибка бота - текст с ❌/⏳/📶"""
+    queue = api.replies(chat_id)
+    deadline = time.perf_counter() + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise asyncio.TimeoutError
+        reply = await asyncio.wait_for(queue.get(), remaining)
+        if reply[0] == kind:
+            return reply
+        if reply[0] == 'message' and reply[2][:1] in ('❌', '⏳', '📶'):
+            raise RuntimeError(reply[2])
+
+
+async def _user(api: FakeBotAPI, chat_id: int, args, results: list) -> None:
+    """Один пользователь проходит сценарий /start -> имя -> сумма -> срок"""
+    started = time.perf_counter()
+    record = {'chat_id': chat_id, 'ok': False}
+    try:
+        await api.push_text(chat_id, '/start')
+        await _expect(api, chat_id, 'message', args.timeout)
+        await asyncio.sleep(args.think)
+        await api.push_text(chat_id, f'Mario Rossi {chat_id}')
+        await _expect(api, chat_id, 'message', args.timeout)
+        await asyncio.sleep(args.think)
+        sent = time.perf_counter()
+        await api.push_text(chat_id, f'{random.randint(1000, 50000)}')
+        _kind, previewed, _text, _size = await _expect(api, chat_id, 'message', args.timeout)
+        await asyncio.sleep(args.think)
+        confirmed = time.perf_counter()
+        await api.push_callback(chat_id, f'term:{random.choice((12, 24, 36, 48, 60))}')
+        _kind, received, _name, size = await _expect(api, chat_id, 'document', args.timeout)
+        record.update(ok=True, preview_latency=previewed - sent, latency=received - confirmed,
+                      total=received - started, bytes=size)
+    except asyncio.TimeoutError:
+        record['error'] = 'timeout'
+    except RuntimeError as e:
+        record['error'] = str(e)[:200]
+    results.append(record)
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+async def run(args) -> dict:
+    """Прогон нагрузки; возвращает отчет"""
+    os.environ.setdefault('TG_CHAT_INTERVAL', str(args.chat_interval))
+    # Архив документов пишется, как в бою, но во временный каталог
+    os.environ.setdefault('ARCHIVE_DIR', tempfile.mkdtemp(prefix='loadtest-archive-'))
+    os.environ.setdefault('STATE_DB', os.path.join(tempfile.mkdtemp(prefix='loadtest-state-'), 'state.sqlite3'))
+    import telegram_document_bot as bot
+    from render_cache import code_version
+
+    api = FakeBotAPI()
+    base_url = await api.start()
+    app = bot.build_application(bot.BotConfig('loadtest', FAKE_TOKEN, base_url=base_url))
+    await bot.start_shared()
+
+    await app.initialize()
+    await app.start()
+    await app.updater.start_polling(poll_interval=0, timeout=5)
+
+    rss_samples, stop_sampling = [], asyncio.Event()
+    sampler = asyncio.create_task(_sample_rss(rss_samples, stop_sampling))
+
+    results, tasks = [], []
+    started = time.perf_counter()
+    for i in range(args.users):
+        tasks.append(asyncio.create_task(_user(api, 100000 + i, args, results)))
+        # Пуассоновский поток прихода пользователей
+        await asyncio.sleep(random.expovariate(args.rate) if args.rate > 0 else 0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    stop_sampling.set()
+    await sampler
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    await app.post_shutdown(app)
+    await bot.stop_shared()
+    await api.stop()
+
+    ok = [r for r in results if r['ok']]
+    latencies = [r['latency'] for r in ok]
+    previews = [r['preview_latency'] for r in ok]
+    errors = {}
+    for r in results:
+        if not r['ok']:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+    return {
+        'revision': _git_revision(),
+        'code_version': code_version(),
+        'config': {'users': args.users, 'rate': args.rate, 'think': args.think,
+                   'render_workers': bot.render_pool.size, 'chat_interval': args.chat_interval},
+        'duration_seconds': round(elapsed, 3),
+        'completed': len(ok),
+        'error_rate': round(1 - len(ok) / len(results), 4) if results else 0,
+        'errors': errors,
+        'throughput_docs_per_second': round(len(ok) / elapsed, 3) if elapsed else 0,
+        'latency_seconds': {
+            'p50': _percentile(latencies, 50), 'p90': _percentile(latencies, 90),
+            'p95': _percentile(latencies, 95), 'p99': _percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        },
+        'preview_latency_seconds': {'p50': _percentile(previews, 50), 'p95': _percentile(previews, 95)},
+        'document_bytes_avg': round(sum(r['bytes'] for r in ok) / len(ok)) if ok else None,
+        'rss_bytes': {
+            'bot_peak': max((s[0] for s in rss_samples), default=0),
+            'total_peak': max((s[1] for s in rss_samples), default=0),
+        },
+    }
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """Печатает изменения ключевых показателей относительно прошлого отчета"""
+    rows = [
+        ('throughput_docs_per_second', report['throughput_docs_per_second'], baseline['throughput_docs_per_second']),
+        ('error_rate', report['error_rate'], baseline['error_rate']),
+        *[(f'latency.{q}', report['latency_seconds'][q], baseline['latency_seconds'][q])
+          for q in ('p50', 'p95', 'p99', 'max')],
+        ('rss.total_peak', report['rss_bytes']['total_peak'], baseline['rss_bytes']['total_peak']),
+    ]
+    print(f"\n📊 Сравнение с {baseline.get('revision') or baseline.get('code_version')}:")
+    for name, new, old in rows:
+        if new is None or old is None:
+            print(f"   {name:30} {old} -> {new}")
+            continue
+        delta = f"{(new - old) / old * 100:+.1f}%" if old else ''
+        print(f"   {name:30} {old:>14.3f} -> {new:>14.3f} {delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушкой Bot API")
+    parser.add_argument('--users', type=int, default=20, help="число пользователей")
+    parser.add_argument('--rate', type=float, default=2.0, help="пользователей в секунду (Пуассон)")
+    parser.add_argument('--think', type=float, default=0.2, help="пауза пользователя между шагами, с")
+    parser.add_argument('--timeout', type=float, default=120.0, help="ожидание ответа бота, с")
+    parser.add_argument('--chat-interval', type=float, default=0.0,
+                        help="TG_CHAT_INTERVAL лимитера (0 = без троттлинга на чат)")
+    parser.add_argument('--out', help="куда записать JSON отчет")
+    parser.add_argument('--compare', help="JSON отчет прошлого релиза для сравнения")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s — %(levelname)s — %(message)s", level=logging.WARNING)
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
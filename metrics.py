@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Метрики процесса для PDF конструктора и Telegram бота
+Счетчики, gauges и наблюдения (min/max/sum) в памяти, без внешних зависимостей
+"""
+
+import threading
+
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_observations = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    """Ключ метрики: имя + отсортированные метки"""
+    return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """Увеличивает счетчик"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """Устанавливает текущее значение gauge"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def max_gauge(name: str, value: float, **labels) -> bool:
+    """Обновляет gauge только если значение больше (high-water mark). True если обновлен"""
+    key = _key(name, labels)
+    with _lock:
+        if value > _gauges.get(key, float('-inf')):
+            _gauges[key] = value
+            return True
+    return False
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Записывает наблюдение (размер, длительность): count/sum/min/max"""
+    key = _key(name, labels)
+    with _lock:
+        obs = _observations.get(key)
+        if obs is None:
+            _observations[key] = {'count': 1, 'sum': value, 'min': value, 'max': value}
+        else:
+            obs['count'] += 1
+            obs['sum'] += value
+            obs['min'] = min(obs['min'], value)
+            obs['max'] = max(obs['max'], value)
+
+
+def snapshot() -> dict:
+    """Снимок всех метрик в виде словаря, пригодного для JSON"""
+    def _flat(store):
+        return [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(store.items(), key=lambda kv: kv[0])
+        ]
+
+    with _lock:
+        return {
+            'counters': _flat(_counters),
+            'gauges': _flat(_gauges),
+            'observations': _flat({k: dict(v) for k, v in _observations.items()}),
+        }
+
+
+def reset() -> None:
+    """Очищает все метрики"""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _observations.clear()
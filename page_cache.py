@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Кэш отрендеренных частей документа
+Шаблон делится по разрывам страниц (pdf_costructor.page_plan), и для каждой
+части известно, какие поля в ней встречаются. Ключ части - хэш ее HTML с
+метками и значения только этих полей, поэтому страницы без данных клиента
+рендерятся один раз на процесс, а WeasyPrint получает лишь измененные части.
+Готовые части склеиваются assemble_parts, печати накладываются на весь документ.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+import tracing
+
+
+# ---------------------- Настройки ------------------------------------------
+PAGE_CACHE_MB = float(os.getenv("PAGE_CACHE_MB", "16"))   # 0 = рендер документа целиком
+
+
+def page_key(template_name: str, plan, index: int, values: list, brand: str = None) -> str:
+    """Ключ части: профиль бренда, HTML части с метками и значения полей, от которых она зависит"""
+    payload = json.dumps(
+        {'template': template_name, 'brand': brand, 'page': index, 'html': plan.digests[index],
+         'fields': {str(i): values[i] for i in sorted(plan.fields[index])}},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'),
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PageCache:
+    """LRU кэш PDF частей: ключ -> (байты, число страниц), ограничен суммарным размером"""
+
+    def __init__(self, max_mb: float = PAGE_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+        return item
+
+    def put(self, key: str, payload: bytes, pages: int) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._items[key] = (payload, pages)
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                _key, (evicted, _pages) = self._items.popitem(last=False)
+                self._size -= len(evicted)
+            metrics.set_gauge('page_cache_bytes', self._size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+            metrics.set_gauge('page_cache_bytes', 0)
+
+
+# Кэш процесса: в воркере - для последовательного рендера, в боте - для частей пула
+page_cache = PageCache()
+
+
+def render_pages(template_name: str, data: dict):
+    """
+    Документ из кэшированных и заново отрендеренных частей
+
+    Returns:
+        BytesIO: PDF с печатями - или None, если кэш выключен, шаблон не делится,
+        каждая часть зависит от данных клиента (кэш не попадет, а лишние проходы
+        и склейка только медленнее) или части дали не то число страниц -
+        тогда рендерим целиком
+    """
+    import pdf_costructor
+
+    if not page_cache.enabled:
+        return None
+    plan = pdf_costructor.page_plan(template_name, data.get('brand'))
+    if plan is None or all(plan.fields):
+        return None
+    split = pdf_costructor.split_document(template_name, data)
+    if split is None:
+        return None
+
+    with tracing.span('pdf.pages', template=template_name, parts=len(split.parts)) as attrs:
+        payloads, pages, rendered = [], 0, 0
+        for html, key in zip(split.parts, split.keys):
+            item = page_cache.get(key)
+            if item is None:
+                buffer, count = pdf_costructor.render_html(html, template_name)
+                item = (buffer.getvalue(), count)
+                page_cache.put(key, *item)
+                rendered += 1
+            payloads.append(item[0])
+            pages += item[1]
+        attrs['parts.rendered'] = rendered
+        metrics.inc('page_cache_hits', len(payloads) - rendered, template=template_name)
+        metrics.inc('page_cache_misses', rendered, template=template_name)
+
+    if split.expected_pages is not None and pages != split.expected_pages:
+        metrics.inc('render_split_page_mismatch', template=template_name)
+        print(f"⚠️ {template_name}: части дали {pages} стр. вместо {split.expected_pages} - рендер целиком")
+        return None
+    print(f"📑 {template_name}: из кэша {len(payloads) - rendered} из {len(payloads)} частей")
+    return pdf_costructor.assemble_parts(template_name, payloads, data.get('brand'))
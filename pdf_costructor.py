@@ -1,13 +1,39 @@
 #!/usr/bin/env python3
 """
-PDF Constructor API для генерации документов Intesa Sanpaolo
-Поддерживает: contratto, garanzia, carta
+PDF Constructor API для генерации документов Intesa Sanpaolo и других брендов
+Поддерживает: contratto, garanzia, carta; бренд - data['brand'] (см. brands.py)
 """
 
+import os
 from io import BytesIO
+from typing import NamedTuple
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
 
+import metrics
+from artifact_store import ArtifactStore, artifact_store, open_stream
+from brands import TEMPLATE_BORDER_COLOR, artifact, profile_key
+from pdf_optimize import optimize_pdf, weasyprint_options
+from render_deadline import STAMPS_SKIPPED, mark_degraded, should_skip_stamps, time_left
+from stamp_layout import configure_reportlab, draw_layout, load_layout
+from tracing import span, traced
+
+
+# ---------------------- Настройки ------------------------------------------
+# Бэкенд по шаблону: "contratto=reportlab,carta=weasyprint"; по умолчанию weasyprint
+PDF_BACKENDS = os.getenv("PDF_BACKENDS", "")
+DEFAULT_BACKEND = 'weasyprint'
+TEMPLATE_BACKENDS = {
+    template.strip(): backend.strip()
+    for template, backend in (item.partition('=')[::2] for item in PDF_BACKENDS.split(',') if item.strip())
+}
+
+# Бюджет страниц: документ длиннее уменьшается (fit_to_pages), а не обрезается
+PAGE_BUDGETS = {'garanzia': 1, 'carta': 1}
+FIT_MIN_SCALE = float(os.getenv("FIT_MIN_SCALE", "0.75"))   # мельче шрифт не делаем
+FIT_MAX_PASSES = int(os.getenv("FIT_MAX_PASSES", "5"))      # всего проходов верстки, включая первый
+FIT_TOLERANCE = 0.05                                         # точность масштаба: 5% размера шрифта
+
 
 def format_money(amount: float) -> str:
     """Форматирование суммы БЕЗ знака € (он уже есть в HTML)"""
@@ -19,6 +45,14 @@ def format_date() -> str:
     return datetime.now().strftime("%d/%m/%Y")
 
 
+BLANK_FIELD = '_' * 20  # поле общей версии документа - заполняется от руки
+
+
+def field(value, fmt=str) -> str:
+    """Значение поля для документа; None - пустая линия (общая версия шаблона)"""
+    return BLANK_FIELD if value is None else fmt(value)
+
+
 def monthly_payment(amount: float, months: int, annual_rate: float) -> float:
     """Аннуитетный расчёт ежемесячного платежа"""
     r = (annual_rate / 100) / 12
@@ -29,7 +63,13 @@ def monthly_payment(amount: float, months: int, annual_rate: float) -> float:
     return round(num / den, 2)
 
 
-def generate_contratto_pdf(data: dict) -> BytesIO:
+def monthly_payments(amount: float, terms, annual_rate: float) -> dict:
+    """Платежи сразу для нескольких сроков (предпросмотр условий): срок -> платеж"""
+    return {months: monthly_payment(amount, months, annual_rate) for months in terms}
+
+
+@traced('pdf.generate_contratto')
+def generate_contratto_pdf(data: dict, backend: str = None) -> BytesIO:
     """
     API функция для генерации PDF договора
     
@@ -42,6 +82,7 @@ def generate_contratto_pdf(data: dict) -> BytesIO:
             'taeg': float - TAEG эффективная ставка,
             'payment': float - Ежемесячный платеж (опционально, будет рассчитан)
         }
+        backend (str): 'weasyprint' или 'reportlab' (по умолчанию из PDF_BACKENDS)
     
     Returns:
         BytesIO: PDF файл в памяти
@@ -50,25 +91,30 @@ def generate_contratto_pdf(data: dict) -> BytesIO:
     if 'payment' not in data:
         data['payment'] = monthly_payment(data['amount'], data['duration'], data['tan'])
     
-    html = fix_html_layout('contratto')
-    return _generate_pdf_with_images(html, 'contratto', data)
+    return _render_with_backend('contratto', data, backend)
 
 
-def generate_garanzia_pdf(name: str) -> BytesIO:
+@traced('pdf.generate_garanzia')
+def generate_garanzia_pdf(name: str, backend: str = None, brand: str = None) -> BytesIO:
     """
     API функция для генерации PDF гарантийного письма
     
     Args:
         name (str): ФИО клиента
+        backend (str): бэкенд рендеринга (по умолчанию из PDF_BACKENDS)
+        brand (str): профиль бренда (None - DEFAULT_BRAND)
         
     Returns:
         BytesIO: PDF файл в памяти
     """
-    html = fix_html_layout('garanzia')
-    return _generate_pdf_with_images(html, 'garanzia', {'name': name})
+    data = {'name': name}
+    if brand is not None:
+        data['brand'] = brand
+    return _render_with_backend('garanzia', data, backend)
 
 
-def generate_carta_pdf(data: dict) -> BytesIO:
+@traced('pdf.generate_carta')
+def generate_carta_pdf(data: dict, backend: str = None) -> BytesIO:
     """
     API функция для генерации PDF письма о карте
     
@@ -80,6 +126,7 @@ def generate_carta_pdf(data: dict) -> BytesIO:
             'tan': float - TAN процентная ставка,
             'payment': float - Ежемесячный платеж (опционально, будет рассчитан)
         }
+        backend (str): бэкенд рендеринга (по умолчанию из PDF_BACKENDS)
     
     Returns:
         BytesIO: PDF файл в памяти
@@ -88,352 +135,561 @@ def generate_carta_pdf(data: dict) -> BytesIO:
     if 'payment' not in data:
         data['payment'] = monthly_payment(data['amount'], data['duration'], data['tan'])
     
-    html = fix_html_layout('carta')
-    return _generate_pdf_with_images(html, 'carta', data)
+    return _render_with_backend('carta', data, backend)
+
+
+# Реестр шаблонов: имя -> функция генерации (используется пулом рендеринга)
+TEMPLATES = {
+    'contratto': generate_contratto_pdf,
+    'garanzia': lambda data, backend=None: generate_garanzia_pdf(data['name'], backend, data.get('brand')),
+    'carta': generate_carta_pdf,
+}
+
+
+def _render_weasyprint(template_name: str, data: dict) -> BytesIO:
+    """HTML шаблон -> WeasyPrint -> наложение изображений ReportLab"""
+    from page_cache import render_pages
+
+    # Многостраничные шаблоны - по частям: неизменные части берутся из кэша
+    buffer = render_pages(template_name, data)
+    if buffer is not None:
+        return buffer
+    return _generate_pdf_with_images(template_html(template_name, data.get('brand')), template_name, data)
+
+
+@traced('pdf.native')
+def _render_reportlab(template_name: str, data: dict) -> BytesIO:
+    """Нативная верстка ReportLab: печати рисуются сразу, без слияния с overlay"""
+    from pdf_native import NATIVE_TEMPLATES
+    buffer = NATIVE_TEMPLATES[template_name](data)
+    print(f"✅ PDF {template_name} сверстан через ReportLab! Размер: {buffer.getbuffer().nbytes} байт")
+    return optimize_pdf(buffer, template_name)
+
+
+def _native_templates() -> set:
+    from pdf_native import NATIVE_TEMPLATES
+    return set(NATIVE_TEMPLATES)
+
+
+# Бэкенды: имя -> (функция рендеринга, поддерживаемые шаблоны; None - любые)
+BACKENDS = {
+    'weasyprint': (_render_weasyprint, lambda: None),
+    'reportlab': (_render_reportlab, _native_templates),
+}
+
+# Опечатка в PDF_BACKENDS - ошибка при старте, а не молча другой бэкенд
+_unknown_backends = [f"{template}={backend}" for template, backend in TEMPLATE_BACKENDS.items()
+                     if backend not in BACKENDS]
+if _unknown_backends:
+    raise ValueError(f"PDF_BACKENDS: unknown backend in {', '.join(_unknown_backends)}"
+                     f" (expected template=backend, backend one of {', '.join(BACKENDS)})")
+
+
+def select_backend(template_name: str, backend: str = None) -> str:
+    """Бэкенд для шаблона: явный, из PDF_BACKENDS или weasyprint, если выбранный шаблон не умеет"""
+    backend = backend or TEMPLATE_BACKENDS.get(template_name, DEFAULT_BACKEND)
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд рендеринга: {backend}")
+    supported = BACKENDS[backend][1]()
+    if supported is not None and template_name not in supported:
+        print(f"⚠️ Бэкенд {backend} не поддерживает {template_name} - используем {DEFAULT_BACKEND}")
+        return DEFAULT_BACKEND
+    return backend
+
+
+def _render_with_backend(template_name: str, data: dict, backend: str = None) -> BytesIO:
+    backend = select_backend(template_name, backend)
+    return BACKENDS[backend][0](template_name, data)
+
+
+def render_document(template_name: str, data: dict, profile_tag: str = None, backend: str = None) -> BytesIO:
+    """
+    Единая точка входа: генерация документа по имени шаблона
+    
+    Args:
+        template_name (str): 'contratto', 'garanzia' или 'carta'
+        data (dict): данные клиента (см. generate_*_pdf)
+        profile_tag (str): если задан (или RENDER_PROFILE=1) - рендер под cProfile/tracemalloc
+        backend (str): 'weasyprint' или 'reportlab' (по умолчанию из PDF_BACKENDS)
+        
+    Returns:
+        BytesIO: PDF файл в памяти
+    """
+    if template_name not in TEMPLATES:
+        raise ValueError(f"Неизвестный тип документа: {template_name}")
+    
+    from render_profiling import RENDER_PROFILE, profiled
+    if profile_tag or RENDER_PROFILE:
+        with profiled(template_name, profile_tag):
+            return TEMPLATES[template_name](data, backend)
+    return TEMPLATES[template_name](data, backend)
+
+
+def warm_up() -> None:
+    """Прогрев процесса: импорт тяжелых библиотек до первого документа"""
+    from reportlab.pdfgen import canvas  # noqa: F401
+    configure_reportlab()
+    import weasyprint  # noqa: F401
+    from PyPDF2 import PdfReader, PdfWriter  # noqa: F401
+    from PIL import Image  # noqa: F401
+    # Манифест хранилища артефактов читается до форка воркеров
+    artifact_store.open()
+    # Схемы размещения компилируются один раз и наследуются воркерами
+    for template_name in TEMPLATES:
+        try:
+            load_layout(template_name)
+        except Exception as e:
+            print(f"⚠️ Схема размещения {template_name} не загружена: {e}")
+        if select_backend(template_name) == 'weasyprint':
+            try:
+                template_html(template_name)
+            except OSError as e:
+                print(f"⚠️ HTML шаблона {template_name} не загружен: {e}")
+    if 'reportlab' in TEMPLATE_BACKENDS.values():
+        import pdf_native
+        pdf_native.warm_up()
+    print("🔥 PDF конструктор прогрет: WeasyPrint, ReportLab, PyPDF2, PIL загружены")
+
+
+def _percent(value) -> str:
+    return f"{value:.2f}%"
+
+
+def _months(value) -> str:
+    return f"{value} mesi"
+
+
+# Поля шаблонов в порядке появления в HTML: (метка, поле данных, формат)
+TEMPLATE_FIELDS = {
+    'contratto': [
+        ('XXX', 'name', str),  # имя клиента (первое)
+        ('ХХХ', 'amount', format_money),  # сумма кредита (кириллическое ХХХ)
+        ('XXX', 'tan', _percent),  # TAN
+        ('XXX', 'taeg', _percent),  # TAEG
+        ('XXX', 'duration', _months),  # срок
+        ('XXX', 'payment', format_money),  # платеж
+        ('11/06/2025', 'date', str),  # дата
+        ('XXX', 'name', str),  # имя в подписи
+    ],
+    'carta': [
+        ('XXX', 'name', str),  # имя клиента
+        ('XXX', 'amount', format_money),  # сумма кредита
+        ('XXX', 'tan', _percent),  # TAN
+        ('XXX', 'duration', _months),  # срок
+        ('XXX', 'payment', format_money),  # платеж
+    ],
+    'garanzia': [
+        ('XXX', 'name', str),  # имя клиента
+    ],
+}
+
+
+def field_values(template_name: str, data: dict) -> list:
+    """Отформатированные значения полей шаблона по порядку TEMPLATE_FIELDS"""
+    data = dict(data, date=format_date())
+    return [field(data[name], fmt) for _old, name, fmt in TEMPLATE_FIELDS.get(template_name, ())]
+
+
+def fill_template(html: str, template_name: str, data: dict) -> str:
+    """Подставляет данные клиента вместо XXX в обработанный HTML шаблона за один проход"""
+    fields = TEMPLATE_FIELDS.get(template_name, ())
+    if not fields:
+        return html
+    # k-я метка одного вида получает k-е вхождение - как replace(old, new, 1) по очереди,
+    # но строка собирается один раз, а не копируется на каждую замену
+    found, cursor_of = [], {}
+    for (old, _name, _fmt), value in zip(fields, field_values(template_name, data)):
+        start = html.find(old, cursor_of.get(old, 0))
+        if start < 0:
+            continue
+        cursor_of[old] = start + len(old)
+        found.append((start, len(old), value))
+    chunks, cursor = [], 0
+    for start, length, value in sorted(found):
+        chunks += (html[cursor:start], value)
+        cursor = start + length
+    chunks.append(html[cursor:])
+    return ''.join(chunks)
+
+
+def _layout(html: str, options: dict, scale: float = 1.0):
+    from weasyprint import HTML
+    from template_transform import scale_typography
+
+    return HTML(string=scale_typography(html, scale)).render(**options)
+
+
+_page_box_warned = False
+
+
+def _pages_used(document) -> float:
+    """
+    Сколько страниц занято с долей последней: 1.1 - на второй пара строк
+
+    Доля берется из приватного Page._page_box WeasyPrint (65.x, requirements.txt):
+    публичного API для высоты верстки нет. Если его устройство поменяется,
+    считаются целые страницы - первая попытка fit_to_pages становится грубее,
+    но результат верный; такие случаи видны в метрике render_fit_page_box_fallback.
+    """
+    global _page_box_warned
+    pages = len(document.pages)
+    try:
+        # Первый потомок страницы - корневой блок html (дальше margin boxes)
+        page_box = document.pages[-1]._page_box
+        root = page_box.children[0]
+        used = (root.position_y + root.margin_height() - page_box.content_box_y()) / page_box.height
+        return pages - 1 + min(max(used, 0.0), 1.0)
+    except (AttributeError, IndexError, TypeError, ZeroDivisionError) as e:
+        metrics.inc('render_fit_page_box_fallback')
+        if not _page_box_warned:
+            _page_box_warned = True
+            print(f"⚠️ Высота верстки недоступна ({type(e).__name__}: {e}) - считаем целые страницы")
+        return pages
 
 
+def fit_to_pages(html: str, template_name: str, budget: int, options: dict) -> tuple:
+    """
+    Верстка в бюджет страниц
+    
+    Первый проход - как есть. Если страниц больше бюджета, масштаб шрифта и
+    интерлиньяжа ищется делением пополам между FIT_MIN_SCALE и 1; первая
+    попытка - sqrt(бюджет / занятые страницы), потому что высота текста
+    растет примерно как квадрат размера шрифта (строки и выше, и длиннее). Возвращается уже сверстанный
+    Document - write_pdf не повторяет последний проход.
+    
+    Returns:
+        tuple: (Document, масштаб, число проходов верстки)
+    """
+    document = _layout(html, options)
+    passes = 1
+    if budget is None or len(document.pages) <= budget:
+        metrics.observe('render_fit_passes', passes, template=template_name)
+        return document, 1.0, passes
+    
+    best = None                        # (масштаб, Document) - самый крупный, что поместился
+    smallest = (1.0, document)         # самый мелкий из не поместившихся - если не поместится ничего
+    low, high = FIT_MIN_SCALE, 1.0     # high не помещается; low - нижняя граница поиска
+    scale = min(max((budget / _pages_used(document)) ** 0.5, FIT_MIN_SCALE), 1.0 - FIT_TOLERANCE)
+    while passes < FIT_MAX_PASSES:
+        candidate = _layout(html, options, scale)
+        passes += 1
+        if len(candidate.pages) <= budget:
+            best, low = (scale, candidate), scale
+        else:
+            smallest, high = (scale, candidate), scale
+            if scale <= FIT_MIN_SCALE:
+                break
+        if high - low > FIT_TOLERANCE:
+            scale = (low + high) / 2
+        elif best is None:
+            scale = FIT_MIN_SCALE      # интервал сжался - осталось проверить сам минимум
+        else:
+            break
+    
+    metrics.observe('render_fit_passes', passes, template=template_name)
+    if best is None:
+        metrics.inc('render_fit_failed', template=template_name)
+        print(f"⚠️ {template_name}: {len(smallest[1].pages)} стр. при бюджете {budget} даже в масштабе {smallest[0]:.2f}")
+        return smallest[1], smallest[0], passes
+    metrics.inc('render_fit_scaled', template=template_name)
+    print(f"📐 {template_name}: шрифт x{best[0]:.2f} для {budget} стр. за {passes} прохода(ов) верстки")
+    return best[1], best[0], passes
+
+
+def render_html(html: str, template_name: str, page_budget: int = None) -> tuple:
+    """
+    HTML -> PDF через WeasyPrint
+    
+    Args:
+        page_budget (int): максимум страниц (None - без подгонки, см. fit_to_pages)
+    
+    Returns:
+        tuple: (BytesIO с PDF в начале, число страниц)
+    """
+    with span('pdf.weasyprint', template=template_name) as attrs:
+        options = weasyprint_options()
+        document, scale, passes = fit_to_pages(html, template_name, page_budget, options)
+        # Пишем сразу в свой буфер - он и идет дальше по конвейеру
+        buffer = BytesIO()
+        document.write_pdf(target=buffer, **options)
+        attrs['pdf.bytes'] = buffer.tell()
+        attrs['pages'] = len(document.pages)
+        attrs['fit.passes'] = passes
+        attrs['fit.scale'] = scale
+    buffer.seek(0)
+    return buffer, len(document.pages)
+
+
+def _finish_with_images(pdf: BytesIO, template_name: str, brand: str = None) -> BytesIO:
+    """Печати поверх базового PDF - или базовый PDF, если до дедлайна не успеть"""
+    if should_skip_stamps():
+        mark_degraded(STAMPS_SKIPPED)
+        print(f"⏱️ До дедлайна {time_left():.1f} с - {template_name} без печатей")
+        pdf.seek(0)
+        return pdf
+    # НАКЛАДЫВАЕМ ИЗОБРАЖЕНИЯ ЧЕРЕЗ REPORTLAB
+    return _add_images_to_pdf(pdf, template_name, brand)
+
+
+@traced('pdf.generate_with_images')
 def _generate_pdf_with_images(html: str, template_name: str, data: dict) -> BytesIO:
     """Внутренняя функция для генерации PDF с изображениями"""
     try:
-        from weasyprint import HTML
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.units import mm
-        from PyPDF2 import PdfReader, PdfWriter
-        from PIL import Image
-        
-        # Заменяем XXX на реальные данные для contratto, carta и garanzia
-        if template_name in ['contratto', 'carta', 'garanzia']:
-            replacements = []
-            if template_name == 'contratto':
-                replacements = [
-                    ('XXX', data['name']),  # имя клиента (первое)
-                    ('ХХХ', format_money(data['amount'])),  # сумма кредита (кириллическое ХХХ)
-                    ('XXX', f"{data['tan']:.2f}%"),  # TAN
-                    ('XXX', f"{data['taeg']:.2f}%"),  # TAEG  
-                    ('XXX', f"{data['duration']} mesi"),  # срок
-                    ('XXX', format_money(data['payment'])),  # платеж
-                    ('11/06/2025', format_date()),  # дата
-                    ('XXX', data['name']),  # имя в подписи
-                ]
-            elif template_name == 'carta':
-                replacements = [
-                    ('XXX', data['name']),  # имя клиента
-                    ('XXX', format_money(data['amount'])),  # сумма кредита
-                    ('XXX', f"{data['tan']:.2f}%"),  # TAN
-                    ('XXX', f"{data['duration']} mesi"),  # срок
-                    ('XXX', format_money(data['payment'])),  # платеж
-                ]
-            elif template_name == 'garanzia':
-                replacements = [
-                    ('XXX', data['name']),  # имя клиента
-                ]
-            
-            for old, new in replacements:
-                html = html.replace(old, new, 1)  # заменяем по одному
-        
-        # Конвертируем HTML в PDF
-        pdf_bytes = HTML(string=html).write_pdf()
-        
-        # НАКЛАДЫВАЕМ ИЗОБРАЖЕНИЯ ЧЕРЕЗ REPORTLAB
-        return _add_images_to_pdf(pdf_bytes, template_name)
+        html = fill_template(html, template_name, data)
+        pdf, _pages = render_html(html, template_name, PAGE_BUDGETS.get(template_name))
+        return _finish_with_images(pdf, template_name, data.get('brand'))
             
     except Exception as e:
         print(f"Ошибка генерации PDF: {e}")
         raise
 
-def _add_images_to_pdf(pdf_bytes: bytes, template_name: str) -> BytesIO:
-    """Добавляет изображения на PDF через ReportLab"""
+
+# Жесткий разрыв страницы в HTML шаблонах - граница частей документа
+PAGE_BREAK = '<div style="page-break-before: always;"></div>'
+
+
+def _marker(index: int) -> str:
+    return f'\x00{index}\x00'
+
+
+class PagePlan(NamedTuple):
+    """
+    Шаблон, разделенный по разрывам страниц, с зависимостями частей от полей
+
+    segments[i] - HTML части i (с <head> и хвостом), разрезанный по меткам полей:
+    текст на четных местах, индексы полей TEMPLATE_FIELDS на нечетных.
+    fields[i] - индексы полей, от которых зависит часть i.
+    """
+    segments: tuple
+    fields: tuple
+    digests: tuple  # хэш HTML части с метками - меняется вместе с шаблоном
+
+
+def page_plan(template_name: str, brand: str = None):
+    """Анализ зависимостей частей шаблона от полей. None, если делить нечего"""
+    if template_name not in TEMPLATES or select_backend(template_name) != 'weasyprint':
+        return None
+    return artifact(brand, ('plan', template_name), lambda profile: _build_page_plan(template_name, profile.name))
+
+
+def _build_page_plan(template_name: str, brand: str):
+    import hashlib
+
+    html = template_html(template_name, brand)
+    if PAGE_BREAK not in html:
+        return None
+    for index, (old, _name, _fmt) in enumerate(TEMPLATE_FIELDS.get(template_name, ())):
+        html = html.replace(old, _marker(index), 1)
+    body_open = html.index('>', html.index('<body')) + 1
+    body_close = html.rindex('</body>')
+    head, tail = html[:body_open], html[body_close:]
+    pages = tuple(html[body_open:body_close].split(PAGE_BREAK))
+    count = len(TEMPLATE_FIELDS.get(template_name, ()))
+    shared = {i for i in range(count) if _marker(i) in head or _marker(i) in tail}
+    fields = tuple(frozenset(shared | {i for i in range(count) if _marker(i) in page}) for page in pages)
+    digests = tuple(hashlib.sha256((head + page + tail).encode('utf-8')).hexdigest()[:16] for page in pages)
+    segments = tuple(
+        tuple(int(piece) if odd else piece for odd, piece in
+              ((n % 2, piece) for n, piece in enumerate((head + page + tail).split('\x00'))))
+        for page in pages
+    )
+    names = [sorted({TEMPLATE_FIELDS[template_name][i][1] for i in deps}) for deps in fields]
+    print(f"🗺️ {template_name} ({brand}): {len(pages)} частей, поля по частям: {names}")
+    return PagePlan(segments, fields, digests)
+
+
+def fill_page(plan: PagePlan, index: int, values: list) -> str:
+    """Полный HTML одной части с подставленными значениями полей (одна сборка строки)"""
+    return ''.join(values[piece] if n % 2 else piece for n, piece in enumerate(plan.segments[index]))
+
+
+class SplitDocument(NamedTuple):
+    """Документ по частям: HTML частей, ключи кэша частей, ожидаемое число страниц"""
+    parts: list
+    keys: list
+    expected_pages: int = None
+
+
+def split_document(template_name: str, data: dict):
+    """
+    Делит документ по объявленным разрывам страниц
+    
+    Каждая часть - полноценный HTML с теми же <head> (стили, шрифты) и <body>.
+    Ключ части зависит только от полей, которые в ней встречаются.
+    
+    Returns:
+        SplitDocument - или None, если шаблон рендерится не через WeasyPrint
+        или разрывов нет
+    """
+    from page_cache import page_key
+
+    brand = data.get('brand')
+    plan = page_plan(template_name, brand)
+    if plan is None:
+        return None
+    data = dict(data)
+    if template_name in ('contratto', 'carta') and 'payment' not in data:
+        data['payment'] = monthly_payment(data['amount'], data['duration'], data['tan'])
+    values = field_values(template_name, data)
+    layout = load_layout(template_name, brand)
+    return SplitDocument(
+        [fill_page(plan, i, values) for i in range(len(plan.segments))],
+        [page_key(template_name, plan, i, values, brand) for i in range(len(plan.segments))],
+        len(layout.pages) if layout is not None else None,
+    )
+
+
+@traced('pdf.assemble')
+def assemble_parts(template_name: str, parts: list, brand: str = None) -> BytesIO:
+    """Склеивает PDF частей в один документ и накладывает печати"""
+    import contextlib
+    import pikepdf
+    
+    # Исходники частей открыты до сохранения: qpdf копирует потоки страниц лениво.
+    # BytesIO(bytes) не копирует байты части, пока в буфер не пишут
+    with contextlib.ExitStack() as stack:
+        pdf = stack.enter_context(pikepdf.Pdf.new())
+        for part in parts:
+            source = stack.enter_context(pikepdf.open(BytesIO(part)))
+            pdf.pages.extend(source.pages)
+        merged = BytesIO()
+        pdf.save(merged)
+    print(f"🧩 {template_name}: склеено {len(parts)} частей")
+    merged.seek(0)
+    return _finish_with_images(merged, template_name, brand)
+
+
+def overlay_pdf(template_name: str, brand: str = None):
+    """
+    Overlay с печатями и номерами страниц: данных клиента в нем нет, поэтому
+    он собирается один раз на профиль бренда и берется из кэша brands
+
+    Returns:
+        bytes или MappedArtifact: PDF overlay (из artifact_store, если собран
+        при сборке образа) - или None, если схемы размещения нет
+    """
+    def build(profile):
+        stored = artifact_store.get(profile_key(profile, 'overlay', template_name))
+        return stored if stored is not None else _build_overlay(template_name, profile)
+    return artifact(brand, ('overlay', template_name), build)
+
+
+def _build_overlay(template_name: str, profile):
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    layout = load_layout(template_name, profile.name)
+    if layout is None:
+        return None
+    buffer = BytesIO()
+    overlay_canvas = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    draw_layout(overlay_canvas, layout)
+    overlay_canvas.save()
+    print(f"🖼️ Overlay {template_name} ({profile.name}) собран: {buffer.tell()} байт")
+    return buffer.getvalue()
+
+
+@traced('pdf.add_images')
+def _add_images_to_pdf(pdf: BytesIO, template_name: str, brand: str = None) -> BytesIO:
+    """Добавляет изображения на PDF: готовый overlay профиля по схеме layouts/<шаблон>.json"""
     try:
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import A4
-        from reportlab.lib.units import mm
         from PyPDF2 import PdfReader, PdfWriter
-        from PIL import Image
-        
-        # Создаем overlay с изображениями
-        overlay_buffer = BytesIO()
-        overlay_canvas = canvas.Canvas(overlay_buffer, pagesize=A4)
-        
-        # Размер ячейки для расчета сдвигов
-        cell_width_mm = 210/25  # 8.4mm
-        cell_height_mm = 297/35  # 8.49mm
-        
-        if template_name == 'garanzia':
-            # Добавляем company.png в центр 27-й клетки с уменьшением в 1.92 раза + сдвиг вправо на 5 клеток
-            company_img = Image.open("company.png")
-            company_width_mm = company_img.width * 0.264583  # пиксели в мм (96 DPI)
-            company_height_mm = company_img.height * 0.264583
-            
-            # Уменьшаем в 1.33 раза (было 1.6, увеличиваем еще на 20%)
-            company_scaled_width = company_width_mm / 1.33
-            company_scaled_height = company_height_mm / 1.33
-            
-            # Клетка 27 = строка 1, колонка 1 + сдвиг на 5 клеток вправо
-            row_27 = (27 - 1) // 25  # строка 1
-            col_27 = (27 - 1) % 25   # колонка 1
-            
-            # Центр клетки 27 + смещение на 5 клеток вправо + 1.25 клетки правее + 1 клетка вправо + 1/3 клетки вправо
-            x_27_center = (col_27 + 5 + 0.5 + 1.25 + 1 + 1/3) * cell_width_mm * mm
-            y_27_center = (297 - (row_27 + 0.5 + 1) * cell_height_mm) * mm  # на 1 клетку вниз
-            
-            # Смещаем на половину размера изображения для центрирования
-            x_27 = x_27_center - (company_scaled_width * mm / 2)
-            y_27 = y_27_center - (company_scaled_height * mm / 2)
-            
-            # Рисуем company.png
-            overlay_canvas.drawImage("company.png", x_27, y_27, 
-                                   width=company_scaled_width*mm, height=company_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # Добавляем seal.png в центр 590-й клетки с уменьшением в 5 раз
-            seal_img = Image.open("seal.png")
-            seal_width_mm = seal_img.width * 0.264583
-            seal_height_mm = seal_img.height * 0.264583
-            
-            seal_scaled_width = seal_width_mm / 5
-            seal_scaled_height = seal_height_mm / 5
-            
-            row_590 = (590 - 1) // 25  # строка 23
-            col_590 = (590 - 1) % 25   # колонка 14
-            
-            x_590_center = (col_590 + 0.5) * cell_width_mm * mm
-            y_590_center = (297 - (row_590 + 0.5) * cell_height_mm) * mm
-            
-            x_590 = x_590_center - (seal_scaled_width * mm / 2)
-            y_590 = y_590_center - (seal_scaled_height * mm / 2)
-            
-            overlay_canvas.drawImage("seal.png", x_590, y_590, 
-                                   width=seal_scaled_width*mm, height=seal_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # Добавляем sing_1.png в центр 593-й клетки с уменьшением в 5 раз
-            sing1_img = Image.open("sing_1.png")
-            sing1_width_mm = sing1_img.width * 0.264583
-            sing1_height_mm = sing1_img.height * 0.264583
-            
-            sing1_scaled_width = sing1_width_mm / 5
-            sing1_scaled_height = sing1_height_mm / 5
-            
-            row_593 = (593 - 1) // 25  # строка 23
-            col_593 = (593 - 1) % 25   # колонка 17
-            
-            x_593_center = (col_593 + 0.5) * cell_width_mm * mm
-            y_593_center = (297 - (row_593 + 0.5) * cell_height_mm) * mm
-            
-            x_593 = x_593_center - (sing1_scaled_width * mm / 2)
-            y_593 = y_593_center - (sing1_scaled_height * mm / 2)
-            
-            overlay_canvas.drawImage("sing_1.png", x_593, y_593, 
-                                   width=sing1_scaled_width*mm, height=sing1_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            overlay_canvas.save()
-            print("🖼️ Добавлены изображения для garanzia через ReportLab API")
-        
-        elif template_name == 'carta':
-            # Добавляем carta_logo.png в 63-ю клетку с увеличением на 20%
-            carta_logo_img = Image.open("carta_logo.png")
-            carta_logo_width_mm = carta_logo_img.width * 0.264583
-            carta_logo_height_mm = carta_logo_img.height * 0.264583
-            
-            carta_logo_scaled_width = (carta_logo_width_mm / 5) * 1.2 * 0.9  # +20% потом -10%
-            carta_logo_scaled_height = (carta_logo_height_mm / 5) * 1.2 * 0.9
-            
-            row_63 = (63 - 1) // 25  # строка 2
-            col_63 = (63 - 1) % 25   # колонка 12
-            
-            x_63_center = (col_63 + 0.5) * cell_width_mm * mm
-            y_63_center = (297 - (row_63 + 0.5 + 2/3) * cell_height_mm) * mm + (cell_height_mm * mm / 3)  # на 2/3 клетки вниз
-            
-            x_63 = x_63_center - (carta_logo_scaled_width * mm / 2)
-            y_63 = y_63_center - (carta_logo_scaled_height * mm / 2)
-            
-            overlay_canvas.drawImage("carta_logo.png", x_63, y_63, 
-                                   width=carta_logo_scaled_width*mm, height=carta_logo_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # Добавляем seal.png в центр 590-й клетки
-            seal_img = Image.open("seal.png")
-            seal_width_mm = seal_img.width * 0.264583
-            seal_height_mm = seal_img.height * 0.264583
-            
-            seal_scaled_width = seal_width_mm / 5
-            seal_scaled_height = seal_height_mm / 5
-            
-            row_590 = (590 - 1) // 25
-            col_590 = (590 - 1) % 25
-            
-            x_590_center = (col_590 + 0.5) * cell_width_mm * mm
-            y_590_center = (297 - (row_590 + 0.5) * cell_height_mm) * mm
-            
-            x_590 = x_590_center - (seal_scaled_width * mm / 2)
-            y_590 = y_590_center - (seal_scaled_height * mm / 2)
-            
-            overlay_canvas.drawImage("seal.png", x_590, y_590, 
-                                   width=seal_scaled_width*mm, height=seal_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # Добавляем sing_1.png в центр 593-й клетки
-            sing1_img = Image.open("sing_1.png")
-            sing1_width_mm = sing1_img.width * 0.264583
-            sing1_height_mm = sing1_img.height * 0.264583
-            
-            sing1_scaled_width = sing1_width_mm / 5
-            sing1_scaled_height = sing1_height_mm / 5
-            
-            row_593 = (593 - 1) // 25
-            col_593 = (593 - 1) % 25
-            
-            x_593_center = (col_593 + 0.5) * cell_width_mm * mm
-            y_593_center = (297 - (row_593 + 0.5) * cell_height_mm) * mm
-            
-            x_593 = x_593_center - (sing1_scaled_width * mm / 2)
-            y_593 = y_593_center - (sing1_scaled_height * mm / 2)
-            
-            overlay_canvas.drawImage("sing_1.png", x_593, y_593, 
-                                   width=sing1_scaled_width*mm, height=sing1_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            overlay_canvas.save()
-            print("🖼️ Добавлены изображения для carta через ReportLab API")
         
-        elif template_name == 'contratto':
-            # Страница 1 - добавляем company.png и logo.png
-            img = Image.open("company.png")
-            img_width_mm = img.width * 0.264583
-            img_height_mm = img.height * 0.264583
-            
-            scaled_width = (img_width_mm / 2) * 1.44 / 2 / 2 * 0.7  # На 30% меньше
-            scaled_height = (img_height_mm / 2) * 1.44 / 2 / 2 * 0.7
-            
-            row_52 = (52 - 1) // 25 + 1  # строка 3
-            col_52 = (52 - 1) % 25 + 1   # колонка 2
-            
-            x_52 = (col_52 * cell_width_mm - 0.5 * cell_width_mm - (1/6) * cell_width_mm + 0.25 * cell_width_mm + 5 * cell_width_mm + 3 * cell_width_mm + 4 * cell_width_mm + 1 * cell_width_mm) * mm  # +1 клетка правее
-            y_52 = (297 - (row_52 * cell_height_mm + cell_height_mm) + 0.5 * cell_height_mm + 0.25 * cell_height_mm - 1 * cell_height_mm) * mm  # +1 клетка ниже
-            
-            overlay_canvas.drawImage("company.png", x_52, y_52, 
-                                   width=scaled_width*mm, height=scaled_height*mm, 
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # Добавляем logo.png
-            logo_img = Image.open("logo.png")
-            logo_width_mm = logo_img.width * 0.264583
-            logo_height_mm = logo_img.height * 0.264583
-            
-            logo_scaled_width = logo_width_mm / 9
-            logo_scaled_height = logo_height_mm / 9
-            
-            row_71 = (71 - 1) // 25
-            col_71 = (71 - 1) % 25
-            
-            x_71 = (col_71 - 2 + 4 - 1.5 - 8 - 8 - 3 - 1/3) * cell_width_mm * mm  # +1/3 клетки влево
-            y_71 = (297 - (row_71 * cell_height_mm + cell_height_mm) - 0.25 * cell_height_mm - 1 * cell_height_mm - 0.5 * cell_height_mm - 0.25 * cell_height_mm) * mm  # +1/4 клетки вниз
-            
-            overlay_canvas.drawImage("logo.png", x_71, y_71, 
-                                   width=logo_scaled_width*mm, height=logo_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # Нумерация страницы 1
-            row_862_p1 = (862 - 1) // 25
-            col_862_p1 = (862 - 1) % 25
-            
-            x_page_num_p1 = (col_862_p1 + 1 + 0.5) * cell_width_mm * mm
-            y_page_num_p1 = (297 - (row_862_p1 * cell_height_mm + cell_height_mm/2) - 0.25 * cell_height_mm + 0.25 * cell_height_mm) * mm  # на 1/4 клетки вверх
-            
-            overlay_canvas.setFillColorRGB(0, 0, 0)
-            overlay_canvas.setFont("Helvetica", 10)
-            overlay_canvas.drawString(x_page_num_p1-2, y_page_num_p1-2, "1")
-            
-            overlay_canvas.showPage()
-            
-            # Страница 2 - добавляем sing_1.png, seal.png (без logo)
-            
-            # sing_1.png
-            sing1_img = Image.open("sing_1.png")
-            sing1_width_mm = sing1_img.width * 0.264583
-            sing1_height_mm = sing1_img.height * 0.264583
-            
-            sing1_scaled_width = (sing1_width_mm / 6) * 1.1  # +10%
-            sing1_scaled_height = (sing1_height_mm / 6) * 1.1
-            
-            row_628 = (628 - 1) // 25
-            col_628 = (628 - 1) % 25
-            
-            x_628 = (col_628 + 6 + 3 - 1) * cell_width_mm * mm  # на 1 клетку левее
-            y_628 = (297 - (row_628 * cell_height_mm + cell_height_mm) - 2 * cell_height_mm - 1.5 * cell_height_mm + 5 * cell_height_mm + 8 * cell_height_mm + 5 * cell_height_mm + 0.5 * cell_height_mm) * mm  # +1/2 клетки выше
-            
-            overlay_canvas.drawImage("sing_1.png", x_628, y_628, 
-                                   width=sing1_scaled_width*mm, height=sing1_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # seal.png
-            seal_img = Image.open("seal.png")
-            seal_width_mm = seal_img.width * 0.264583
-            seal_height_mm = seal_img.height * 0.264583
-            
-            seal_scaled_width = (seal_width_mm / 7) * 1.3  # +30% больше
-            seal_scaled_height = (seal_height_mm / 7) * 1.3
-            
-            row_682 = (682 - 1) // 25
-            col_682 = (682 - 1) % 25
-            
-            x_682 = (col_682 + 6 + 3) * cell_width_mm * mm  # еще на 3 клетки вправо
-            y_682 = (297 - (row_682 * cell_height_mm + cell_height_mm) - 1.5 * cell_height_mm + 5 * cell_height_mm + 8 * cell_height_mm + 5 * cell_height_mm - 2 * cell_height_mm) * mm  # +2 клетки вниз
-            
-            overlay_canvas.drawImage("seal.png", x_682, y_682, 
-                                   width=seal_scaled_width*mm, height=seal_scaled_height*mm,
-                                   mask='auto', preserveAspectRatio=True)
-            
-            # Нумерация страницы 2
-            row_862 = (862 - 1) // 25
-            col_862 = (862 - 1) % 25
-            
-            x_page_num = (col_862 + 1 + 0.5) * cell_width_mm * mm
-            y_page_num = (297 - (row_862 * cell_height_mm + cell_height_mm/2) - 0.25 * cell_height_mm + 0.25 * cell_height_mm) * mm  # на 1/4 клетки вверх
-            
-            overlay_canvas.setFillColorRGB(0, 0, 0)
-            overlay_canvas.setFont("Helvetica", 10)
-            overlay_canvas.drawString(x_page_num-2, y_page_num-2, "2")
-            
-            overlay_canvas.save()
-            print("🖼️ Добавлены изображения для contratto через ReportLab API")
+        overlay = overlay_pdf(template_name, brand)
+        if overlay is None:
+            print(f"📋 Для {template_name} нет схемы размещения - PDF без изображений")
+            pdf.seek(0)
+            return pdf
         
         # Объединяем PDF с overlay
-        overlay_buffer.seek(0)
-        base_pdf = PdfReader(BytesIO(pdf_bytes))
-        overlay_pdf = PdfReader(overlay_buffer)
+        pdf.seek(0)
+        base_pdf = PdfReader(pdf)
+        overlay_pages = PdfReader(open_stream(overlay)).pages
         
         writer = PdfWriter()
         
         # Накладываем изображения на каждую страницу
         for i, page in enumerate(base_pdf.pages):
-            if i < len(overlay_pdf.pages):
-                page.merge_page(overlay_pdf.pages[i])
+            if i < len(overlay_pages):
+                page.merge_page(overlay_pages[i])
             writer.add_page(page)
         
         # Создаем финальный PDF с изображениями
         final_buffer = BytesIO()
         writer.write(final_buffer)
+        size = final_buffer.tell()
         final_buffer.seek(0)
         
-        print(f"✅ PDF с изображениями создан через API! Размер: {len(final_buffer.getvalue())} байт")
-        return final_buffer
+        print(f"✅ PDF с изображениями создан через API! Размер: {size} байт")
+        
+        # Оптимизация: дедупликация изображений, объектные потоки, линеаризация
+        return optimize_pdf(final_buffer, template_name)
         
     except Exception as e:
         print(f"❌ Ошибка наложения изображений через API: {e}")
         # Возвращаем обычный PDF без изображений
-        buf = BytesIO(pdf_bytes)
-        buf.seek(0)
-        return buf
+        pdf.seek(0)
+        return pdf
+
+
+def template_html(template_name: str, brand: str = None) -> str:
+    """HTML шаблона профиля после fix_html_layout - обрабатывается один раз на профиль в кэше"""
+    def build(profile):
+        stored = artifact_store.get(profile_key(profile, 'html', template_name))
+        return stored.text() if stored is not None else _build_template_html(template_name, profile)
+    return artifact(brand, ('html', template_name), build)
+
+
+def _build_template_html(template_name: str, profile) -> str:
+    html = fix_html_layout(template_name, profile.find(f'{template_name}.html'))
+    if profile.border_color != TEMPLATE_BORDER_COLOR:
+        html = html.replace(TEMPLATE_BORDER_COLOR, profile.border_color)
+    return html
 
 
-def fix_html_layout(template_name='contratto'):
+def build_artifacts(brand_names: list = None) -> ArtifactStore:
+    """
+    Собирает artifact_store текущей версии кода (при сборке образа):
+    шаблоны после fix_html_layout, overlay PDF и уменьшенные изображения печатей
+    для каждого профиля и шаблона. Каталоги прежних версий удаляются.
+    """
+    from brands import get_profile, list_profiles
+    from stamp_layout import downsampled_png, image_key, layout_images
+
+    store = ArtifactStore(artifact_store.directory)
+    if not store.enabled:
+        print("⚠️ ARTIFACT_DIR пуст - хранилище артефактов выключено")
+        return store
+    for name in brand_names or list_profiles():
+        profile = get_profile(name)
+        for template_name in TEMPLATES:
+            # Чего не удалось собрать, соберет рантайм - как без хранилища
+            try:
+                store.put(profile_key(profile, 'html', template_name),
+                          _build_template_html(template_name, profile).encode('utf-8'))
+            except OSError as e:
+                print(f"⚠️ HTML шаблона {template_name} ({name}) не собран: {e}")
+            try:
+                for path, max_px in layout_images(template_name, profile):
+                    store.put(image_key(path, max_px), downsampled_png(path, max_px))
+                overlay = _build_overlay(template_name, profile)
+                if overlay is not None:
+                    store.put(profile_key(profile, 'overlay', template_name), overlay)
+            except Exception as e:
+                print(f"⚠️ Overlay {template_name} ({name}) не собран: {e}")
+    store.save()
+    for version in store.prune():
+        print(f"🗑️ Удалена версия артефактов {version}")
+    print(f"📦 Артефакты {store.version}: {len(store._entries())} в {store.path}")
+    return store
+
+
+@traced('pdf.fix_html_layout')
+def fix_html_layout(template_name='contratto', html_file=None):
     """Исправляем HTML для корректного отображения"""
     
-    # Читаем оригинальный HTML
-    html_file = f'{template_name}.html'
+    # Читаем оригинальный HTML (шаблон профиля бренда или общий)
+    html_file = html_file or f'{template_name}.html'
     with open(html_file, 'r', encoding='utf-8') as f:
         html = f.read()
     
@@ -471,17 +727,7 @@ def fix_html_layout(template_name='contratto'):
         padding: 0 !important;  /* Убираем дополнительные отступы */
         max-width: none !important;  /* Убираем ограничение ширины */
     }
-    
-    /* ТОЛЬКО контроль количества страниц */
-    * {
-        page-break-after: avoid !important;
-        page-break-inside: avoid !important;
-        page-break-before: avoid !important;
-    }
-    
-    @page:nth(2) {
-        display: none !important;
-    }
+
     </style>
     """
         # Вставляем CSS ПЕРЕД закрывающим </head>
@@ -507,21 +753,9 @@ def fix_html_layout(template_name='contratto'):
         line-height: 1.0;  /* Компактная высота строки */
         margin: 0;
         padding: 0;  /* Убираем дополнительные отступы, используем только @page margin */
-        overflow: hidden;  /* Предотвращаем выход за границы */
     }
     
-    /* СТРОГИЙ КОНТРОЛЬ: ТОЛЬКО 1 СТРАНИЦА для carta */
-    * {
-        page-break-after: avoid !important;
-        page-break-inside: avoid !important;
-        page-break-before: avoid !important;
-        overflow: hidden !important;  /* Обрезаем контент если он не помещается */
-    }
-    
-    /* Запрещаем создание страниц после 1-й */
-    @page:nth(2) {
-        display: none !important;
-    }
+    /* 1 страница обеспечивается fit_to_pages (PAGE_BUDGETS), без обрезки контента */
     
     /* ИСПРАВЛЯЕМ ВСЕ ОТСТУПЫ ИЗ HTML - главная проблема! */
     .c11 {
@@ -877,16 +1111,10 @@ def fix_html_layout(template_name='contratto'):
         html = html.replace('class="c5"', 'class="c5" style="height: auto !important;"')
         html = html.replace('class="c9"', 'class="c9" style="height: auto !important;"')
         
-        # КРИТИЧНО: Убираем всё что может создать вторую страницу в конце документа
-        # Ищем закрывающий тег body и убираем всё лишнее перед ним
-        body_end = html.rfind('</body>')
-        if body_end != -1:
-            # Находим последний значимый контент перед </body>
-            content_before_body = html[:body_end].rstrip()
-            # Убираем trailing пустые параграфы и divs
-            content_before_body = re.sub(r'(<p[^>]*><span[^>]*></span></p>\s*)+$', '', content_before_body)
-            content_before_body = re.sub(r'(<div[^>]*></div>\s*)+$', '', content_before_body)
-            html = content_before_body + '\n</body></html>'
+        # КРИТИЧНО: Убираем всё что может создать вторую страницу в конце документа -
+        # пустые параграфы и div перед </body>
+        from template_transform import transform
+        html, _hits = transform(html, ('trailing_empty',))
         
         print("🗑️ Удалены все изображения из carta для предотвращения лишних страниц")
         print("🗑️ Убраны пустые элементы в конце документа для строгого контроля 1 страницы")
@@ -900,76 +1128,14 @@ def fix_html_layout(template_name='contratto'):
     else:
         print("🚫 Для garanzia пропускаем общую очистку таблиц - сохраняем исходные стили")
     
-    # УНИВЕРСАЛЬНЫЙ АНАЛИЗАТОР И УДАЛИТЕЛЬ ПРОБЛЕМНЫХ ЭЛЕМЕНТОВ
-    def analyze_and_fix_problematic_elements(html_content):
-        """
-        Универсальный анализатор, находящий и исправляющий элементы, создающие лишние страницы:
-        1. Элементы с огромными высотами (>500pt)
-        2. Элементы с красными/оранжевыми рамками
-        3. Таблицы с фиксированными высотами строк
-        """
-        print("🔍 Анализируем HTML на предмет проблемных элементов...")
-        
-        # 1. НАХОДИМ И ИСПРАВЛЯЕМ ОГРОМНЫЕ ВЫСОТЫ (>500pt)
-        height_pattern = r'\.([a-zA-Z0-9_-]+)\{[^}]*height:\s*([0-9]+(?:\.[0-9]+)?)pt[^}]*\}'
-        matches = re.findall(height_pattern, html_content)
-        
-        fixed_heights = []
-        for class_name, height_value in matches:
-            height_pt = float(height_value)
-            if height_pt > 500:  # Больше 500pt = проблема
-                old_pattern = f'.{class_name}{{height:{height_value}pt}}'
-                new_pattern = f'.{class_name}{{height:auto;}}'
-                html_content = html_content.replace(old_pattern, new_pattern)
-                fixed_heights.append(f"{class_name}({height_value}pt)")
-        
-        if fixed_heights:
-            print(f"📏 Исправлены огромные высоты: {', '.join(fixed_heights)}")
-        
-        # 2. НАХОДИМ И УБИРАЕМ КРАСНЫЕ РАМКИ #e2001a (встроенные из HTML)
-        # Это нужно чтобы избежать двойных рамок с @page
-        red_border_pattern = r'\.([a-zA-Z0-9_-]+)\{[^}]*border[^}]*#e2001a[^}]*\}'
-        red_border_matches = re.findall(red_border_pattern, html_content, re.IGNORECASE)
-        
-        removed_red_borders = []
-        for class_name in red_border_matches:
-            # Заменяем весь CSS класса на простой без рамки
-            old_class_pattern = rf'\.{re.escape(class_name)}\{{[^}}]+\}}'
-            new_class_css = f'.{class_name}{{border:none !important; padding:5pt;}}'
-            html_content = re.sub(old_class_pattern, new_class_css, html_content)
-            removed_red_borders.append(class_name)
-        
-        if removed_red_borders:
-            print(f"🎨 Убраны встроенные красные рамки #e2001a: {', '.join(removed_red_borders)}")
-        # 3. НАХОДИМ И ИСПРАВЛЯЕМ ТАБЛИЦЫ С ФИКСИРОВАННЫМИ ВЫСОТАМИ СТРОК
-        # Ищем tr с классами, имеющими большие высоты
-        tr_pattern = r'<tr\s+class="([^"]*)"[^>]*>'
-        tr_matches = re.findall(tr_pattern, html_content)
-        
-        fixed_rows = []
-        for tr_class in set(tr_matches):  # Убираем дубли
-            # Проверяем, есть ли у этого класса большая высота в CSS
-            css_pattern = rf'\.{re.escape(tr_class)}\{{[^}}]*height:\s*([0-9]+(?:\.[0-9]+)?)pt[^}}]*\}}'
-            css_match = re.search(css_pattern, html_content)
-            if css_match:
-                height_value = float(css_match.group(1))
-                if height_value > 300:  # Строки таблиц больше 300pt = проблема
-                    old_css = css_match.group(0)
-                    new_css = f'.{tr_class}{{height:auto;}}'
-                    html_content = html_content.replace(old_css, new_css)
-                    fixed_rows.append(f"{tr_class}({height_value}pt)")
-        
-        if fixed_rows:
-            print(f"📋 Исправлены высоты строк таблиц: {', '.join(fixed_rows)}")
-        
-        if not fixed_heights and not removed_red_borders and not fixed_rows:
-            print("✅ Проблемных элементов не найдено")
-        
-        return html_content
-    
-    # Применяем универсальный анализатор ТОЛЬКО для contratto и carta
+    # УНИВЕРСАЛЬНЫЙ АНАЛИЗАТОР ПРОБЛЕМНЫХ ЭЛЕМЕНТОВ: огромные высоты (>500pt),
+    # красные рамки #e2001a, строки таблиц с фиксированной высотой - правила
+    # template_transform, один проход по документу через tinycss2
     if template_name != 'garanzia':
-        html = analyze_and_fix_problematic_elements(html)
+        from template_transform import format_hits, transform
+        print("🔍 Анализируем HTML на предмет проблемных элементов...")
+        html, hits = transform(html)
+        print(f"🔍 {format_hits(hits)}")
     else:
         print("🚫 Для garanzia пропускаем универсальный анализатор - сохраняем исходный HTML")
     
@@ -1076,6 +1242,10 @@ def main():
     
     # Определяем какой шаблон обрабатывать
     template = sys.argv[1] if len(sys.argv) > 1 else 'contratto'
+    configure_reportlab()
+    if template == 'build-artifacts':
+        build_artifacts(sys.argv[2:])
+        return
     
     print(f"🧪 Тестируем PDF конструктор для {template} через API...")
     
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Нативный бэкенд рендеринга на ReportLab platypus, без HTML и WeasyPrint
+Документы с фиксированной структурой верстаются напрямую: те же поля, рамка
+@page цвета профиля бренда и печати по схеме layouts/<шаблон>.json, но за миллисекунды.
+Текст договора повторяет contratto.html - при правке шаблона обновлять оба.
+"""
+
+import os
+from functools import lru_cache
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from stamp_layout import BASE_DIR, draw_page, load_layout
+
+
+# ---------------------- Настройки ------------------------------------------
+FONTS_DIR = os.getenv("PDF_NATIVE_FONTS_DIR", os.path.join(BASE_DIR, "fonts"))
+
+BORDER_WIDTH = 4        # pt, как @page border в fix_html_layout
+PAGE_MARGIN_CM = 1      # @page margin
+BODY_PADDING_CM = 0.2   # .c11 padding слева и справа
+FONT_SIZE = 10
+TITLE_SIZE = 12
+LINE_HEIGHT = 1.15
+EMPTY_LINE_PT = 11      # пустой абзац .c3 (height: 11pt)
+
+
+# Текст договора в разметке Paragraph: {name} и {amount} - поля клиента
+CONTRATTO_PAGES = [
+    [
+        *[('empty', None)] * 6,
+        ('title', "Contratto per la prestazione di servizi di consulenza e investimento"),
+        ('empty', None),
+        ('text', "<b>1. Parti e oggetto del contratto</b><br/>"
+                 "&nbsp;Il presente contratto è concluso tra <b>Chiara Lombardi</b> (di seguito – «Fornitore») e "
+                 "<b>{name}</b> (di seguito – «Cliente»).<br/>"
+                 "&nbsp;Il Fornitore si impegna a fornire al Cliente servizi di consulenza e investimento nel settore "
+                 "delle criptovalute utilizzando le proprie strategie, e il Cliente si impegna a versare l’investimento "
+                 "e a corrispondere il compenso secondo le condizioni del presente contratto."),
+        ('empty', None),
+        ('text', "<b>2. Legislazione applicabile</b><br/>"
+                 "&nbsp;2.1. Il presente contratto è disciplinato dalle norme del <b>Codice Civile italiano</b>, "
+                 "che regolano i rapporti civili e commerciali in Italia.<br/>"
+                 "&nbsp;2.2. Le parti hanno diritto di scegliere la legge applicabile al contratto conformemente al "
+                 "<b>Regolamento CE «Roma I» (Rome I Regulation)</b>, che garantisce la libertà di scelta della legge "
+                 "nei rapporti contrattuali nell’Unione Europea.<br/>"
+                 "&nbsp;2.3. L’attività relativa ai servizi di investimento e finanziari è soggetta alla vigilanza della "
+                 "<b>CONSOB</b> (Commissione Nazionale per le Società e la Borsa), nonché al Regolamento della Banca "
+                 "d’Italia e della CONSOB del 29 ottobre 2007 «Regolamento sull’organizzazione e sulle procedure di "
+                 "prestazione dei servizi di investimento e collettivi»."),
+        ('empty', None),
+        ('text', "<b>3. Trasparenza e garanzie di fiducia</b><br/>"
+                 "&nbsp;3.1. Il Fornitore fornisce al Cliente prove dell’efficacia del proprio operato: testimonianze, "
+                 "risultati dei clienti, materiali di supporto.<br/>"
+                 "&nbsp;3.2. Su richiesta del Cliente, il Fornitore può fornire anche documenti personali che attestino "
+                 "la propria identità e il proprio status legale.<br/>"
+                 "&nbsp;3.3. Il Fornitore è partner ufficiale dell’exchange <b>Bitget</b>, fatto che conferma "
+                 "ulteriormente il suo status professionale e il livello di affidabilità.<br/>"
+                 "&nbsp;3.4. Il Fornitore si impegna, decorso il termine di 5 (cinque) giorni in caso di mancata "
+                 "prestazione dei servizi pattuiti, a restituire integralmente l’importo dell’investimento versato "
+                 "dal Cliente."),
+        ('empty', None),
+        ('text', "<b>4. Validità giuridica del contratto</b><br/>"
+                 "&nbsp;4.1. Il contratto è redatto in forma scritta e sottoscritto da entrambe le parti. Esso ha piena "
+                 "validità giuridica sul territorio italiano in conformità con le norme del Codice Civile italiano.<br/>"
+                 "&nbsp;4.2. In caso di controversie, le parti si impegnano a tentare una risoluzione amichevole. "
+                 "Qualora ciò non fosse possibile, le controversie saranno deferite al tribunale competente in Italia "
+                 "o ad arbitrato, se previsto dal contratto, conformemente al Regolamento «Roma I»."),
+        ('empty', None),
+        ('text', "<b>5. Durata e responsabilità</b><br/>"
+                 "&nbsp;5.1. Il contratto entra in vigore al momento della firma da parte di entrambe le parti e rimane "
+                 "valido fino al completo adempimento degli obblighi.<br/>"
+                 "&nbsp;5.2. Le parti sono responsabili per la violazione delle condizioni contrattuali in conformità "
+                 "alla legislazione vigente in Italia."),
+    ],
+    [
+        ('empty', None),
+        ('text', "<b>6. Importo dell’investimento</b><br/>"
+                 "&nbsp;6.1. Il Cliente versa un investimento pari a: <b>{amount}</b> <b>euro</b> (l’importo viene "
+                 "indicato al momento della firma del contratto).<br/>"
+                 "&nbsp;6.2. L’invio del capitale di investimento avviene sul conto della persona di fiducia indicata "
+                 "dal Fornitore.<br/>"
+                 "&nbsp;6.2.1. Nel caso in cui l’investimento sia effettuato sotto forma di cripto-attività, il "
+                 "trasferimento viene effettuato all’indirizzo del wallet collegato al Fornitore, intestato a "
+                 "<b>Chiara Lombardi</b>.<br/>"
+                 "&nbsp;6.3. L’importo viene utilizzato nell’ambito dei servizi forniti secondo il presente contratto.<br/>"
+                 "&nbsp;6.4. Il Fornitore conferma la ricezione dell’importo e si impegna a lavorare nell’interesse del "
+                 "Cliente in conformità con il presente contratto."),
+        ('empty', None),
+        ('text', "<b>7. Firme delle parti</b>"),
+        ('empty', None),
+        ('text', "&nbsp;Fornitore: Chiara Lombardi _____________________________"),
+        ('empty', None),
+        ('empty', None),
+        ('text', "<br/>&nbsp;Cliente: __________________________________________"),
+    ],
+]
+
+
+@lru_cache(maxsize=None)
+def _fonts() -> tuple:
+    """(обычный, жирный): Roboto Mono из FONTS_DIR, иначе встроенный моноширинный Courier"""
+    from reportlab.lib.fonts import addMapping
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    regular = os.path.join(FONTS_DIR, 'RobotoMono-Regular.ttf')
+    bold = os.path.join(FONTS_DIR, 'RobotoMono-Bold.ttf')
+    if not (os.path.exists(regular) and os.path.exists(bold)):
+        return 'Courier', 'Courier-Bold'
+    pdfmetrics.registerFont(TTFont('RobotoMono', regular))
+    pdfmetrics.registerFont(TTFont('RobotoMono-Bold', bold))
+    addMapping('RobotoMono', 0, 0, 'RobotoMono')
+    addMapping('RobotoMono', 1, 0, 'RobotoMono-Bold')
+    return 'RobotoMono', 'RobotoMono-Bold'
+
+
+@lru_cache(maxsize=None)
+def _styles() -> dict:
+    from reportlab.lib.styles import ParagraphStyle
+
+    regular, bold = _fonts()
+    return {
+        'text': ParagraphStyle('text', fontName=regular, fontSize=FONT_SIZE, leading=FONT_SIZE * LINE_HEIGHT,
+                               spaceBefore=2, spaceAfter=2),
+        'title': ParagraphStyle('title', fontName=bold, fontSize=TITLE_SIZE, leading=TITLE_SIZE * LINE_HEIGHT,
+                                spaceBefore=2, spaceAfter=2),
+    }
+
+
+def warm_up() -> None:
+    """Регистрация шрифтов и сборка стилей до первого документа"""
+    _styles()
+
+
+def _story(pages: list, fields: dict) -> list:
+    from reportlab.platypus import PageBreak, Paragraph, Spacer
+
+    styles = _styles()
+    story = []
+    for page_index, blocks in enumerate(pages):
+        if page_index:
+            story.append(PageBreak())
+        for kind, text in blocks:
+            if kind == 'empty':
+                story.append(Spacer(1, EMPTY_LINE_PT + 1))
+            else:
+                story.append(Paragraph(text.format(**fields), styles[kind]))
+    return story
+
+
+def _page_decorator(layout, border_color: str):
+    """Рамка страницы и печати по схеме - рисуются поверх текста, как overlay в HTML пути"""
+    from reportlab.lib.colors import HexColor
+    from reportlab.lib.units import cm
+
+    def on_page_end(canvas, doc):
+        width, height = doc.pagesize
+        inset = PAGE_MARGIN_CM * cm + BORDER_WIDTH / 2
+        canvas.saveState()
+        canvas.setStrokeColor(HexColor(border_color))
+        canvas.setLineWidth(BORDER_WIDTH)
+        canvas.rect(inset, inset, width - 2 * inset, height - 2 * inset)
+        canvas.restoreState()
+        if layout is not None:
+            draw_page(canvas, layout, canvas.getPageNumber() - 1)
+    return on_page_end
+
+
+def render_contratto(data: dict) -> BytesIO:
+    """
+    Договор contratto целиком на ReportLab (печати и рамка включены)
+
+    Args:
+        data (dict): поля как у generate_contratto_pdf
+
+    Returns:
+        BytesIO: PDF до пост-обработки pdf_optimize
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate
+
+    from brands import get_profile
+    from pdf_costructor import field, format_money
+
+    profile = get_profile(data.get('brand'))
+    width, height = A4
+    edge = PAGE_MARGIN_CM * cm + BORDER_WIDTH
+    frame = Frame(edge + BODY_PADDING_CM * cm, edge, width - 2 * (edge + BODY_PADDING_CM * cm), height - 2 * edge,
+                  leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0, id='body')
+    buffer = BytesIO()
+    doc = BaseDocTemplate(buffer, pagesize=A4, pageCompression=1, title='Contratto',
+                          leftMargin=0, rightMargin=0, topMargin=0, bottomMargin=0)
+    decorator = _page_decorator(load_layout('contratto', profile.name), profile.border_color)
+    doc.addPageTemplates([PageTemplate('contratto', [frame], onPageEnd=decorator)])
+    doc.build(_story(CONTRATTO_PAGES, {
+        'name': escape(field(data['name'])),
+        'amount': escape(field(data['amount'], format_money)),
+    }))
+    buffer.seek(0)
+    return buffer
+
+
+# Шаблоны с нативной версткой: имя -> функция (data) -> BytesIO
+NATIVE_TEMPLATES = {
+    'contratto': render_contratto,
+}
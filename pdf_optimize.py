@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Этап оптимизации PDF после наложения изображений
+Сабсеттинг шрифтов, дедупликация изображений, сжатие потоков,
+объектные потоки и линеаризация (первая страница видна до окончания загрузки)
+"""
+
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+import metrics
+from tracing import traced
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+PDF_OPTIMIZE = os.getenv("PDF_OPTIMIZE", "1") != "0"            # весь этап целиком
+PDF_SUBSET_FONTS = os.getenv("PDF_SUBSET_FONTS", "1") != "0"    # только используемые глифы
+PDF_DEDUP_IMAGES = os.getenv("PDF_DEDUP_IMAGES", "1") != "0"    # одинаковые XObject -> один объект
+PDF_COMPRESS_STREAMS = os.getenv("PDF_COMPRESS_STREAMS", "1") != "0"  # merge_page оставляет потоки несжатыми
+PDF_OBJECT_STREAMS = os.getenv("PDF_OBJECT_STREAMS", "1") != "0"
+PDF_LINEARIZE = os.getenv("PDF_LINEARIZE", "1") != "0"
+
+
+def weasyprint_options() -> dict:
+    """Опции HTML.write_pdf(): сабсеттинг шрифтов и сжатие на стороне WeasyPrint"""
+    if not PDF_OPTIMIZE:
+        return {}
+    return {
+        'full_fonts': not PDF_SUBSET_FONTS,  # False = встраиваем только используемые глифы
+        'hinting': not PDF_SUBSET_FONTS,     # хинтинг не нужен для печати/просмотра
+        'uncompressed_pdf': not PDF_COMPRESS_STREAMS,
+        'optimize_images': True,
+    }
+
+
+def _image_digest(image) -> str:
+    """Хэш изображения: сырые байты потока + словарь (без ссылок) + маска"""
+    h = hashlib.sha256(image.read_raw_bytes())
+    for key in sorted(image.keys()):
+        if key in ('/Length', '/SMask'):
+            continue
+        h.update(f"{key}={image[key]!r};".encode())
+    smask = image.get('/SMask')
+    if smask is not None:
+        h.update(_image_digest(smask).encode())
+    return h.hexdigest()
+
+
+def _dedup_images(pdf) -> int:
+    """Заменяет одинаковые image XObject на одну ссылку. Возвращает число замен"""
+    import pikepdf
+
+    seen = {}
+    replaced = 0
+    for page in pdf.pages:
+        resources = page.obj.get('/Resources')
+        xobjects = resources.get('/XObject') if resources is not None else None
+        if xobjects is None:
+            continue
+        for name in list(xobjects.keys()):
+            xobj = xobjects[name]
+            if xobj.get('/Subtype') != pikepdf.Name.Image or not xobj.is_indirect:
+                continue
+            canonical = seen.setdefault(_image_digest(xobj), xobj)
+            if canonical.objgen != xobj.objgen:
+                xobjects[name] = canonical
+                replaced += 1
+    return replaced
+
+
+@traced('pdf.optimize')
+def optimize_pdf(buffer: BytesIO, template_name: str) -> BytesIO:
+    """
+    Пост-обработка готового PDF через qpdf (pikepdf)
+
+    Args:
+        buffer (BytesIO): PDF после наложения изображений
+        template_name (str): имя шаблона для метрик
+
+    Returns:
+        BytesIO: оптимизированный PDF (или исходный, если этап отключен/недоступен)
+    """
+    size_before = buffer.getbuffer().nbytes
+    metrics.observe('pdf_bytes_before', size_before, template=template_name)
+
+    if not PDF_OPTIMIZE:
+        metrics.observe('pdf_bytes_after', size_before, template=template_name)
+        return buffer
+
+    try:
+        import pikepdf
+    except ImportError:
+        logger.warning("⚠️ pikepdf не установлен - объектные потоки и линеаризация пропущены")
+        metrics.inc('pdf_optimize_skipped', template=template_name)
+        metrics.observe('pdf_bytes_after', size_before, template=template_name)
+        return buffer
+
+    try:
+        buffer.seek(0)
+        with pikepdf.open(buffer) as pdf:
+            replaced = _dedup_images(pdf) if PDF_DEDUP_IMAGES else 0
+            pdf.remove_unreferenced_resources()
+
+            out = BytesIO()
+            pdf.save(
+                out,
+                compress_streams=PDF_COMPRESS_STREAMS,
+                object_stream_mode=(pikepdf.ObjectStreamMode.generate if PDF_OBJECT_STREAMS
+                                    else pikepdf.ObjectStreamMode.preserve),
+                linearize=PDF_LINEARIZE,
+            )
+    except Exception as e:
+        logger.warning("⚠️ Ошибка оптимизации PDF, отдаем исходный: %s", e)
+        metrics.inc('pdf_optimize_errors', template=template_name)
+        metrics.observe('pdf_bytes_after', size_before, template=template_name)
+        buffer.seek(0)
+        return buffer
+
+    size_after = out.tell()
+    # Линеаризация добавляет hint-таблицы; без нее берем меньший вариант
+    if size_after >= size_before and not PDF_LINEARIZE:
+        out = buffer
+        size_after = size_before
+    out.seek(0)
+
+    metrics.observe('pdf_bytes_after', size_after, template=template_name)
+    metrics.inc('pdf_images_deduplicated', replaced, template=template_name)
+    logger.info("🗜️ PDF %s оптимизирован: %d -> %d байт (дубликатов изображений: %d)",
+                template_name, size_before, size_after, replaced)
+    return out
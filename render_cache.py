@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Кэш готовых PDF по хэшу входных данных
+Ключ учитывает шаблон, данные клиента, дату в документе и версию кода/ассетов,
+поэтому одинаковый запрос в тот же день отдается без повторного рендеринга.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import metrics
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RENDER_CACHE_MB = float(os.getenv("RENDER_CACHE_MB", "64"))
+
+# Файлы, изменение которых меняет результат рендеринга
+VERSION_GLOBS = ('*.py', '*.html', '*.png', 'layouts/*.json',
+                 'brands/*/*.json', 'brands/*/*.html', 'brands/*/*.png', 'brands/*/layouts/*.json')
+
+
+@lru_cache(maxsize=1)
+def code_version() -> str:
+    """Хэш исходников, шаблонов и ассетов - меняется при каждом деплое с изменениями"""
+    import glob
+
+    h = hashlib.sha256()
+    for pattern in VERSION_GLOBS:
+        for path in sorted(glob.glob(os.path.join(BASE_DIR, pattern))):
+            h.update(os.path.relpath(path, BASE_DIR).encode())
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def content_key(template_name: str, data: dict) -> str:
+    """Хэш входных данных документа (используется и как ETag)"""
+    from pdf_costructor import format_date
+
+    payload = json.dumps(
+        {'template': template_name, 'data': data, 'date': format_date(), 'version': code_version()},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def stable_key(template_name: str, data: dict) -> str:
+    """Хэш только шаблона и данных клиента: находит документ прошлого дня или версии"""
+    payload = json.dumps({'template': template_name, 'data': data},
+                         sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """LRU кэш байтов PDF, ограниченный суммарным размером"""
+
+    def __init__(self, max_mb: float = RENDER_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # stable_key -> последний ключ содержимого и обратно (для выдачи устаревшей копии)
+        self._latest = {}
+        self._stable_of = {}
+
+    def get(self, key: str):
+        with self._lock:
+            payload = self._items.get(key)
+            if payload is not None:
+                self._items.move_to_end(key)
+        metrics.inc('render_cache_hits' if payload is not None else 'render_cache_misses')
+        return payload
+
+    def put(self, key: str, payload: bytes, stable: str = None) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = payload
+            self._size += len(payload)
+            if stable is not None:
+                self._latest[stable] = key
+                self._stable_of[key] = stable
+            while self._size > self.max_bytes:
+                evicted_key, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+                evicted_stable = self._stable_of.pop(evicted_key, None)
+                if evicted_stable is not None and self._latest.get(evicted_stable) == evicted_key:
+                    del self._latest[evicted_stable]
+            metrics.set_gauge('render_cache_bytes', self._size)
+
+    def get_latest(self, stable: str):
+        """Последний документ с теми же данными клиента (возможно, с другой датой или версией)"""
+        with self._lock:
+            key = self._latest.get(stable)
+            return self._items.get(key) if key is not None else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._latest.clear()
+            self._stable_of.clear()
+            self._size = 0
+            metrics.set_gauge('render_cache_bytes', 0)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Рендеринг с дедлайном и деградацией
+Запрос получает срок RENDER_DEADLINE_S. Если полный документ к сроку не готов,
+отдается самый дешевый из доступных результатов:
+   1. базовый PDF без печатей - воркер сам пропускает наложение, если не успевает
+   2. документ с теми же данными из кэша (прошлого дня или прошлой версии)
+   3. заранее отрендеренная общая версия шаблона с пустыми полями
+Деградация помечается для оператора и считается в метриках render_degraded.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from typing import NamedTuple
+
+import metrics
+import tracing
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+RENDER_DEADLINE_S = float(os.getenv("RENDER_DEADLINE_S", "20"))          # 0 = без дедлайна
+RENDER_STAMP_BUDGET_S = float(os.getenv("RENDER_STAMP_BUDGET_S", "2"))   # запас на печати и оптимизацию
+RENDER_GENERIC = os.getenv("RENDER_GENERIC", "1") != "0"                 # готовить общие версии
+
+# Причины деградации (метка метрик и ключ подписи для оператора)
+STAMPS_SKIPPED = 'stamps_skipped'
+STALE_CACHE = 'stale_cache'
+GENERIC = 'generic'
+
+# Данные общей версии: None - пустая линия в документе, заполняется от руки
+GENERIC_DATA = {
+    'contratto': {'name': None, 'amount': None, 'duration': None, 'tan': None, 'taeg': None, 'payment': None},
+    'garanzia': {'name': None},
+    'carta': {'name': None, 'amount': None, 'duration': None, 'tan': None, 'payment': None},
+}
+
+
+class RenderTimeout(Exception):
+    """Срок вышел, а подменить документ нечем"""
+
+
+class _Scope:
+    def __init__(self, deadline: float = None):
+        self.deadline = deadline
+        self.degraded = []
+
+
+_scope = contextvars.ContextVar('render_deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline: float = None):
+    """Срок (time.time()) для стадий рендера в этом контексте; собирает причины деградации"""
+    scope = _Scope(deadline)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def time_left():
+    """Секунд до срока текущего рендера (None - срока нет)"""
+    scope = _scope.get()
+    if scope is None or scope.deadline is None:
+        return None
+    return scope.deadline - time.time()
+
+
+def should_skip_stamps() -> bool:
+    """
+    Пропустить печати, чтобы успеть к сроку
+
+    Если срок уже прошел, вызывающий давно получил замену - документ
+    рендерится полностью, чтобы попасть в кэш для следующего запроса.
+    """
+    left = time_left()
+    return left is not None and 0 < left < RENDER_STAMP_BUDGET_S
+
+
+def mark_degraded(reason: str) -> None:
+    scope = _scope.get()
+    if scope is not None and reason not in scope.degraded:
+        scope.degraded.append(reason)
+
+
+class RenderOutcome(NamedTuple):
+    """Итог запроса: байты PDF, откуда они, и причина деградации (None - полный документ)"""
+    payload: bytes
+    source: str            # 'cache', 'render' или причина деградации
+    degraded: str = None
+    key: str = None        # ключ содержимого (ETag) для полного документа
+
+
+class GenericDocuments:
+    """
+    Общие версии шаблонов с пустыми полями - последний рубеж при пропуске срока
+    Хранятся по профилю бренда: документ чужого бренда хуже, чем отказ по сроку.
+    """
+
+    def __init__(self):
+        self._items = {}
+
+    async def prepare(self, pool, templates=None, brand: str = None) -> None:
+        """Рендерит общие версии через пул (один раз после прогрева; готовые - не повторно)"""
+        from brands import brand_name
+
+        if not RENDER_GENERIC:
+            return
+        for template_name in templates or GENERIC_DATA:
+            data = dict(GENERIC_DATA[template_name], brand=brand_name(brand))
+            if (template_name, data['brand']) in self._items:
+                continue
+            try:
+                payload = await pool.render_bytes(template_name, data)
+                self._items[template_name, data['brand']] = payload
+                logger.info("📄 Общая версия %s (%s) готова (%d байт)", template_name, data['brand'], len(payload))
+            except Exception as e:
+                logger.warning("⚠️ Общая версия %s не отрендерилась: %s", template_name, e)
+
+    def get(self, template_name: str, brand: str = None):
+        from brands import brand_name
+
+        return self._items.get((template_name, brand_name(brand)))
+
+
+def _store_late(cache, template_name: str, key: str, stable: str, future: asyncio.Future) -> None:
+    """Опоздавший полный документ кладем в кэш - следующий запрос получит его сразу"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if not result.degraded:
+        cache.put(key, result.payload, stable)
+        metrics.inc('render_late_cached', template=template_name)
+
+
+async def render_with_deadline(pool, cache, template_name: str, data: dict, deadline_s: float = None,
+                               generic: GenericDocuments = None) -> RenderOutcome:
+    """
+    Рендер через кэш и пул с ограничением по времени
+
+    Args:
+        pool: RenderPool
+        cache: RenderCache
+        template_name (str): шаблон
+        data (dict): данные клиента
+        deadline_s (float): срок в секундах (по умолчанию RENDER_DEADLINE_S, 0 - без срока)
+        generic (GenericDocuments): общие версии для последнего рубежа
+
+    Returns:
+        RenderOutcome: документ и отметка о деградации
+
+    Raises:
+        RenderTimeout: срок вышел, замены нет
+    """
+    from render_cache import content_key, stable_key
+
+    deadline_s = RENDER_DEADLINE_S if deadline_s is None else deadline_s
+    with tracing.span('render.deadline', template=template_name, deadline_s=deadline_s) as attrs:
+        key = content_key(template_name, data)
+        payload = cache.get(key)
+        if payload is not None:
+            attrs['source'] = 'cache'
+            return RenderOutcome(payload, 'cache', key=key)
+
+        stable = stable_key(template_name, data)
+        deadline = time.time() + deadline_s if deadline_s > 0 else None
+        job = pool.submit(template_name, data, deadline=deadline)
+        waiter = asyncio.wrap_future(job)
+        done, _ = await asyncio.wait({waiter}, timeout=deadline_s if deadline else None)
+
+        if done:
+            result = waiter.result()
+            if result.degraded:
+                reason = result.degraded[0]
+                metrics.inc('render_degraded', template=template_name, reason=reason)
+                attrs['source'] = attrs['degraded'] = reason
+                return RenderOutcome(result.payload, reason, reason)
+            cache.put(key, result.payload, stable)
+            attrs['source'] = 'render'
+            return RenderOutcome(result.payload, 'render', key=key)
+
+        # Срок вышел: задача из очереди снимается, начатая - дорабатывает в кэш
+        metrics.inc('render_deadline_missed', template=template_name)
+        if not job.cancel():
+            waiter.add_done_callback(lambda f: _store_late(cache, template_name, key, stable, f))
+
+        payload, reason = cache.get_latest(stable), STALE_CACHE
+        if payload is None and generic is not None:
+            payload, reason = generic.get(template_name, data.get('brand')), GENERIC
+        if payload is None:
+            attrs['source'] = 'timeout'
+            raise RenderTimeout(f"render of {template_name} missed the {deadline_s:g}s deadline")
+
+        metrics.inc('render_degraded', template=template_name, reason=reason)
+        logger.warning("⏱️ %s не успел за %g с - выдана замена: %s", template_name, deadline_s, reason)
+        attrs['source'] = attrs['degraded'] = reason
+        return RenderOutcome(payload, reason, reason)
@@ -0,0 +1,777 @@
+#!/usr/bin/env python3
+"""
+Пул процессов рендеринга PDF с контролем памяти
+Воркеры считают свой RSS и пик tracemalloc на каждый документ и уходят на покой
+после N задач или при превышении потолка памяти. Замена порождается из
+заранее прогретого forkserver, а не из разросшегося процесса бота.
+При RENDER_WORKERS=auto пул сам выбирает размер: первый воркер делает пробный
+рендер и меряет пиковый RSS, а число воркеров следует из лимитов CPU и памяти
+cgroup (resource_limits). Под очередью пул растет до этого предела, после
+простоя сокращается и освобождает кэши.
+Очередь общая для всех ботов процесса, но справедливая: задачи каждого
+арендатора (бота) в своей очереди, воркеры берут их по кругу.
+"""
+
+import asyncio
+import contextvars
+import functools
+import gc
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import NamedTuple
+
+import metrics
+import resource_limits
+import tracing
+from render_deadline import deadline_scope
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+RENDER_WORKERS = os.getenv("RENDER_WORKERS", "auto")              # auto - по лимитам; число - фиксированный пул; 0 = в потоке
+RENDER_MIN_WORKERS = int(os.getenv("RENDER_MIN_WORKERS", "1"))    # auto: меньше после простоя не бывает
+RENDER_MAX_WORKERS = int(os.getenv("RENDER_MAX_WORKERS", "0"))    # auto: верхний предел (0 = только лимиты)
+RENDER_IDLE_S = float(os.getenv("RENDER_IDLE_S", "300"))          # auto: простой до сокращения и сброса кэшей (0 = никогда)
+RENDER_MEMORY_RESERVE_MB = float(os.getenv("RENDER_MEMORY_RESERVE_MB", "100"))  # auto: запас памяти сверх воркеров
+RENDER_MAX_JOBS = int(os.getenv("RENDER_MAX_JOBS", "50"))         # задач до плановой замены воркера
+RENDER_MAX_RSS_MB = float(os.getenv("RENDER_MAX_RSS_MB", "450"))  # потолок RSS воркера
+RENDER_TRACEMALLOC = os.getenv("RENDER_TRACEMALLOC", "0") != "0"  # пик аллокаций Python на документ
+RENDER_HARD_TIMEOUT_S = float(os.getenv("RENDER_HARD_TIMEOUT_S", "120"))  # зависший воркер убивается
+RENDER_INLINE_THREADS = int(os.getenv("RENDER_INLINE_THREADS", "4"))     # потоков при RENDER_WORKERS=0
+RENDER_SPLIT_PAGES = os.getenv("RENDER_SPLIT_PAGES", "0") != "0"         # части документа - в разные воркеры
+
+# Модули, которые forkserver импортирует один раз; все воркеры стартуют уже прогретыми
+PRELOAD_MODULES = ['render_preload']
+
+MB = 1024 * 1024
+
+# Арендатор задач (имя бота): задается обработчиком апдейта, наследуется задачами asyncio
+render_tenant = contextvars.ContextVar('render_tenant', default='')
+
+
+def peak_rss() -> int:
+    """Пиковый RSS процесса в байтах (VmHWM; сбрасывается reset_peak_rss)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss() -> None:
+    """Сброс VmHWM до текущего RSS - пик следующего документа меряется отдельно (Linux 4.0+)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def current_rss() -> int:
+    """Текущий RSS процесса в байтах"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # На не-Linux доступен только пиковый RSS (в КБ на Linux, в байтах на macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RenderJob(NamedTuple):
+    """Задача воркеру (пиклится через Pipe)"""
+    template_name: str
+    data: dict
+    profile_tag: str = None
+    trace_context: tuple = None
+    deadline: float = None    # time.time() срока или None
+    stage: str = 'document'   # 'document', 'part' (HTML одной части) или 'assemble' (склейка частей)
+    tenant: str = ''          # бот, поставивший задачу (справедливая очередь, метки метрик)
+
+
+class RenderResult(NamedTuple):
+    """Результат рендера: байты PDF, причины деградации (пусто - полный документ), страниц в части"""
+    payload: bytes
+    degraded: tuple = ()
+    pages: int = 0
+
+
+def _run_job(job: RenderJob) -> RenderResult:
+    """Рендер одной задачи в текущем процессе: трасса и дедлайн задачи"""
+    import pdf_costructor
+
+    # Спаны стадий рендера продолжают трассу апдейта из процесса бота
+    with tracing.attach(job.trace_context), deadline_scope(job.deadline) as scope, \
+            tracing.span('render.worker', template=job.template_name, stage=job.stage, pid=os.getpid()):
+        pages = 0
+        if job.stage == 'part':
+            buffer, pages = pdf_costructor.render_html(job.data['html'], job.template_name)
+        elif job.stage == 'assemble':
+            buffer = pdf_costructor.assemble_parts(job.template_name, job.data['parts'], job.data.get('brand'))
+        else:
+            buffer = pdf_costructor.render_document(job.template_name, job.data, job.profile_tag)
+    # getvalue() без экспортов буфера отдает его же байты, без копии
+    return RenderResult(buffer.getvalue(), tuple(scope.degraded), pages)
+
+
+def _probe() -> None:
+    """Пробный рендер общих версий шаблонов - по нему пул узнает пиковый RSS воркера"""
+    from render_deadline import GENERIC_DATA
+
+    for template_name, data in GENERIC_DATA.items():
+        try:
+            _run_job(RenderJob(template_name, dict(data)))
+        except Exception as e:
+            print(f"⚠️ Пробный рендер {template_name} не удался: {e}")
+
+
+def _worker_main(conn, trace_malloc: bool, probe: bool = False) -> None:
+    """Цикл воркера: прогрев (и пробный рендер), затем задачи из канала до сигнала None"""
+    import pdf_costructor
+
+    if trace_malloc:
+        tracemalloc.start()
+    try:
+        pdf_costructor.warm_up()
+    except Exception as e:
+        print(f"⚠️ Прогрев воркера не удался: {e}")
+    reset_peak_rss()
+    if probe:
+        _probe()
+    conn.send({'pid': os.getpid(), 'rss': current_rss(), 'peak_rss': peak_rss()})
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        if trace_malloc:
+            tracemalloc.reset_peak()
+        reset_peak_rss()
+        started = time.perf_counter()
+        result, error = None, None
+        try:
+            result = _run_job(job)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        # PDF идет отдельным сообщением send_bytes: pickle скопировал бы его
+        # в поток при отправке и еще раз при разборе в процессе бота
+        conn.send({
+            'result': result._replace(payload=None) if result else None,
+            'error': error,
+            'seconds': time.perf_counter() - started,
+            'rss': current_rss(),
+            'peak_rss': peak_rss(),
+            'tracemalloc_peak': tracemalloc.get_traced_memory()[1] if trace_malloc else None,
+        })
+        if result:
+            conn.send_bytes(result.payload)
+    conn.close()
+
+
+class FairQueue:
+    """
+    Очередь задач с круговым обходом арендаторов: у каждого своя FIFO очередь,
+    get берет по одной задаче у каждого по очереди - всплеск одного бота
+    не задерживает документы остальных. None (остановка) выдается только
+    после всех задач, как в обычной FIFO очереди.
+    """
+
+    def __init__(self):
+        self._lanes = OrderedDict()   # арендатор -> deque задач; первый - следующий на выдачу
+        self._stops = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def put(self, item, tenant: str = '') -> None:
+        with self._cond:
+            if item is None:
+                self._stops.append(item)
+            else:
+                self._lanes.setdefault(tenant, deque()).append(item)
+                self._size += 1
+            self._cond.notify()
+
+    def get(self, timeout: float = None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._size or self._stops, timeout):
+                raise queue.Empty
+            if not self._size:
+                return self._stops.popleft()
+            tenant, lane = next(iter(self._lanes.items()))
+            item = lane.popleft()
+            self._size -= 1
+            if lane:
+                self._lanes.move_to_end(tenant)
+            else:
+                del self._lanes[tenant]
+            return item
+
+    def qsize(self) -> int:
+        return self._size
+
+
+class RenderError(Exception):
+    """Ошибка рендеринга внутри воркера"""
+
+
+class _WorkerSlot:
+    """Слот пула: поток-диспетчер и текущий процесс-воркер"""
+
+    def __init__(self, pool: 'RenderPool', index: int):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.jobs_done = 0
+        self.thread = threading.Thread(target=self._run, name=f"render-slot-{index}", daemon=True)
+
+    def spawn(self, probe: bool = False) -> None:
+        parent_conn, child_conn = self.pool.ctx.Pipe()
+        self.process = self.pool.ctx.Process(
+            target=_worker_main, args=(child_conn, self.pool.trace_malloc, probe),
+            name=f"render-worker-{self.index}", daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.jobs_done = 0
+        hello = self.conn.recv()
+        metrics.inc('render_worker_spawned')
+        logger.info("🧩 Воркер %d запущен (pid %s, RSS %.1f МБ)",
+                    self.index, hello['pid'], hello['rss'] / MB)
+        if probe:
+            logger.info("🧪 Пробный рендер: пик RSS воркера %.1f МБ", hello['peak_rss'] / MB)
+            self.pool.note_peak(hello['peak_rss'])
+
+    def respawn(self) -> None:
+        """
+        Замена воркера после вывода. Если замена не поднялась (например, OOM при
+        прогреве), ошибка только логируется: поток слота должен жить дальше,
+        а _process поднимет воркер к следующей задаче.
+        """
+        try:
+            self.spawn()
+        except Exception as e:
+            metrics.inc('render_worker_spawn_failed')
+            logger.error("💥 Замена воркера %d не запустилась: %s", self.index, e)
+            if self.process is not None and self.process.is_alive():
+                self.process.terminate()
+                self.process.join(timeout=1)
+            if self.conn is not None:
+                self.conn.close()
+            self.process, self.conn = None, None
+
+    def retire(self, reason: str, detail: str = '') -> None:
+        """Плавно останавливает воркер: он дорабатывает текущую задачу и выходит"""
+        if self.process is None:
+            return
+        pid = self.process.pid
+        try:
+            self.conn.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.process, self.conn = None, None
+        if reason != 'shutdown':
+            metrics.inc('render_worker_recycled', reason=reason)
+            logger.info("♻️ Воркер %d (pid %s) выведен: %s", self.index, pid, detail or reason)
+
+    def _run(self) -> None:
+        if self.process is None and not self.pool.closed:
+            # Слот добавлен под нагрузкой: воркер прогревается здесь, не задерживая очередь
+            try:
+                self.spawn()
+            except Exception as e:
+                logger.error("💥 Воркер %d не запустился: %s", self.index, e)
+            finally:
+                self.pool.spawned(self)
+            if self.process is None:
+                return
+        while True:
+            try:
+                job = self.pool.jobs.get(timeout=self.pool.idle_timeout or None)
+            except queue.Empty:
+                if self.pool.on_idle(self):
+                    return
+                continue
+            if job is None:
+                self.retire('shutdown')
+                return
+            with self.pool.lock:
+                self.pool.busy += 1
+            try:
+                self._process(*job)
+            finally:
+                with self.pool.lock:
+                    self.pool.busy -= 1
+
+    def _process(self, job: RenderJob, future: Future, enqueued: float, enqueued_ns: int) -> None:
+        template_name = job.template_name
+        if not future.set_running_or_notify_cancel():
+            metrics.inc('render_jobs_cancelled', template=template_name)
+            return
+        metrics.observe('render_queue_wait_seconds', time.perf_counter() - enqueued, bot=job.tenant)
+        tracing.record_span('render.queue_wait', enqueued_ns, time.time_ns(), job.trace_context,
+                            template=template_name, slot=self.index)
+        try:
+            if self.process is None:
+                self.spawn()
+            self.conn.send(job)
+            if not self.conn.poll(self.pool.hard_timeout or None):
+                self._kill_stuck(template_name, future)
+                return
+            result = self.conn.recv()
+            if result['result'] is not None:
+                result['result'] = result['result']._replace(payload=self.conn.recv_bytes())
+        except (EOFError, OSError) as e:
+            # Воркер умер посреди задачи (например, OOM-killer)
+            metrics.inc('render_worker_recycled', reason='crashed')
+            logger.error("💥 Воркер %d упал во время %s: %s", self.index, template_name, e)
+            if self.process is not None:
+                self.process.join(timeout=1)
+            self.process, self.conn = None, None
+            future.set_exception(RenderError(f"render worker crashed: {e}"))
+            return
+
+        self.jobs_done += 1
+        self._record(template_name, result)
+        if result['error']:
+            future.set_exception(RenderError(result['error']))
+        else:
+            future.set_result(result['result'])
+
+        if self.jobs_done >= self.pool.max_jobs:
+            self.retire('max_jobs', f"лимит задач {self.pool.max_jobs}")
+        elif result['rss'] > self.pool.max_rss:
+            self.retire('max_rss', f"RSS {result['rss'] / MB:.1f} МБ > {self.pool.max_rss / MB:.0f} МБ")
+        if self.process is None and not self.pool.closed:
+            self.respawn()  # замена готова до следующей задачи
+
+    def _kill_stuck(self, template_name: str, future: Future) -> None:
+        """Воркер не ответил за RENDER_HARD_TIMEOUT_S: убиваем, замена поднимется к следующей задаче"""
+        pid = self.process.pid
+        self.process.terminate()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process, self.conn = None, None
+        metrics.inc('render_worker_recycled', reason='timeout')
+        logger.error("⏱️ Воркер %d (pid %s) завис на %s дольше %g с - остановлен",
+                     self.index, pid, template_name, self.pool.hard_timeout)
+        future.set_exception(RenderError(f"render timed out after {self.pool.hard_timeout:g}s"))
+
+    def _record(self, template_name: str, result: dict) -> None:
+        """Телеметрия памяти по документу и high-water marks по шаблону"""
+        rss = result['rss']
+        metrics.observe('render_seconds', result['seconds'], template=template_name)
+        metrics.observe('render_worker_rss_bytes', rss, template=template_name)
+        metrics.observe('render_worker_peak_rss_bytes', result['peak_rss'], template=template_name)
+        self.pool.note_peak(result['peak_rss'])
+        if metrics.max_gauge('render_rss_high_water_bytes', rss, template=template_name):
+            logger.info("📈 Новый максимум RSS для %s: %.1f МБ", template_name, rss / MB)
+        peak = result['tracemalloc_peak']
+        if peak is not None:
+            metrics.observe('render_tracemalloc_peak_bytes', peak, template=template_name)
+            if metrics.max_gauge('render_tracemalloc_high_water_bytes', peak, template=template_name):
+                logger.info("📈 Новый пик tracemalloc для %s: %.1f МБ", template_name, peak / MB)
+
+
+class _SplitFuture(Future):
+    """
+    Итог документа, разделенного на части. cancel() ведет себя как у одной
+    задачи: снимает части из очереди и не удается, если какая-то уже рендерится.
+    """
+
+    def __init__(self, parts: list):
+        super().__init__()
+        self.parts = parts
+        self.follow_up = None  # склейка частей или рендер целиком
+
+    def cancel(self) -> bool:
+        if self.done():
+            return self.cancelled()
+        if self.follow_up is not None:
+            return self.follow_up.cancel() and self.cancel_now()
+        # Начатый документ дорабатывает целиком - иначе результат не попадет в кэш;
+        # готовые части (в том числе из page_cache) отмене не мешают
+        if any(f.running() for f in self.parts):
+            return False
+        if not all([f.cancel() for f in self.parts if not f.done()]):
+            return False
+        return self.cancel_now()
+
+    def cancel_now(self) -> bool:
+        return super().cancel()
+
+
+class RenderPool:
+    """
+    Пул воркеров рендеринга
+
+    Args:
+        size (int): число процессов (0 = рендер в потоке текущего процесса, 'auto' - по лимитам)
+        max_jobs (int): задач до плановой замены воркера
+        max_rss_mb (float): потолок RSS воркера в МБ
+        trace_malloc (bool): включить tracemalloc в воркерах
+        hard_timeout (float): жесткий потолок задачи в секундах, зависший воркер убивается
+        split_pages (bool): многостраничные шаблоны рендерить частями в разных воркерах
+    """
+
+    def __init__(self, size: int = None, max_jobs: int = None, max_rss_mb: float = None,
+                 trace_malloc: bool = None, hard_timeout: float = None, split_pages: bool = None):
+        workers = RENDER_WORKERS if size is None else size
+        self.autoscale = str(workers).strip().lower() == 'auto'
+        self.min_size = max(RENDER_MIN_WORKERS, 1)
+        self.size = self.min_size if self.autoscale else int(workers)
+        self.max_jobs = max_jobs or RENDER_MAX_JOBS
+        self.max_rss = (max_rss_mb or RENDER_MAX_RSS_MB) * MB
+        self.trace_malloc = RENDER_TRACEMALLOC if trace_malloc is None else trace_malloc
+        self.hard_timeout = RENDER_HARD_TIMEOUT_S if hard_timeout is None else hard_timeout
+        self.split_pages = RENDER_SPLIT_PAGES if split_pages is None else split_pages
+        self.jobs = FairQueue()
+        self.slots = []
+        self.closed = False
+        self.ctx = None
+        self.inline = None  # ThreadPoolExecutor в режиме без процессов
+        self.state = 'idle'  # idle -> warming -> ready -> stopped
+        # Авторазмер: занятые и прогревающиеся слоты, пик RSS воркера, время последней задачи
+        self.idle_timeout = RENDER_IDLE_S if self.autoscale else 0
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.spawning = 0
+        self.worker_peak = 0
+        self.last_activity = time.monotonic()
+        self.released = False
+        self._held = None   # причина, по которой пул не вырос (логируется при смене)
+
+    def start(self) -> 'RenderPool':
+        """Поднимает forkserver с предзагрузкой и воркеры"""
+        self.state = 'warming'
+        if self.size <= 0:
+            from stamp_layout import configure_reportlab
+
+            # Рендер в этом процессе: настройки ReportLab - как у воркеров после warm_up
+            configure_reportlab()
+            self.inline = ThreadPoolExecutor(RENDER_INLINE_THREADS, thread_name_prefix='render-inline')
+            logger.info("🧵 Пул рендеринга в режиме без процессов (%d потоков)", RENDER_INLINE_THREADS)
+            self.state = 'ready'
+            return self
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.ctx = multiprocessing.get_context('forkserver')
+            self.ctx.set_forkserver_preload(PRELOAD_MODULES)
+        else:
+            self.ctx = multiprocessing.get_context('spawn')
+        if self.autoscale:
+            self._add_slot(probe=True)
+            target, reason = self.capacity()
+            logger.info("📐 Размер пула рендеринга: %d воркеров (%s)", target, reason)
+        else:
+            target = self.size
+        while len(self.slots) < target:
+            self._add_slot()
+        self.state = 'ready'
+        logger.info("🏭 Пул рендеринга: %d воркеров%s, замена после %d задач или %.0f МБ RSS",
+                    self.size, ' (авторазмер)' if self.autoscale else '', self.max_jobs, self.max_rss / MB)
+        return self
+
+    def _add_slot(self, probe: bool = False, spawn: bool = True) -> '_WorkerSlot':
+        """Новый слот: spawn=False - воркер поднимется в потоке слота"""
+        with self.lock:
+            index = max((slot.index for slot in self.slots), default=-1) + 1
+            slot = _WorkerSlot(self, index)
+            if not spawn:
+                self.spawning += 1
+        if spawn:
+            slot.spawn(probe)
+        with self.lock:
+            self.slots.append(slot)
+            self.size = len(self.slots)
+        slot.thread.start()
+        metrics.set_gauge('render_workers', self.size)
+        return slot
+
+    def spawned(self, slot: '_WorkerSlot') -> None:
+        """Слот, добавленный под нагрузкой, закончил прогрев (или не смог запуститься)"""
+        with self.lock:
+            self.spawning -= 1
+            if slot.process is None and slot in self.slots:
+                self.slots.remove(slot)
+                self.size = len(self.slots)
+        metrics.set_gauge('render_workers', self.size)
+
+    def note_peak(self, peak: int) -> None:
+        """High-water mark пикового RSS воркера - по нему считается, сколько воркеров влезет"""
+        if peak and peak > self.worker_peak:
+            self.worker_peak = peak
+            metrics.set_gauge('render_worker_peak_rss_high_water_bytes', peak)
+
+    def capacity(self) -> tuple:
+        """
+        Сколько воркеров выдержат лимиты: по одному на ядро квоты CPU и столько,
+        сколько пиков RSS воркера помещается в лимит памяти за вычетом бота и запаса
+
+        Returns:
+            tuple: (число воркеров, пояснение для лога)
+        """
+        cpus = resource_limits.cpu_limit()
+        limit = resource_limits.memory_limit()
+        per_worker = self.worker_peak or self.max_rss
+        target = max(int(cpus), 1)
+        reason = f"CPU {cpus:g}"
+        if limit:
+            spare = limit - current_rss() - RENDER_MEMORY_RESERVE_MB * MB
+            target = min(target, int(spare // per_worker))
+            reason += f", память {limit / MB:.0f} МБ, пик воркера {per_worker / MB:.0f} МБ"
+        if RENDER_MAX_WORKERS > 0:
+            target = min(target, RENDER_MAX_WORKERS)
+        target = max(target, self.min_size)
+        metrics.set_gauge('render_pool_capacity', target)
+        return target, reason
+
+    def _maybe_grow(self) -> None:
+        """Очередь стоит, а все воркеры заняты - добавляем слот, если пускают лимиты"""
+        with self.lock:
+            waiting = self.jobs.qsize()
+            if self.closed or waiting <= self.spawning or self.busy < len(self.slots) - self.spawning:
+                return
+            size = len(self.slots)
+        target, reason = self.capacity()
+        available = resource_limits.memory_available()
+        need = (self.worker_peak or self.max_rss) + RENDER_MEMORY_RESERVE_MB * MB
+        if size >= target:
+            held = f"предел {target} воркеров ({reason})"
+        elif available is not None and available < need:
+            held = f"свободно {available / MB:.0f} МБ < {need / MB:.0f} МБ"
+        else:
+            self._held = None
+            self._add_slot(spawn=False)
+            metrics.inc('render_pool_resized', direction='up')
+            logger.info("📈 Пул рендеринга: %d -> %d воркеров (в очереди %d, %s)", size, size + 1, waiting, reason)
+            return
+        if held != self._held:
+            self._held = held
+            logger.info("⏸️ Пул рендеринга не растет (в очереди %d): %s", waiting, held)
+
+    def on_idle(self, slot: '_WorkerSlot') -> bool:
+        """
+        Слот простоял idle_timeout: лишний выводится, последние перезапускают
+        воркер (память и кэши процесса уходят вместе с ним), кэш частей в боте
+        очищается. Возвращает True, если слот выведен из пула.
+        """
+        from page_cache import page_cache
+
+        with self.lock:
+            if self.closed or time.monotonic() - self.last_activity < self.idle_timeout:
+                return False
+            leave = len(self.slots) > self.min_size
+            if leave:
+                self.slots.remove(slot)
+                self.size = len(self.slots)
+            release = not leave and not self.released
+            self.released = self.released or release
+            size = len(self.slots)
+        if leave:
+            slot.retire('idle', f"простой {self.idle_timeout:g} с")
+            metrics.inc('render_pool_resized', direction='down')
+            metrics.set_gauge('render_workers', size)
+            logger.info("📉 Пул рендеринга: %d -> %d воркеров после %g с простоя", size + 1, size, self.idle_timeout)
+            return True
+        if slot.jobs_done and slot.process is not None:
+            slot.retire('idle', f"простой {self.idle_timeout:g} с - память воркера освобождена")
+            slot.respawn()
+        if release:
+            page_cache.clear()
+            gc.collect()
+            logger.info("🧹 Пул рендеринга простаивает %g с: кэш частей очищен", self.idle_timeout)
+        return False
+
+    @property
+    def ready(self) -> bool:
+        """Пул прогрет и принимает задачи"""
+        return self.state == 'ready'
+
+    def submit(self, template_name: str, data: dict, profile_tag: str = None,
+               deadline: float = None) -> Future:
+        """
+        Ставит документ в очередь
+
+        Args:
+            template_name (str): шаблон
+            data (dict): данные клиента
+            profile_tag (str): включает профилирование рендера
+            deadline (float): срок (time.time()); воркер деградирует результат, если не успевает
+
+        Returns:
+            Future: RenderResult; пока задача в очереди, ее можно отменить через cancel()
+        """
+        if self.closed:
+            raise RuntimeError("render pool is shut down")
+        job = RenderJob(template_name, dict(data), profile_tag, tracing.current_context(), deadline,
+                        tenant=render_tenant.get())
+        if self.split_pages and self.size > 1 and profile_tag is None:
+            split = self._split(template_name, data)
+            if split is not None:
+                return self._submit_split(job, split)
+        return self._enqueue(job)
+
+    def _enqueue(self, job: RenderJob) -> Future:
+        if self.size <= 0:
+            if self.inline is None:
+                self.start()
+            return self.inline.submit(self._render_inline, job)
+        future = Future()
+        self.last_activity = time.monotonic()
+        self.released = False
+        self.jobs.put((job, future, time.perf_counter(), time.time_ns()), job.tenant)
+        metrics.set_gauge('render_queue_depth', self.jobs.qsize())
+        metrics.inc('render_jobs_queued', template=job.template_name, bot=job.tenant)
+        if self.autoscale:
+            self._maybe_grow()
+        return future
+
+    @staticmethod
+    def _split(template_name: str, data: dict):
+        import pdf_costructor
+
+        try:
+            return pdf_costructor.split_document(template_name, data)
+        except Exception as e:
+            logger.warning("⚠️ %s не разделен на части: %s", template_name, e)
+            return None
+
+    def _submit_split(self, job: RenderJob, split) -> Future:
+        """
+        Части документа рендерятся в разных воркерах одновременно, затем
+        один воркер склеивает страницы и накладывает печати. Части из кэша
+        page_cache не рендерятся вовсе. Если число страниц не сошлось
+        с ожидаемым, документ рендерится целиком обычной задачей.
+        """
+        from page_cache import page_cache
+
+        expected_pages = split.expected_pages
+        part_futures = []
+        for html, key in zip(split.parts, split.keys):
+            cached = page_cache.get(key) if page_cache.enabled else None
+            if cached is not None:
+                future = Future()
+                future.set_result(RenderResult(cached[0], (), cached[1]))
+            else:
+                future = self._enqueue(job._replace(data={'html': html}, stage='part'))
+                if page_cache.enabled:
+                    future.add_done_callback(functools.partial(self._cache_part, key))
+            part_futures.append(future)
+        outer = _SplitFuture(part_futures)
+        pending = [len(outer.parts)]
+        lock = threading.Lock()
+        hits = sum(f.done() for f in part_futures)
+        metrics.inc('render_split_documents', template=job.template_name)
+        metrics.inc('page_cache_hits', hits, template=job.template_name)
+        metrics.inc('page_cache_misses', len(part_futures) - hits, template=job.template_name)
+
+        def finish(future: Future, degraded: tuple = ()) -> None:
+            if outer.done():
+                return
+            if future.cancelled():
+                outer.cancel_now()
+            elif future.exception() is not None:
+                outer.set_exception(future.exception())
+            else:
+                result = future.result()
+                outer.set_result(result._replace(degraded=tuple(dict.fromkeys(degraded + result.degraded))))
+
+        def part_done(_future: Future) -> None:
+            with lock:
+                pending[0] -= 1
+                if pending[0]:
+                    return
+            if outer.done():
+                return
+            failed = next((f for f in outer.parts if f.cancelled() or f.exception() is not None), None)
+            if failed is not None:
+                finish(failed)
+                return
+            results = [f.result() for f in outer.parts]
+            pages = sum(r.pages for r in results)
+            if expected_pages is not None and pages != expected_pages or any(r.pages < 1 for r in results):
+                metrics.inc('render_split_page_mismatch', template=job.template_name)
+                logger.warning("📄 %s: части дали %d стр. вместо %s - рендер целиком",
+                               job.template_name, pages, expected_pages)
+                outer.follow_up = self._enqueue(job)
+                outer.follow_up.add_done_callback(finish)
+                return
+            degraded = tuple(reason for r in results for reason in r.degraded)
+            outer.follow_up = self._enqueue(
+                job._replace(data={'parts': [r.payload for r in results], 'brand': job.data.get('brand')},
+                             stage='assemble'))
+            outer.follow_up.add_done_callback(lambda f: finish(f, degraded))
+
+        for f in outer.parts:
+            f.add_done_callback(part_done)
+        return outer
+
+    @staticmethod
+    def _cache_part(key: str, future: Future) -> None:
+        from page_cache import page_cache
+
+        if not future.cancelled() and future.exception() is None:
+            result = future.result()
+            if not result.degraded:
+                page_cache.put(key, result.payload, result.pages)
+
+    @staticmethod
+    def _render_inline(job: RenderJob) -> RenderResult:
+        try:
+            return _run_job(job)
+        except Exception as e:
+            raise RenderError(f"{type(e).__name__}: {e}") from e
+
+    async def render_result(self, template_name: str, data: dict, profile_tag: str = None,
+                            deadline: float = None) -> RenderResult:
+        """Асинхронный рендер: RenderResult с отметкой о деградации"""
+        with tracing.span('render.pool', template=template_name, workers=self.size) as attrs:
+            result = await asyncio.wrap_future(self.submit(template_name, data, profile_tag, deadline))
+            attrs['pdf.bytes'] = len(result.payload)
+            return result
+
+    async def render_bytes(self, template_name: str, data: dict, profile_tag: str = None) -> bytes:
+        """Асинхронный рендер: байты PDF"""
+        return (await self.render_result(template_name, data, profile_tag)).payload
+
+    async def render(self, template_name: str, data: dict, profile_tag: str = None) -> BytesIO:
+        """Асинхронный рендер для обработчиков бота"""
+        return BytesIO(await self.render_bytes(template_name, data, profile_tag))
+
+    def shutdown(self) -> None:
+        """Дожидается текущих задач и останавливает воркеры"""
+        if self.closed:
+            return
+        self.closed = True
+        self.state = 'stopped'
+        if self.inline is not None:
+            self.inline.shutdown(wait=True)
+        with self.lock:
+            slots = list(self.slots)
+        for _ in slots:
+            self.jobs.put(None)
+        for slot in slots:
+            slot.thread.join()
+        logger.info("🛑 Пул рендеринга остановлен")
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+"""
+Предзагрузка для forkserver пула рендеринга
+Импортируется один раз в forkserver; все воркеры форкаются уже с загруженными
+WeasyPrint, ReportLab, PyPDF2 и PIL. Ошибки не роняют forkserver.
+"""
+
+try:
+    import pdf_costructor
+
+    pdf_costructor.warm_up()
+except Exception as e:  # OSError при отсутствии системных библиотек Pango
+    print(f"⚠️ Предзагрузка forkserver не удалась: {e}")
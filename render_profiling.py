@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Профилирование одного рендеринга по требованию
+cProfile (pstats) + снимок tracemalloc с топом аллокаций, файлы помечены шаблоном.
+Включается переменной RENDER_PROFILE=1 (каждый рендер), флагом вызова
+render_document(..., profile_tag=...) или командой бота /profile N.
+"""
+
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+RENDER_PROFILE = os.getenv("RENDER_PROFILE", "0") != "0"
+RENDER_PROFILE_DIR = os.getenv("RENDER_PROFILE_DIR", "profiles")
+RENDER_PROFILE_TOP = int(os.getenv("RENDER_PROFILE_TOP", "30"))
+
+
+def new_tag() -> str:
+    """Метка профиля: время + случайный суффикс"""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def profile_paths(template_name: str, tag: str) -> dict:
+    """Пути файлов профиля для шаблона и метки"""
+    base = os.path.join(RENDER_PROFILE_DIR, f"{template_name}-{tag}")
+    return {'pstats': f"{base}.pstats", 'report': f"{base}.txt"}
+
+
+def _allocations_report(snapshot, top: int) -> str:
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+    lines = []
+    for stat in snapshot.statistics('lineno')[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} КБ  {stat.count:7d} блоков  {frame.filename}:{frame.lineno}")
+    return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profiled(template_name: str, tag: str = None):
+    """
+    Оборачивает один рендеринг в cProfile и tracemalloc
+
+    Записывает <шаблон>-<метка>.pstats (python -m pstats, snakeviz) и
+    <шаблон>-<метка>.txt (топ функций по cumtime и топ аллокаций).
+    """
+    tag = tag or new_tag()
+    paths = profile_paths(template_name, tag)
+    os.makedirs(RENDER_PROFILE_DIR, exist_ok=True)
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(25)
+    else:
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield paths
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        profiler.dump_stats(paths['pstats'])
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats('cumulative').print_stats(RENDER_PROFILE_TOP)
+        with open(paths['report'], 'w', encoding='utf-8') as f:
+            f.write(f"Шаблон: {template_name}\nМетка: {tag}\n")
+            f.write(f"Время: {elapsed:.3f} с\n")
+            f.write(f"tracemalloc: текущее {current / 1024:.1f} КБ, пик {peak / 1024:.1f} КБ\n\n")
+            f.write(f"=== Топ {RENDER_PROFILE_TOP} функций по cumulative time ===\n")
+            f.write(stats_text.getvalue())
+            f.write(f"\n=== Топ {RENDER_PROFILE_TOP} аллокаций ===\n")
+            f.write(_allocations_report(snapshot, RENDER_PROFILE_TOP))
+            f.write('\n')
+        logger.info("🔬 Профиль %s записан: %s", template_name, paths['report'])
+        print(f"🔬 Профиль {template_name} записан: {paths['pstats']}, {paths['report']}")
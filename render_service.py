@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+HTTP сервис рендеринга поверх API pdf_costructor
+   POST /render/{шаблон}  — JSON с полями документа, в ответ PDF (ETag по хэшу входа);
+                            ?brand=<профиль> - бренд документа, tan/taeg по умолчанию из профиля
+   GET  /healthz          — процесс жив
+   GET  /readyz           — пул рендеринга прогрет
+   GET  /metrics          — снимок метрик
+Запускается отдельно (python render_service.py) или внутри бота при RENDER_HTTP_PORT,
+тогда использует тот же прогретый пул и кэш.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import signal
+
+import metrics
+from brands import UnknownBrand, get_profile
+from http_server import HTTPError, Response, json_response, serve
+from render_cache import RenderCache, content_key
+from render_deadline import GenericDocuments, RenderTimeout, render_with_deadline
+from render_pool import RenderPool
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+RENDER_HTTP_HOST = os.getenv("RENDER_HTTP_HOST", "0.0.0.0")
+RENDER_HTTP_PORT = int(os.getenv("RENDER_HTTP_PORT", os.getenv("PORT", "8080")))
+
+# Поля шаблонов: имя -> тип; payment необязателен (будет рассчитан)
+TEMPLATE_FIELDS = {
+    'contratto': {'name': str, 'amount': float, 'duration': int, 'tan': float, 'taeg': float},
+    'carta': {'name': str, 'amount': float, 'duration': int, 'tan': float},
+    'garanzia': {'name': str},
+}
+OPTIONAL_FIELDS = {'payment': float}
+# Поля со значением по умолчанию из профиля бренда
+PROFILE_FIELDS = ('tan', 'taeg')
+
+
+def _field_value(kind, value):
+    """
+    Значение поля без молчаливого приведения: bool не число, 12.7 не срок в
+    месяцах, nan/inf не сумма. Числа принимаются и строкой ("15000").
+
+    Raises:
+        ValueError: значение не того типа
+    """
+    if kind is str:
+        if not isinstance(value, str):
+            raise ValueError(value)
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(value)
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    if kind is int:
+        if not number.is_integer():
+            raise ValueError(value)
+        return int(number)
+    return number
+
+
+def validate_fields(template_name: str, body: dict, brand: str = None) -> dict:
+    """Проверяет и приводит поля запроса к типам шаблона; недостающие tan/taeg - из профиля бренда"""
+    if template_name not in TEMPLATE_FIELDS:
+        raise HTTPError(404, f"unknown template: {template_name}")
+    if not isinstance(body, dict):
+        raise HTTPError(400, 'JSON object expected')
+    try:
+        profile = get_profile(brand)
+    except UnknownBrand as e:
+        raise HTTPError(400, str(e))
+    fields = TEMPLATE_FIELDS[template_name]
+    body = {**{name: getattr(profile, name) for name in PROFILE_FIELDS if name in fields}, **body}
+    missing = [name for name in fields if name not in body]
+    if missing:
+        raise HTTPError(400, f"missing fields: {', '.join(missing)}")
+    data = {}
+    for name, kind in {**fields, **OPTIONAL_FIELDS}.items():
+        if name not in body:
+            continue
+        try:
+            data[name] = _field_value(kind, body[name])
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"invalid value for {name}")
+    if 'name' in data and not data['name'].strip():
+        raise HTTPError(400, 'empty name')
+    data['brand'] = profile.name
+    return data
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+class RenderService:
+    """HTTP фронт для пула рендеринга"""
+
+    def __init__(self, pool: RenderPool, cache: RenderCache, generic: GenericDocuments = None):
+        self.pool = pool
+        self.cache = cache
+        self.generic = generic
+        self.server = None
+
+    async def handle(self, request) -> Response:
+        if request.path == '/healthz':
+            return json_response({'status': 'ok'})
+        if request.path == '/readyz':
+            ready = self.pool.ready
+            return json_response({'ready': ready, 'pool': self.pool.state}, 200 if ready else 503)
+        if request.path == '/metrics':
+            return json_response(metrics.snapshot())
+        if request.path.startswith('/render/'):
+            if request.method != 'POST':
+                raise HTTPError(405)
+            return await self.render(request.path[len('/render/'):], request)
+        raise HTTPError(404)
+
+    async def render(self, template_name: str, request) -> Response:
+        try:
+            body = request.json()
+        except ValueError:
+            raise HTTPError(400, 'invalid JSON')
+        data = validate_fields(template_name, body, request.query.get('brand'))
+
+        key = content_key(template_name, data)
+        etag = f'"{key}"'
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if _etag_matches(request.headers.get('if-none-match', ''), etag):
+            metrics.inc('render_http_not_modified', template=template_name)
+            return Response(304, b'', headers)
+
+        if not self.pool.ready:
+            return json_response({'error': 'render pool is warming up'}, 503, {'Retry-After': '5'})
+
+        try:
+            outcome = await render_with_deadline(self.pool, self.cache, template_name, data, generic=self.generic)
+        except RenderTimeout as e:
+            metrics.inc('render_http_errors', template=template_name)
+            return json_response({'error': str(e)}, 504, {'Retry-After': '5'})
+        except Exception as e:
+            logger.error("❌ Ошибка рендеринга %s: %s", template_name, e)
+            metrics.inc('render_http_errors', template=template_name)
+            return json_response({'error': str(e)}, 500)
+
+        if outcome.degraded:
+            # Замена по дедлайну: без ETag, чтобы клиент не закэшировал ее как полный документ
+            headers = {'Cache-Control': 'no-store', 'X-Render-Degraded': outcome.degraded}
+        metrics.inc('render_http_ok', template=template_name)
+        return Response(200, outcome.payload, {
+            **headers,
+            'Content-Type': 'application/pdf',
+            'Content-Disposition': f'inline; filename="{template_name}.pdf"',
+        })
+
+    async def start(self, host: str = RENDER_HTTP_HOST, port: int = RENDER_HTTP_PORT) -> None:
+        self.server = await serve(self.handle, host, port)
+        logger.info("🌐 Сервис рендеринга слушает %s:%d", host, port)
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+async def main() -> None:
+    logging.basicConfig(format="%(asctime)s — %(levelname)s — %(message)s", level=logging.INFO)
+    pool = RenderPool()
+    generic = GenericDocuments()
+    service = RenderService(pool, RenderCache(), generic)
+    await service.start()
+
+    # Прогрев пула в фоне: /readyz отвечает 503, пока воркеры не готовы
+    loop = asyncio.get_running_loop()
+    warm_up = loop.run_in_executor(None, pool.start)
+
+    async def prepare_generic():
+        await warm_up
+        await generic.prepare(pool)
+    generic_task = asyncio.create_task(prepare_generic())
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    await service.stop()
+    await warm_up
+    generic_task.cancel()
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Лимиты CPU и памяти, доступные процессу
+Читает квоты cgroup v2 (cpu.max, memory.max) и v1 (cpu.cfs_quota_us,
+memory.limit_in_bytes); вне контейнера - ядра из sched_getaffinity и
+/proc/meminfo. Так один образ сам узнает, сколько ему дали на маленьком
+dyno и на большом Docker хосте.
+
+   python resource_limits.py   — что видит процесс
+"""
+
+import os
+
+
+# ---------------------- Настройки ------------------------------------------
+CGROUP_ROOT = os.getenv("CGROUP_ROOT", "/sys/fs/cgroup")
+MEMORY_LIMIT_MB = float(os.getenv("MEMORY_LIMIT_MB", "0"))   # 0 = из cgroup; задать, если хост не ограничивает
+
+MB = 1024 * 1024
+UNLIMITED = 1 << 60   # cgroup v1 пишет "без лимита" как почти 2^63
+
+
+def _read(path: str):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_dirs(controller: str = None) -> list:
+    """
+    Каталоги cgroup процесса: сначала по пути из /proc/self/cgroup, затем корень
+    (в контейнере свой cgroup обычно смонтирован корнем)
+    """
+    base = os.path.join(CGROUP_ROOT, controller) if controller else CGROUP_ROOT
+    dirs = []
+    for line in (_read('/proc/self/cgroup') or '').splitlines():
+        _id, controllers, path = line.split(':', 2)
+        if (controller in controllers.split(',')) if controller else controllers == '':
+            dirs.append(base + path.rstrip('/'))
+    dirs.append(base)
+    return dirs
+
+
+def _first(names_by_version: list):
+    """Первый найденный файл cgroup: [(controller или None для v2, имя файла), ...]"""
+    for controller, name in names_by_version:
+        for directory in _cgroup_dirs(controller):
+            value = _read(os.path.join(directory, name))
+            if value is not None:
+                return controller, value
+    return None, None
+
+
+def _meminfo() -> dict:
+    info = {}
+    for line in (_read('/proc/meminfo') or '').splitlines():
+        key, _, value = line.partition(':')
+        if value.strip().endswith('kB'):
+            info[key] = int(value.split()[0]) * 1024
+    return info
+
+
+def cpu_limit() -> float:
+    """Ядер процессу: квота cgroup (может быть дробной) или доступные ядра"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    version, value = _first([(None, 'cpu.max'), ('cpu', 'cpu.cfs_quota_us')])
+    quota = period = None
+    if version is None and value and not value.startswith('max'):
+        quota, period = (int(x) for x in value.split()[:2])
+    elif version == 'cpu' and value and int(value) > 0:
+        _version, period_value = _first([('cpu', 'cpu.cfs_period_us')])
+        quota, period = int(value), int(period_value or 100000)
+    if quota and period:
+        return min(float(cpus), quota / period)
+    return float(cpus)
+
+
+def memory_limit():
+    """Лимит памяти в байтах: MEMORY_LIMIT_MB, cgroup или память хоста (None - неизвестно)"""
+    if MEMORY_LIMIT_MB > 0:
+        return int(MEMORY_LIMIT_MB * MB)
+    host = _meminfo().get('MemTotal')
+    _version, value = _first([(None, 'memory.max'), ('memory', 'memory.limit_in_bytes')])
+    if value and value != 'max' and int(value) < UNLIMITED:
+        return min(int(value), host) if host else int(value)
+    return host
+
+
+def memory_used():
+    """
+    Занятая память в байтах: cgroup без вытесняемого файлового кэша
+    (так считают docker stats и OOM-killer), иначе MemTotal - MemAvailable
+    """
+    version, value = _first([(None, 'memory.current'), ('memory', 'memory.usage_in_bytes')])
+    if value is not None:
+        used = int(value)
+        stat_name = 'inactive_file' if version is None else 'total_inactive_file'
+        _v, stat = _first([(version, 'memory.stat')])
+        for line in (stat or '').splitlines():
+            key, _, amount = line.partition(' ')
+            if key == stat_name:
+                used -= int(amount)
+                break
+        return max(used, 0)
+    info = _meminfo()
+    if 'MemTotal' in info and 'MemAvailable' in info:
+        return info['MemTotal'] - info['MemAvailable']
+    return None
+
+
+def memory_available():
+    """Свободно до лимита, байт (None - неизвестно)"""
+    limit, used = memory_limit(), memory_used()
+    if limit is None or used is None:
+        return None
+    return max(limit - used, 0)
+
+
+def main():
+    limit, available = memory_limit(), memory_available()
+    print(f"CPU: {cpu_limit():g}")
+    print(f"Память: лимит {limit / MB if limit else 0:.0f} МБ, свободно {available / MB if available else 0:.0f} МБ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Декларативные схемы размещения печатей, подписей и логотипов
+Схема шаблона (layouts/<шаблон>.json) задает изображение, страницу, клетку-якорь
+сетки 25x35, смещение в клетках и масштаб. При загрузке схема один раз
+компилируется в абсолютные координаты в пунктах и кэшированные ImageReader.
+Схемы и изображения берутся из профиля бренда (brands), общие - из корня.
+"""
+
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import NamedTuple
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LAYOUTS_DIR = os.getenv("LAYOUTS_DIR", os.path.join(BASE_DIR, "layouts"))
+STAMP_MAX_DPI = float(os.getenv("STAMP_MAX_DPI", "300"))  # 0 = встраивать исходные пиксели
+STAMP_IMAGE_CACHE = int(os.getenv("STAMP_IMAGE_CACHE", "64"))  # декодированных изображений на процесс
+
+PX_TO_MM = 0.264583  # пиксели в мм (96 DPI)
+MM_PER_INCH = 25.4
+
+
+class DrawOp(NamedTuple):
+    """Скомпилированная операция рисования (координаты в пунктах от левого нижнего угла)"""
+    kind: str          # 'image' или 'text'
+    x: float
+    y: float
+    width: float = 0.0
+    height: float = 0.0
+    image: object = None  # reportlab ImageReader
+    text: str = ''
+    font: str = 'Helvetica'
+    size: float = 10
+
+
+class Layout(NamedTuple):
+    """Скомпилированная схема шаблона: список операций на каждую страницу"""
+    template: str
+    pages: tuple
+
+
+@lru_cache(maxsize=STAMP_IMAGE_CACHE)
+def _file_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def image_key(path: str, max_px: tuple) -> str:
+    """Ключ уменьшенного изображения в artifact_store: содержимое исходника и размер"""
+    return f"image/{_file_digest(path)}/{max_px[0]}x{max_px[1]}"
+
+
+def _downsample(path: str, max_px: tuple):
+    """PIL изображение, уменьшенное до max_px - или None, если исходник не больше"""
+    from PIL import Image
+    with Image.open(path) as image:
+        if image.width <= max_px[0] and image.height <= max_px[1]:
+            return None
+        image.load()
+        return image.resize(max_px, Image.LANCZOS)
+
+
+def downsampled_png(path: str, max_px: tuple):
+    """PNG уменьшенного изображения для artifact_store (None - уменьшать нечего)"""
+    from io import BytesIO
+
+    image = _downsample(path, max_px)
+    if image is None:
+        return None
+    buffer = BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=STAMP_IMAGE_CACHE)
+def _image_reader(path: str, max_px: tuple = None):
+    """
+    ImageReader на файл изображения - декодируется один раз на процесс
+
+    max_px (ширина, высота) уменьшает изображение до размера печати: исходники
+    1024px при ширине печати ~30 мм дают ~900 DPI, и каждый рендер заново
+    сжимает в PDF пиксели, которых не видно ни на экране, ни на бумаге.
+    Уменьшенная копия берется из artifact_store, если собрана при сборке образа.
+    Один ImageReader делят все рендеры процесса (и потоки inline пула), поэтому
+    изображение декодируется здесь целиком: ленивое чтение PNG из общего потока
+    при одновременных drawImage ломает PngImagePlugin.
+    """
+    from reportlab.lib.utils import ImageReader
+    from PIL import Image
+
+    image = None
+    if max_px is not None:
+        from artifact_store import artifact_store
+        stored = artifact_store.get(image_key(path, max_px))
+        if stored is not None:
+            with Image.open(stored.stream()) as decoded:
+                image = decoded.copy()
+        else:
+            image = _downsample(path, max_px)
+    if image is None:
+        with Image.open(path) as decoded:
+            image = decoded.copy()
+    reader = ImageReader(image)
+    reader.getRGBData()   # пиксели для PDF тоже готовятся один раз, а не в первом рендере
+    return reader
+
+
+def _cell_point(spec: dict, grid: dict) -> tuple:
+    """Точка (мм) в системе PDF: клетка-якорь + смещение в клетках (x вправо, y вниз)"""
+    cell_width_mm = grid['page_width_mm'] / grid['columns']
+    cell_height_mm = grid['page_height_mm'] / grid['rows']
+    row = (spec['cell'] - 1) // grid['columns']
+    col = (spec['cell'] - 1) % grid['columns']
+    dx, dy = spec.get('offset', (0, 0))
+    x_mm = (col + dx) * cell_width_mm
+    y_mm = grid['page_height_mm'] - (row + dy) * cell_height_mm
+    return x_mm, y_mm
+
+
+def _asset_path(base_dir, name: str) -> str:
+    """Изображение из первого каталога, где оно есть (base_dir - каталог или кортеж каталогов)"""
+    dirs = (base_dir,) if isinstance(base_dir, str) else base_dir
+    for directory in dirs:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(dirs[-1], name)
+
+
+def _image_geometry(spec: dict, path: str) -> tuple:
+    """Размер печати в мм и предел пикселей для STAMP_MAX_DPI: (ширина, высота, max_px или None)"""
+    px_width, px_height = _image_reader(path).getSize()
+    width_mm = px_width * PX_TO_MM * spec.get('scale', 1)
+    height_mm = px_height * PX_TO_MM * spec.get('scale', 1)
+    max_px = None
+    if STAMP_MAX_DPI > 0:
+        max_px = (max(1, round(width_mm / MM_PER_INCH * STAMP_MAX_DPI)),
+                  max(1, round(height_mm / MM_PER_INCH * STAMP_MAX_DPI)))
+    return width_mm, height_mm, max_px
+
+
+def compile_op(spec: dict, grid: dict, base_dir) -> DrawOp:
+    """Компилирует одну запись схемы в DrawOp"""
+    from reportlab.lib.units import mm
+
+    x_mm, y_mm = _cell_point(spec, grid)
+    nudge_x, nudge_y = spec.get('nudge_pt', (0, 0))
+
+    if 'text' in spec:
+        return DrawOp('text', x_mm * mm + nudge_x, y_mm * mm + nudge_y, text=spec['text'],
+                      font=spec.get('font', 'Helvetica'), size=spec.get('size', 10))
+
+    path = _asset_path(base_dir, spec['image'])
+    width_mm, height_mm, max_px = _image_geometry(spec, path)
+    reader = _image_reader(path, max_px)
+    if spec.get('align', 'bottom-left') == 'center':
+        x_mm -= width_mm / 2
+        y_mm -= height_mm / 2
+    elif spec['align'] != 'bottom-left':
+        raise ValueError(f"Неизвестное выравнивание: {spec['align']}")
+    return DrawOp('image', x_mm * mm + nudge_x, y_mm * mm + nudge_y,
+                  width=width_mm * mm, height=height_mm * mm, image=reader)
+
+
+def configure_reportlab() -> None:
+    """
+    Общие настройки ReportLab процесса - до первого Canvas (warm_up, CLI)
+
+    PDF у нас бинарный: ASCII85 раздувает потоки изображений на 25% и
+    кодируется на чистом Python.
+    """
+    from reportlab import rl_config
+
+    rl_config.useA85 = 0
+
+
+def compile_layout(spec: dict, base_dir=BASE_DIR) -> Layout:
+    """Компилирует схему целиком: все координаты считаются здесь, а не при каждом рендере"""
+    grid = spec['grid']
+    pages = tuple(
+        tuple(compile_op(op, grid, base_dir) for op in page_ops)
+        for page_ops in spec['pages']
+    )
+    return Layout(spec['template'], pages)
+
+
+def load_layout(template_name: str, brand: str = None):
+    """Загружает и компилирует схему шаблона для профиля бренда (кэш brands). None если схемы нет"""
+    from brands import artifact
+
+    return artifact(brand, ('layout', template_name), lambda profile: _compile_profile_layout(template_name, profile))
+
+
+def layout_images(template_name: str, profile) -> list:
+    """Изображения схемы профиля для artifact_store: [(путь, max_px), ...] без исходных размеров"""
+    path = profile.layout_path(template_name)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    images = []
+    for page_ops in spec['pages']:
+        for op in page_ops:
+            if 'image' in op:
+                image_path = _asset_path(profile.asset_dirs, op['image'])
+                max_px = _image_geometry(op, image_path)[2]
+                if max_px is not None and (image_path, max_px) not in images:
+                    images.append((image_path, max_px))
+    return images
+
+
+def _compile_profile_layout(template_name: str, profile):
+    path = profile.layout_path(template_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return compile_layout(json.load(f), profile.asset_dirs)
+
+
+def draw_page(canvas, layout: Layout, page_index: int) -> None:
+    """Рисует операции одной страницы схемы на текущей странице canvas"""
+    if page_index >= len(layout.pages):
+        return
+    for op in layout.pages[page_index]:
+        if op.kind == 'image':
+            canvas.drawImage(op.image, op.x, op.y, width=op.width, height=op.height,
+                             mask='auto', preserveAspectRatio=True)
+        else:
+            canvas.setFillColorRGB(0, 0, 0)
+            canvas.setFont(op.font, op.size)
+            canvas.drawString(op.x, op.y, op.text)
+
+
+def draw_layout(overlay_canvas, layout: Layout) -> None:
+    """Рисует скомпилированную схему на canvas ReportLab, страница за страницей"""
+    for page_index in range(len(layout.pages)):
+        if page_index:
+            overlay_canvas.showPage()
+        draw_page(overlay_canvas, layout, page_index)
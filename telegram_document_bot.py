@@ -1,61 +1,181 @@
  # telegram_document_bot.py — Telegram бот с интеграцией PDF конструктора
 # -----------------------------------------------------------------------------
-# Генератор PDF-документов Intesa Sanpaolo:
+# Генератор PDF-документов Intesa Sanpaolo и других брендов (brands/<профиль>):
 #   /contratto — кредитный договор
 #   /garanzia  — письмо о гарантийном взносе
 #   /carta     — письмо о выпуске карты
+#   /brand     — профиль бренда документов этого чата
 # -----------------------------------------------------------------------------
 # Интеграция с pdf_costructor.py API
+# Несколько ботов в одном процессе - BOTS_CONFIG (см. bot_hosting.py)
 # -----------------------------------------------------------------------------
+import asyncio
+import functools
 import logging
 import os
-from io import BytesIO
+import time
+import warnings
 
-from telegram import Update, InputFile, ReplyKeyboardRemove
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, Message, ReplyKeyboardRemove
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.warnings import PTBUserWarning
 from telegram.ext import (
-    Application, CommandHandler, ConversationHandler, MessageHandler, ContextTypes, filters,
+    Application, CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler, ContextTypes, filters,
 )
 
 # Импортируем API функции из PDF конструктора
 from pdf_costructor import (
-    generate_contratto_pdf,
+    format_money,
     monthly_payment,
+    monthly_payments,
 )
+from brands import UnknownBrand, get_profile, list_profiles
+from bot_hosting import BotConfig, bot_configs, serve
+from chat_state import SQLitePersistence, configure_state
+from document_archive import DocumentArchive
+import metrics
+from render_cache import RenderCache
+from render_deadline import (
+    GENERIC, STALE_CACHE, STAMPS_SKIPPED, GenericDocuments, RenderOutcome, RenderTimeout, render_with_deadline,
+)
+from render_pool import RenderPool, render_tenant
+from render_profiling import new_tag, profile_paths
+from render_service import RenderService
+from telegram_transport import configure_builder
+import tracing
 
 
 # ---------------------- Настройки ------------------------------------------
-TOKEN = os.getenv("BOT_TOKEN", "YOUR_TOKEN_HERE")
-DEFAULT_TAN = 7.86
-DEFAULT_TAEG = 8.30
+QUOTE_TERMS = [int(x) for x in os.getenv("QUOTE_TERMS", "12,24,36,48,60").split(",") if x.strip()]  # сроки в предпросмотре
+RENDER_HTTP_PORT = os.getenv("RENDER_HTTP_PORT")  # если задан - HTTP сервис рендеринга в этом же процессе
 
 
 logging.basicConfig(format="%(asctime)s — %(levelname)s — %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Диалог ведется по чату: кнопки предпросмотра относятся к текущему диалогу, per_message не нужен
+warnings.filterwarnings('ignore', message="If 'per_message=False'", category=PTBUserWarning)
 
 # ------------------ Состояния Conversation -------------------------------
-ASK_NAME, ASK_AMOUNT = range(2)
+ASK_NAME, ASK_AMOUNT, ASK_TERM = range(3)
+
+# Пул процессов рендеринга, кэш и архив - общие для всех ботов процесса
+render_pool = RenderPool()
+render_cache = RenderCache()
+generic_documents = GenericDocuments()  # замена на случай пропуска дедлайна
+render_service = RenderService(render_pool, render_cache, generic_documents)
+document_archive = DocumentArchive()  # копии отправленных документов для /storico
+
+# Подписи к документу, выданному вместо полного по дедлайну
+DEGRADED_CAPTIONS = {
+    STAMPS_SKIPPED: "⚠️ Versione rapida senza timbri e firme: il rendering completo ha superato il tempo limite.",
+    STALE_CACHE: "⚠️ Copia dalla cache: data o versione del documento potrebbero essere precedenti.",
+    GENERIC: "⚠️ Modello generico con campi vuoti: compilare a mano. Il rendering ha superato il tempo limite.",
+}
 
 # ---------------------- PDF-строители через API -------------------------
-def build_contratto(data: dict) -> BytesIO:
-    """Генерация PDF договора через API pdf_costructor"""
-    return generate_contratto_pdf(data)
+async def build_contratto(data: dict, profile_tag: str = None) -> RenderOutcome:
+    """Генерация PDF договора через API pdf_costructor в пуле рендеринга (с дедлайном)"""
+    if profile_tag:
+        # Профилируемый рендер идет мимо кэша и без дедлайна, иначе профилировать нечего
+        payload = await render_pool.render_bytes('contratto', dict(data), profile_tag)
+        return RenderOutcome(payload, 'render')
+    return await render_with_deadline(render_pool, render_cache, 'contratto', dict(data),
+                                      generic=generic_documents)
+
+
+def bot_config(context: ContextTypes.DEFAULT_TYPE) -> BotConfig:
+    """Настройки бота, которому пришел апдейт"""
+    return context.bot_data['config']
+
+
+def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    return update.effective_user.id in bot_config(context).admin_ids
+
+
+def profile_requests(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """Профилирование следующих N рендеров по команде /profile - у каждого бота свое"""
+    return context.bot_data.setdefault('profile_requests', {'remaining': 0, 'chat_id': None})
+
+
+def take_profile_tag(context: ContextTypes.DEFAULT_TYPE):
+    """Метка профиля, если администратор запросил профилирование следующих рендеров"""
+    requests = profile_requests(context)
+    if requests['remaining'] <= 0:
+        return None
+    requests['remaining'] -= 1
+    return new_tag()
+
+
+async def send_profile_report(context: ContextTypes.DEFAULT_TYPE, template_name: str, tag: str) -> None:
+    """Отправляет отчет профиля администратору, запросившему /profile"""
+    paths = profile_paths(template_name, tag)
+    chat_id = profile_requests(context)['chat_id']
+    if not chat_id or not os.path.exists(paths['report']):
+        return
+    for path in (paths['report'], paths['pstats']):
+        with open(path, 'rb') as f:
+            await context.bot.send_document(chat_id, document=InputFile(f, filename=os.path.basename(path)))
+
+
+def traced_update(handler):
+    """
+    Корневой спан на апдейт: его trace_id - correlation ID всего запроса.
+    Имя бота становится арендатором пула рендеринга и меткой метрик.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        name = bot_config(context).name
+        render_tenant.set(name)
+        metrics.inc('telegram_updates', bot=name, handler=handler.__name__)
+        with tracing.span(f"telegram.{handler.__name__}", update_id=update.update_id, bot=name,
+                          chat_id=update.effective_chat.id if update.effective_chat else None):
+            return await handler(update, context)
+    return wrapper
 
 
 # ------------------------- Handlers -----------------------------------------
+@traced_update
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
+    # Профиль бренда фиксируется на весь диалог, даже если /brand сменят посреди него
+    context.user_data['brand'] = get_profile(context.chat_data.get('brand') or bot_config(context).brand).name
     await update.message.reply_text(
         "Benvenuto! Inserisci nome e cognome del cliente:",
         reply_markup=ReplyKeyboardRemove()
     )
     return ASK_NAME
 
+@traced_update
 async def ask_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     name = update.message.text.strip()
     context.user_data['name'] = name
     await update.message.reply_text("Inserisci importo (€):")
     return ASK_AMOUNT
 
+def quote_payments(data: dict) -> dict:
+    """Платежи по всем срокам QUOTE_TERMS - один расчет на предпросмотр"""
+    return monthly_payments(data['amount'], QUOTE_TERMS, data['tan'])
+
+
+def quote_text(data: dict, payments: dict) -> str:
+    """Предпросмотр условий: платежи по всем срокам QUOTE_TERMS, без рендера PDF"""
+    lines = [
+        f"📋 Preventivo per {data['name']}",
+        f"Importo: {format_money(data['amount'])} € · TAN {data['tan']:.2f}% · TAEG {data['taeg']:.2f}%",
+        "",
+        *[f"{months} mesi — {format_money(payment)} €/mese" for months, payment in payments.items()],
+    ]
+    return '\n'.join(lines)
+
+
+def quote_keyboard(payments: dict) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"{months} mesi · {format_money(payment)} €", callback_data=f"term:{months}")]
+        for months, payment in payments.items()
+    ])
+
+
+@traced_update
 async def ask_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         amt = float(update.message.text.replace('€','').replace(',','.').replace(' ',''))
@@ -64,48 +184,239 @@ async def ask_amount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return ASK_AMOUNT
     context.user_data['amount'] = round(amt, 2)
     
-    # Устанавливаем значения по умолчанию для остальных параметров
-    context.user_data['duration'] = 36  # 36 месяцев по умолчанию
-    context.user_data['tan'] = DEFAULT_TAN
-    context.user_data['taeg'] = DEFAULT_TAEG
-    context.user_data['payment'] = monthly_payment(amt, 36, DEFAULT_TAN)
+    # Значения по умолчанию для остальных параметров - из профиля бренда
+    brand_profile = get_profile(context.user_data.get('brand'))
+    context.user_data['brand'] = brand_profile.name
+    context.user_data['tan'] = brand_profile.tan
+    context.user_data['taeg'] = brand_profile.taeg
     
-    # Сразу генерируем и отправляем документ
+    # Сначала мгновенный предпросмотр: PDF рендерится только для выбранного срока
+    payments = quote_payments(context.user_data)
+    await update.message.reply_text(
+        f"{quote_text(context.user_data, payments)}\n\nScegli la durata per generare il contratto:",
+        reply_markup=quote_keyboard(payments),
+    )
+    return ASK_TERM
+
+@traced_update
+async def choose_term(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    months = int(query.data.split(':', 1)[1])
+    if 'amount' not in context.user_data or months not in QUOTE_TERMS:
+        await query.edit_message_text("Preventivo scaduto, ricomincia: /start")
+        return ConversationHandler.END
+    context.user_data['duration'] = months
+    context.user_data['payment'] = monthly_payment(context.user_data['amount'], months, context.user_data['tan'])
+    metrics.inc('quote_confirmed', months=months, bot=bot_config(context).name)
+    
+    # Клавиатура убирается - повторное нажатие не запустит второй рендер
+    quote = quote_text(context.user_data, quote_payments(context.user_data))
+    await query.edit_message_text(
+        f"{quote}\n\n✅ Scelta: {months} mesi — generazione del contratto..."
+    )
+    await send_contratto(query.message, context)
+    return ConversationHandler.END
+
+@traced_update
+async def stale_quote(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопка предпросмотра вне диалога (после /cancel или уже выбранного срока)"""
+    await update.callback_query.answer("Preventivo scaduto, ricomincia: /start", show_alert=True)
+
+async def send_contratto(message: Message, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Рендер договора по context.user_data и отправка в чат сообщения"""
+    profile_tag = take_profile_tag(context)
+    trace_id = tracing.current_trace_id()
+    started = time.perf_counter()
     try:
-        pdf_buffer = build_contratto(context.user_data)
+        outcome = await build_contratto(context.user_data, profile_tag)
         filename = f"Contratto_{context.user_data['name'].replace(' ', '_')}.pdf"
-        await update.message.reply_document(
-            document=InputFile(pdf_buffer, filename=filename)
+        with tracing.span('telegram.send_document', pdf_bytes=len(outcome.payload), degraded=outcome.degraded):
+            sent = await message.reply_document(
+                document=InputFile(outcome.payload, filename=filename),  # bytes отдаются как есть, без read()
+                caption=DEGRADED_CAPTIONS.get(outcome.degraded),
+            )
+        # В архив - уже после отправки, в фоне; file_id позволит переслать без загрузки
+        document_archive.store_later('contratto', dict(context.user_data), outcome.payload, filename,
+                                     message.chat_id, sent.document.file_id if sent.document else None,
+                                     outcome.degraded, bot=bot_config(context).name)
+        metrics.inc('documents_sent', template='contratto', bot=bot_config(context).name, source=outcome.source)
+        logger.info("📨 Contratto для чата %s отправлен за %.2f с (%s, trace %s)",
+                    message.chat_id, time.perf_counter() - started, outcome.source, trace_id)
+    except RenderTimeout as e:
+        logger.error("⏱️ Дедлайн для чата %s (trace %s): %s", message.chat_id, trace_id, e)
+        await message.reply_text(
+            f"⏳ Il documento richiede più tempo del previsto, riprova tra poco: /start (rif. {trace_id[:8]})"
+        )
+    except RetryAfter as e:
+        # Лимитер уже исчерпал повторы - сообщаем, когда можно попробовать снова
+        logger.warning("Flood limit при отправке документа: %s", e)
+        await message.reply_text(
+            f"⏳ Troppe richieste, riprova tra {int(e.retry_after)} secondi: /start"
         )
+    except NetworkError as e:
+        logger.warning("Сетевая ошибка при отправке документа: %s", e)
+        await message.reply_text("📶 Errore di rete durante l'invio, riprova: /start")
     except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка: {e}")
+        logger.error("❌ Ошибка генерации для чата %s (trace %s): %s", message.chat_id, trace_id, e)
+        await message.reply_text(f"❌ Ошибка: {e} (rif. {trace_id[:8]})")
     
-    return ConversationHandler.END
+    if profile_tag:
+        try:
+            await send_profile_report(context, 'contratto', profile_tag)
+        except Exception as e:
+            logger.warning("Не удалось отправить профиль %s: %s", profile_tag, e)
 
 # Удалены неиспользуемые функции ask_duration, ask_tan, ask_taeg
 
+@traced_update
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Operazione annullata.")
     return await start(update, context)
 
+@traced_update
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/profile N — профилировать следующие N рендеров (только администраторы бота)"""
+    if not is_admin(update, context):
+        return
+    try:
+        count = int(context.args[0]) if context.args else 1
+    except ValueError:
+        await update.message.reply_text("Uso: /profile N")
+        return
+    requests = profile_requests(context)
+    requests['remaining'] = max(count, 0)
+    requests['chat_id'] = update.effective_chat.id
+    await update.message.reply_text(f"🔬 Profilazione dei prossimi {count} render")
+
+@traced_update
+async def brand(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/brand [профиль] — профиль бренда чата; сменить может администратор (если они заданы)"""
+    available = ', '.join(list_profiles())
+    if not context.args:
+        current = get_profile(context.chat_data.get('brand') or bot_config(context).brand)
+        await update.message.reply_text(f"🏦 Profilo: {current.title} ({current.name})\nDisponibili: {available}")
+        return
+    if bot_config(context).admin_ids and not is_admin(update, context):
+        await update.message.reply_text("⛔ Solo un amministratore può cambiare il profilo.")
+        return
+    try:
+        selected = get_profile(context.args[0])
+    except UnknownBrand:
+        await update.message.reply_text(f"Profilo sconosciuto: {context.args[0]}\nDisponibili: {available}")
+        return
+    context.chat_data['brand'] = selected.name
+    metrics.inc('brand_selected', brand=selected.name, bot=bot_config(context).name)
+    await update.message.reply_text(f"✅ Profilo: {selected.title} ({selected.name}) — vale dal prossimo /start")
+
+async def resend_archived(message: Message, doc, bot_name: str) -> None:
+    """Повторная отправка из архива: по file_id, а если он устарел - байтами с диска"""
+    amount = f" · {format_money(doc.amount)} €" if doc.amount is not None else ''
+    caption = (f"🗂 {doc.template} · {doc.client_name}{amount} · "
+               f"{time.strftime('%d/%m/%Y', time.localtime(doc.created_at))}")
+    if doc.file_id:
+        try:
+            await message.reply_document(document=doc.file_id, caption=caption)
+            metrics.inc('archive_resent', source='file_id', bot=bot_name)
+            return
+        except BadRequest as e:
+            logger.info("file_id документа %s не принят (%s) - отправляем файл", doc.id, e)
+    payload = await document_archive.load_async(doc.sha256)
+    sent = await message.reply_document(document=InputFile(payload, filename=doc.filename), caption=caption)
+    metrics.inc('archive_resent', source='file', bot=bot_name)
+    if sent.document:
+        await document_archive.set_file_id_async(doc.id, sent.document.file_id)
+
+@traced_update
+async def storico(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/storico <nome> [importo] — последние документы клиента из архива (на эту сумму)"""
+    if not document_archive.enabled:
+        await update.message.reply_text("Archivio non attivo.")
+        return
+    args = list(context.args or [])
+    amount = None
+    if len(args) > 1:
+        try:
+            amount = round(float(args[-1].replace('€', '').replace(',', '.')), 2)
+            args.pop()
+        except ValueError:
+            pass
+    name = ' '.join(args)
+    if not name:
+        await update.message.reply_text("Uso: /storico <nome> [importo]")
+        return
+    # Оператор видит документы своего чата, администратор - всех чатов; и тот и другой - только своего бота
+    chat_id = None if is_admin(update, context) else update.effective_chat.id
+    try:
+        docs = await document_archive.find_async(name, chat_id, bot=bot_config(context).name, amount=amount)
+        if not docs:
+            await update.message.reply_text(f"Nessun documento per «{name}».")
+            return
+        for doc in docs:
+            await resend_archived(update.message, doc, bot_config(context).name)
+    except Exception as e:
+        logger.error("❌ Ошибка архива для чата %s: %s", update.effective_chat.id, e)
+        await update.message.reply_text(f"❌ Errore archivio: {e}")
+
 # ---------------------------- Main -------------------------------------------
-def main():
-    app = Application.builder().token(TOKEN).build()
+async def post_init(app: Application) -> None:
+    # Общая версия договора бренда бота рендерится в фоне, пока бот уже отвечает
+    app.create_task(generic_documents.prepare(render_pool, ['contratto'], app.bot_data['config'].brand))
+
+async def post_shutdown(app: Application) -> None:
+    # Persistence уже записан Application.shutdown - закрываем базу состояния
+    if isinstance(app.persistence, SQLitePersistence):
+        app.persistence.close()
+
+async def start_shared() -> None:
+    """Общие ресурсы процесса - один раз на всех ботов"""
+    render_pool.start()
+    if RENDER_HTTP_PORT:
+        await render_service.start(port=int(RENDER_HTTP_PORT))
+
+async def stop_shared() -> None:
+    await render_service.stop()
+    document_archive.close()
+    render_pool.shutdown()
+
+def build_application(config: BotConfig) -> Application:
+    """Собирает Application бота со всеми обработчиками по его BotConfig"""
+    app = (
+        configure_state(configure_builder(Application.builder().token(config.token), base_url=config.base_url),
+                        config.state_db)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    app.bot_data['config'] = config
     conv = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
             ASK_NAME:     [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_name)],
             ASK_AMOUNT:   [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_amount)],
+            ASK_TERM:     [CallbackQueryHandler(choose_term, pattern=r'^term:\d+$')],
         },
         fallbacks=[CommandHandler('cancel', cancel), CommandHandler('start', start)],
+        name='contratto',
+        persistent=bool(config.state_db),
     )
     app.add_handler(conv)
+    app.add_handler(CallbackQueryHandler(stale_quote, pattern=r'^term:'))
+    app.add_handler(CommandHandler('profile', profile))
+    app.add_handler(CommandHandler('storico', storico))
+    app.add_handler(CommandHandler('brand', brand))
+    return app
+
+def main():
+    configs = bot_configs()
+    bots = [(build_application(config), config) for config in configs]
     
-    print("🤖 Телеграм бот запущен!")
+    print(f"🤖 Телеграм ботов запущено: {len(bots)} ({', '.join(config.name for config in configs)})")
     print("📋 Генерируется: contratto")
     print("🔧 Использует PDF конструктор из pdf_costructor.py")
     
-    app.run_polling()
+    # Все боты - в одном цикле событий поверх общего пула рендеринга
+    asyncio.run(serve(bots, on_start=start_shared, on_stop=stop_shared))
 
 if __name__ == '__main__':
     main()
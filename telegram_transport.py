@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Транспорт Telegram для бота: настроенный HTTPX пул соединений и очередь отправки
+с учетом лимитов Telegram (RetryAfter, лимиты на чат и глобальный лимит).
+Бот можно направить на локальный Bot API сервер (быстрая загрузка больших файлов)
+или на локальную заглушку в тестах через TG_BASE_URL.
+Апдейты разных чатов обрабатываются параллельно, одного чата - строго по очереди
+(ChatSerializedApplication): ConversationHandler не рассчитан на гонки внутри диалога.
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+from telegram.error import RetryAfter
+from telegram.ext import Application, BaseRateLimiter
+from telegram.request import HTTPXRequest
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# ---------------------- Настройки ------------------------------------------
+TG_POOL_SIZE = int(os.getenv("TG_POOL_SIZE", "16"))                  # соединений для API методов
+TG_KEEPALIVE_EXPIRY = float(os.getenv("TG_KEEPALIVE_EXPIRY", "60"))  # сек. жизни простаивающего соединения
+TG_CONNECT_TIMEOUT = float(os.getenv("TG_CONNECT_TIMEOUT", "5"))
+TG_READ_TIMEOUT = float(os.getenv("TG_READ_TIMEOUT", "30"))
+TG_WRITE_TIMEOUT = float(os.getenv("TG_WRITE_TIMEOUT", "60"))        # загрузка PDF на сотни КБ
+TG_POOL_TIMEOUT = float(os.getenv("TG_POOL_TIMEOUT", "10"))
+TG_HTTP_VERSION = os.getenv("TG_HTTP_VERSION", "1.1")
+TG_CONCURRENT_UPDATES = int(os.getenv("TG_CONCURRENT_UPDATES", "32"))  # параллельных апдейтов (разных чатов)
+
+TG_BASE_URL = os.getenv("TG_BASE_URL", "")            # например http://localhost:8081/bot
+TG_BASE_FILE_URL = os.getenv("TG_BASE_FILE_URL", "")  # например http://localhost:8081/file/bot
+TG_LOCAL_MODE = os.getenv("TG_LOCAL_MODE", "0") != "0"
+
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))         # сообщений в секунду на бота
+TG_CHAT_INTERVAL = float(os.getenv("TG_CHAT_INTERVAL", "1.0"))    # сек. между сообщениями в личный чат
+TG_GROUP_INTERVAL = float(os.getenv("TG_GROUP_INTERVAL", "3.0"))  # сек. между сообщениями в группу (20/мин)
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))            # повторов после RetryAfter
+
+
+class TunedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest с настраиваемым временем жизни keep-alive соединений"""
+
+    def __init__(self, *args, keepalive_expiry: float = TG_KEEPALIVE_EXPIRY, **kwargs):
+        self._keepalive_expiry = keepalive_expiry
+        super().__init__(*args, **kwargs)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = self._client_kwargs['limits']
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self._keepalive_expiry,
+        )
+        return super()._build_client()
+
+
+class _Slots:
+    """Расписание отправок по ключу: следующий разрешенный момент времени"""
+
+    def __init__(self):
+        self._next = {}
+
+    def reserve(self, key, interval: float) -> float:
+        """Резервирует слот и возвращает, сколько секунд ждать до него"""
+        now = time.monotonic()
+        slot = max(self._next.get(key, now), now)
+        self._next[key] = slot + interval
+        # Старые ключи чатов не копятся бесконечно
+        if len(self._next) > 4096:
+            self._next = {k: v for k, v in self._next.items() if v > now}
+        return slot - now
+
+    def push_back(self, key, until: float) -> None:
+        self._next[key] = max(self._next.get(key, 0), until)
+
+
+class SendRateLimiter(BaseRateLimiter):
+    """
+    Очередь исходящих запросов с троттлингом
+
+    Сообщения распределяются так, чтобы не превышать глобальный лимит бота и лимит на чат.
+    При RetryAfter вся отправка приостанавливается на указанное Telegram время
+    и запрос повторяется до max_retries раз.
+    """
+
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_interval: float = TG_CHAT_INTERVAL,
+                 group_interval: float = TG_GROUP_INTERVAL, max_retries: int = TG_MAX_RETRIES):
+        self.global_interval = 1 / global_rate if global_rate > 0 else 0
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self._slots = _Slots()
+        self._resume = asyncio.Event()
+        self._resume.set()
+
+    async def initialize(self) -> None:
+        """Нечего инициализировать"""
+
+    async def shutdown(self) -> None:
+        """Нечего освобождать"""
+
+    async def _throttle(self, chat_id) -> None:
+        waits = [self._slots.reserve('*', self.global_interval)]
+        if chat_id is not None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            waits.append(self._slots.reserve(chat_id, self.group_interval if is_group else self.chat_interval))
+        wait = max(waits)
+        if wait > 0:
+            metrics.observe('tg_send_throttle_seconds', wait)
+            await asyncio.sleep(wait)
+        await self._resume.wait()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        """Отправляет запрос с учетом лимитов; rate_limit_args - число повторов"""
+        max_retries = self.max_retries if rate_limit_args is None else rate_limit_args
+        chat_id = data.get('chat_id')
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        for attempt in range(max_retries + 1):
+            # Ответы без chat_id (getUpdates, getMe, answerCallbackQuery) не троттлим
+            if chat_id is not None:
+                await self._throttle(chat_id)
+            else:
+                await self._resume.wait()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                metrics.inc('tg_retry_after', endpoint=endpoint)
+                if attempt == max_retries:
+                    logger.error("🚦 Лимит Telegram (%s) не снят после %d повторов", endpoint, max_retries)
+                    raise
+                delay = float(exc.retry_after) + 0.1
+                logger.warning("🚦 RetryAfter %.1f с на %s (чат %s), повтор %d/%d",
+                               delay, endpoint, chat_id, attempt + 1, max_retries)
+                if chat_id is not None:
+                    self._slots.push_back(chat_id, time.monotonic() + delay)
+                self._resume.clear()
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._resume.set()
+
+
+def update_chat_id(update):
+    """Чат апдейта (или пользователь, если чата нет) - ключ последовательной обработки"""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    return user.id if user is not None else None
+
+
+class ChatSerializedApplication(Application):
+    """
+    Application с concurrent_updates, в котором апдейты одного чата идут по очереди
+
+    PTB при concurrent_updates обрабатывает апдейты одного диалога одновременно:
+    два быстрых нажатия на клавиатуру сроков дважды проходят choose_term и
+    отправляют два договора. Здесь параллельны только разные чаты.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._chat_locks = {}   # chat_id -> [asyncio.Lock, апдейтов чата в работе]
+
+    async def process_update(self, update: object) -> None:
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            await super().process_update(update)
+            return
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            if entry[0].locked():
+                metrics.inc('telegram_chat_update_waits')
+            async with entry[0]:
+                await self.process_chat_update(chat_id, update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._chat_locks.pop(chat_id, None)
+
+    async def process_chat_update(self, chat_id: int, update: object) -> None:
+        """Обработка апдейта, когда предыдущие апдейты чата уже обработаны"""
+        await super().process_update(update)
+
+
+def configure_builder(builder, base_url: str = None):
+    """Применяет к ApplicationBuilder пул соединений, таймауты, лимитер и адрес Bot API"""
+    base_url = base_url or TG_BASE_URL
+    builder = (
+        builder
+        .request(TunedHTTPXRequest(
+            connection_pool_size=TG_POOL_SIZE,
+            connect_timeout=TG_CONNECT_TIMEOUT,
+            read_timeout=TG_READ_TIMEOUT,
+            write_timeout=TG_WRITE_TIMEOUT,
+            pool_timeout=TG_POOL_TIMEOUT,
+            http_version=TG_HTTP_VERSION,
+        ))
+        # Long polling держит одно соединение; read_timeout больше таймаута getUpdates
+        .get_updates_request(TunedHTTPXRequest(
+            connection_pool_size=1,
+            connect_timeout=TG_CONNECT_TIMEOUT,
+            read_timeout=TG_READ_TIMEOUT + 10,
+            http_version=TG_HTTP_VERSION,
+        ))
+        .rate_limiter(SendRateLimiter())
+        .concurrent_updates(TG_CONCURRENT_UPDATES)
+        .application_class(ChatSerializedApplication)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+        logger.info("🛰️ Bot API: %s", base_url)
+    if TG_BASE_FILE_URL:
+        builder = builder.base_file_url(TG_BASE_FILE_URL)
+    if TG_LOCAL_MODE:
+        builder = builder.local_mode(True)
+    return builder
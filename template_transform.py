@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Декларативная очистка HTML шаблонов от элементов, создающих лишние страницы
+Один проход html.parser собирает <style> блоки, классы строк <tr> и пустые
+блоки в конце <body>; CSS разбирается tinycss2 (он уже стоит вместе с WeasyPrint).
+scale_typography уменьшает шрифт и интерлиньяж тем же разбором - для fit_to_pages.
+Правила описаны данными и применяются одной сборкой строки - время линейно
+от размера документа, а не "классы x документ", как у цепочки re.sub.
+Нетронутые участки документа (и CSS без сработавших правил) не меняются ни на байт.
+
+   python template_transform.py contratto.html   — какие правила сработают
+"""
+
+import sys
+from html.parser import HTMLParser
+from typing import NamedTuple
+
+
+# Пороги правил (как в прежнем анализаторе fix_html_layout)
+TALL_HEIGHT_PT = 500    # высота класса больше - блок не помещается на страницу
+TALL_ROW_PT = 300       # то же для классов строк таблиц <tr>
+RED_BORDER = '#e2001a'  # встроенная рамка из Google Docs - дублирует рамку @page
+
+# Теги, которые делают блок непустым, даже без текста
+CONTENT_TAGS = {'img', 'br', 'hr', 'table', 'svg', 'input', 'object', 'iframe'}
+
+
+class RuleHit(NamedTuple):
+    """Срабатывание правила: имя правила и на чем (класс с высотой, число блоков)"""
+    rule: str
+    target: str
+
+
+class _Scanner(HTMLParser):
+    """Один проход по документу: смещения <style>, классы <tr>, пустые p/div"""
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=False)
+        self.html = html
+        self.line_starts = [0]
+        newline = html.find('\n')
+        while newline != -1:
+            self.line_starts.append(newline + 1)
+            newline = html.find('\n', newline + 1)
+        self.styles = []        # (начало содержимого, конец содержимого)
+        self.row_classes = set()
+        self.blocks = {}        # конец блока -> (начало, пустой)
+        self.body_close = None
+        self._stack = []        # открытые p/div: [начало, пустой]
+        self._style_start = None
+
+    def position(self) -> int:
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'style':
+            self._style_start = self.position() + len(self.get_starttag_text())
+        elif tag == 'tr':
+            self.row_classes.update(dict(attrs).get('class', '').split())
+        if tag in ('p', 'div'):
+            self._stack.append([self.position(), True])
+        elif tag in CONTENT_TAGS and self._stack:
+            for block in self._stack:
+                block[1] = False
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in CONTENT_TAGS:
+            for block in self._stack:
+                block[1] = False
+
+    def handle_endtag(self, tag):
+        start = self.position()
+        if tag == 'style' and self._style_start is not None:
+            self.styles.append((self._style_start, start))
+            self._style_start = None
+        elif tag == 'body':
+            self.body_close = start
+        elif tag in ('p', 'div') and self._stack:
+            block_start, empty = self._stack.pop()
+            end = self.html.index('>', start) + 1
+            known = self.blocks.get(end)
+            if known is None or block_start < known[0]:
+                self.blocks[end] = (block_start, empty)
+
+    def handle_data(self, data):
+        if self._style_start is None and data.strip():
+            for block in self._stack:
+                block[1] = False
+
+    def handle_entityref(self, name):
+        self.handle_data('&')
+
+    def handle_charref(self, name):
+        self.handle_data('&')
+
+
+def _classes(prelude) -> list:
+    """Классы простых селекторов правила: '.c5' или '.c5, .c9' (составные не трогаем)"""
+    import tinycss2
+
+    classes = []
+    selector = []
+    for token in prelude + [tinycss2.ast.LiteralToken(0, 0, ',')]:
+        if token.type == 'whitespace':
+            continue
+        if token.type == 'literal' and token.value == ',':
+            if len(selector) == 2 and selector[0].type == 'literal' and selector[0].value == '.' \
+                    and selector[1].type == 'ident':
+                classes.append(selector[1].value)
+            selector = []
+        else:
+            selector.append(token)
+    return classes
+
+
+def _height_pt(declarations):
+    for declaration in declarations:
+        if declaration.type == 'declaration' and declaration.lower_name == 'height':
+            for token in declaration.value:
+                if token.type == 'dimension' and token.lower_unit == 'pt':
+                    return token.value
+    return None
+
+
+def _has_red_border(declarations) -> bool:
+    import tinycss2
+
+    return any(declaration.type == 'declaration' and declaration.lower_name.startswith('border')
+               and RED_BORDER in tinycss2.serialize(declaration.value).lower()
+               for declaration in declarations)
+
+
+def _with_height_auto(declarations) -> str:
+    import tinycss2
+
+    parts = []
+    for declaration in declarations:
+        if declaration.type != 'declaration':
+            continue
+        value = 'auto' if declaration.lower_name == 'height' else tinycss2.serialize(declaration.value).strip()
+        parts.append(f"{declaration.name}:{value}{' !important' if declaration.important else ''}")
+    return ';'.join(parts) + ';'
+
+
+def _transform_css(css: str, row_classes: set, rules, hits: list) -> str:
+    """
+    CSS правила:
+      tall_height - высота класса > TALL_HEIGHT_PT pt -> height:auto
+      red_border  - рамка RED_BORDER -> правило заменяется на border:none; padding:5pt
+      tall_row    - класс строки <tr> выше TALL_ROW_PT pt -> правило сводится к height:auto
+    """
+    import tinycss2
+
+    stylesheet = tinycss2.parse_stylesheet(css)
+    changed = False
+    for rule in stylesheet:
+        if rule.type != 'qualified-rule':
+            continue
+        classes = _classes(rule.prelude)
+        if not classes:
+            continue
+        declarations = tinycss2.parse_declaration_list(rule.content, skip_whitespace=True, skip_comments=True)
+        height = _height_pt(declarations)
+        target = ','.join(classes)
+        if 'red_border' in rules and _has_red_border(declarations):
+            rule.content = tinycss2.parse_component_value_list('border:none !important; padding:5pt;')
+            hits.append(RuleHit('red_border', target))
+        elif 'tall_height' in rules and height is not None and height > TALL_HEIGHT_PT:
+            rule.content = tinycss2.parse_component_value_list(_with_height_auto(declarations))
+            hits.append(RuleHit('tall_height', f"{target}({height:g}pt)"))
+        elif 'tall_row' in rules and height is not None and height > TALL_ROW_PT \
+                and row_classes.intersection(classes):
+            rule.content = tinycss2.parse_component_value_list('height:auto;')
+            hits.append(RuleHit('tall_row', f"{target}({height:g}pt)"))
+        else:
+            continue
+        changed = True
+    return tinycss2.serialize(stylesheet) if changed else css
+
+
+def _trailing_empty(html: str, scanner: _Scanner, hits: list):
+    """trailing_empty - пустые p/div перед </body> (создают пустую последнюю страницу)"""
+    if scanner.body_close is None:
+        return None
+    cursor = scanner.body_close
+    removed = 0
+    while True:
+        end = cursor
+        while end and html[end - 1].isspace():
+            end -= 1
+        block = scanner.blocks.get(end)
+        if block is None or not block[1]:
+            break
+        cursor = block[0]
+        removed += 1
+    if not removed:
+        return None
+    hits.append(RuleHit('trailing_empty', f"{removed} блоков"))
+    return cursor, scanner.body_close
+
+
+# Правило -> где применяется; по умолчанию - правила прежнего анализатора
+CSS_RULES = ('tall_height', 'red_border', 'tall_row')
+DEFAULT_RULES = CSS_RULES
+
+
+def transform(html: str, rules=DEFAULT_RULES) -> tuple:
+    """
+    Применяет правила очистки за один проход
+
+    Args:
+        html (str): документ
+        rules: имена правил (CSS_RULES и/или 'trailing_empty')
+
+    Returns:
+        tuple: (новый HTML, список RuleHit сработавших правил)
+    """
+    scanner = _Scanner(html)
+    scanner.feed(html)
+    scanner.close()
+
+    hits, edits = [], []
+    if set(rules) & set(CSS_RULES):
+        for start, end in scanner.styles:
+            css_hits = []
+            css = _transform_css(html[start:end], scanner.row_classes, rules, css_hits)
+            if css_hits:
+                edits.append((start, end, css))
+                hits += css_hits
+    if 'trailing_empty' in rules:
+        span = _trailing_empty(html, scanner, hits)
+        if span is not None:
+            edits.append((*span, ''))
+
+    if not edits:
+        return html, hits
+    chunks, cursor = [], 0
+    for start, end, text in sorted(edits):
+        chunks += (html[cursor:start], text)
+        cursor = end
+    chunks.append(html[cursor:])
+    return ''.join(chunks), hits
+
+
+# Свойства и абсолютные единицы, которые масштабирует scale_typography
+# (em, % и множители line-height относительные - следуют за шрифтом сами)
+TYPOGRAPHY_PROPERTIES = ('font-size', 'line-height')
+ABSOLUTE_UNITS = {'pt', 'px', 'mm', 'cm', 'in', 'pc', 'q'}
+
+
+def _scale_css(css: str, scale: float) -> str:
+    import tinycss2
+
+    stylesheet = tinycss2.parse_stylesheet(css)
+    changed = False
+    for rule in stylesheet:
+        if rule.type != 'qualified-rule':
+            continue
+        # Токены объявлений - те же объекты, что в rule.content: правка сразу попадает в serialize
+        for declaration in tinycss2.parse_declaration_list(rule.content):
+            if declaration.type != 'declaration' or declaration.lower_name not in TYPOGRAPHY_PROPERTIES:
+                continue
+            for token in declaration.value:
+                if token.type == 'dimension' and token.lower_unit in ABSOLUTE_UNITS:
+                    token.value *= scale
+                    token.representation = f"{token.value:.2f}".rstrip('0').rstrip('.')
+                    changed = True
+    return tinycss2.serialize(stylesheet) if changed else css
+
+
+def scale_typography(html: str, scale: float) -> str:
+    """
+    Документ с font-size и line-height в <style>, умноженными на scale
+
+    Args:
+        html (str): документ
+        scale (float): множитель (1.0 - без изменений)
+
+    Returns:
+        str: новый HTML; вне <style> документ не меняется
+    """
+    if scale == 1.0:
+        return html
+    scanner = _Scanner(html)
+    scanner.feed(html)
+    scanner.close()
+
+    chunks, cursor = [], 0
+    for start, end in scanner.styles:
+        chunks += (html[cursor:start], _scale_css(html[start:end], scale))
+        cursor = end
+    chunks.append(html[cursor:])
+    return ''.join(chunks)
+
+
+def format_hits(hits: list) -> str:
+    if not hits:
+        return "✅ Проблемных элементов не найдено"
+    groups = {}
+    for hit in hits:
+        groups.setdefault(hit.rule, []).append(hit.target)
+    return '; '.join(f"{rule}: {', '.join(targets)}" for rule, targets in groups.items())
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Использование: python template_transform.py <шаблон.html> [правило ...]")
+        return
+    with open(sys.argv[1], encoding='utf-8') as f:
+        html = f.read()
+    result, hits = transform(html, sys.argv[2:] or DEFAULT_RULES + ('trailing_empty',))
+    print(format_hits(hits))
+    print(f"Размер: {len(html)} -> {len(result)} символов")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Регрессия копирований на пути WeasyPrint: слияние с overlay (PyPDF2) и optimize_pdf
+Базовый PDF - маленькая фикстура ReportLab вместо WeasyPrint, поэтому тест
+идет без системных библиотек Pango.
+
+   python -m pytest -q test_pdf_memory.py
+"""
+
+import tracemalloc
+from io import BytesIO
+
+import pytest
+
+import pdf_costructor
+from stamp_layout import configure_reportlab
+
+
+MAX_PEAK_RATIO = 5.0   # пик аллокаций на документ - небольшое кратное размера PDF
+RUNS = 3
+
+
+def _base_pdf(pages: int = 2) -> BytesIO:
+    """Двухстраничный PDF с текстом - как у договора, но без WeasyPrint"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    base_canvas = canvas.Canvas(buffer, pagesize=A4)
+    for page in range(pages):
+        for line in range(40):
+            base_canvas.drawString(72, 800 - line * 18, f"Riga {line}, pagina {page + 1}: Mario Rossi, 15000 EUR")
+        base_canvas.showPage()
+    base_canvas.save()
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture(scope='module', autouse=True)
+def warm_overlay():
+    # Overlay и сжатые печати собираются один раз на профиль - в пик документа они не входят
+    configure_reportlab()
+    if pdf_costructor.overlay_pdf('contratto') is None:
+        pytest.skip("нет схемы размещения contratto")
+    pdf_costructor._add_images_to_pdf(_base_pdf(), 'contratto')
+
+
+def test_overlay_merge_peak_is_small_multiple_of_pdf():
+    base_size = _base_pdf().getbuffer().nbytes
+    for _ in range(RUNS):
+        base = _base_pdf()
+        tracemalloc.start()
+        try:
+            merged = pdf_costructor._add_images_to_pdf(base, 'contratto')
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        size = merged.getbuffer().nbytes
+        # При ошибке слияния возвращается базовый PDF - печати должны быть на месте
+        assert size > base_size * 10, "overlay не наложен"
+        assert peak <= MAX_PEAK_RATIO * size, f"пик аллокаций x{peak / size:.2f} от PDF > x{MAX_PEAK_RATIO:g}"
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Трассировка запроса от апдейта Telegram до отправленного документа
+Идентификатор трассы (correlation ID) создается на апдейт и живет в contextvars,
+в воркеры пула передается вместе с задачей. Спаны пишутся в формате OTLP JSON
+(как у файлового экспортера OpenTelemetry Collector) в файл или в консоль.
+
+   python tracing.py <trace_id>   — дерево спанов трассы из TRACE_FILE
+"""
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import sys
+import time
+from typing import NamedTuple
+
+
+# ---------------------- Настройки ------------------------------------------
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")     # none | console | file
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")     # для TRACE_EXPORTER=file
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "chiara-contratto-bot")
+
+# Коды статуса спана OTLP
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class SpanContext(NamedTuple):
+    """Контекст для передачи между задачами и процессами (пиклится)"""
+    trace_id: str
+    span_id: str
+
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    # os.urandom, а не random: воркеры forkserver иначе унаследуют одно состояние генератора
+    return os.urandom(nbytes).hex()
+
+
+def enabled() -> bool:
+    """Спаны экспортируются"""
+    return TRACE_EXPORTER in ('console', 'file')
+
+
+def current_context():
+    """Текущий SpanContext или None вне трассы"""
+    return _current.get()
+
+
+def current_trace_id() -> str:
+    """Correlation ID текущего запроса (пустая строка вне трассы)"""
+    ctx = _current.get()
+    return ctx.trace_id if ctx else ''
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def _export(span: dict) -> None:
+    """Одна строка OTLP JSON на спан; O_APPEND - воркеры пишут в тот же файл"""
+    line = json.dumps({'resourceSpans': [{
+        'resource': {'attributes': [
+            _attribute('service.name', TRACE_SERVICE_NAME),
+            _attribute('process.pid', os.getpid()),
+        ]},
+        'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span]}],
+    }]}, ensure_ascii=False) + '\n'
+    if TRACE_EXPORTER == 'console':
+        sys.stdout.write(line)
+        return
+    fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode('utf-8'))
+    finally:
+        os.close(fd)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, parent: SpanContext = None,
+                error: str = None, **attributes) -> None:
+    """Экспортирует спан с уже измеренными границами (например, ожидание в очереди)"""
+    if not enabled():
+        return
+    parent = parent or _current.get()
+    if parent is None:
+        return
+    _export({
+        'traceId': parent.trace_id,
+        'spanId': _new_id(8),
+        'parentSpanId': parent.span_id,
+        'name': name,
+        'kind': 1,
+        'startTimeUnixNano': str(start_ns),
+        'endTimeUnixNano': str(end_ns),
+        'attributes': [_attribute(k, v) for k, v in attributes.items() if v is not None],
+        'status': {'code': STATUS_ERROR, 'message': error} if error else {'code': STATUS_OK},
+    })
+
+
+@contextlib.contextmanager
+def span(name: str, root: bool = False, **attributes):
+    """
+    Спан вокруг блока кода
+
+    Args:
+        name (str): имя стадии, например 'pdf.weasyprint'
+        root (bool): начать новую трассу даже внутри текущей
+        **attributes: атрибуты спана (чат, шаблон, размеры)
+
+    Yields:
+        dict: атрибуты - можно дополнить внутри блока
+    """
+    parent = None if root else _current.get()
+    ctx = SpanContext(parent.trace_id if parent else _new_id(16), _new_id(8))
+    token = _current.set(ctx)
+    start_ns = time.time_ns()
+    started = time.perf_counter_ns()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        _current.reset(token)
+        if enabled():
+            _export({
+                'traceId': ctx.trace_id,
+                'spanId': ctx.span_id,
+                'parentSpanId': parent.span_id if parent else '',
+                'name': name,
+                'kind': 1,
+                'startTimeUnixNano': str(start_ns),
+                'endTimeUnixNano': str(start_ns + time.perf_counter_ns() - started),
+                'attributes': [_attribute(k, v) for k, v in attributes.items() if v is not None],
+                'status': {'code': STATUS_ERROR, 'message': error} if error else {'code': STATUS_OK},
+            })
+
+
+@contextlib.contextmanager
+def attach(ctx: SpanContext):
+    """Продолжает трассу, пришедшую из другого процесса"""
+    token = _current.set(SpanContext(*ctx) if ctx else None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def traced(name: str):
+    """Декоратор: вызов функции (обычной или async) как спан"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---------------------------- Просмотр трассы --------------------------------
+def load_trace(trace_id: str, path: str = None) -> list:
+    """Спаны трассы из файла экспорта (допускается префикс идентификатора)"""
+    spans = []
+    with open(path or TRACE_FILE, encoding='utf-8') as f:
+        for line in f:
+            for resource in json.loads(line)['resourceSpans']:
+                for scope in resource['scopeSpans']:
+                    spans += [s for s in scope['spans'] if s['traceId'].startswith(trace_id)]
+    return spans
+
+
+def format_trace(spans: list) -> str:
+    """Дерево спанов с отступами, смещением от начала и длительностью"""
+    if not spans:
+        return "Трасса не найдена"
+    children = {}
+    for s in spans:
+        children.setdefault(s['parentSpanId'], []).append(s)
+    ids = {s['spanId'] for s in spans}
+    t0 = min(int(s['startTimeUnixNano']) for s in spans)
+    lines = [f"Трасса {spans[0]['traceId']}"]
+
+    def walk(s, depth):
+        start = (int(s['startTimeUnixNano']) - t0) / 1e9
+        duration = (int(s['endTimeUnixNano']) - int(s['startTimeUnixNano'])) / 1e9
+        attrs = ' '.join(f"{a['key']}={next(iter(a['value'].values()))}" for a in s['attributes'])
+        mark = ' ❌ ' + s['status'].get('message', '') if s['status']['code'] == STATUS_ERROR else ''
+        lines.append(f"{'  ' * depth}{s['name']:<{40 - 2 * depth}} +{start:7.3f} с {duration:8.3f} с  {attrs}{mark}")
+        for child in sorted(children.get(s['spanId'], []), key=lambda c: int(c['startTimeUnixNano'])):
+            walk(child, depth + 1)
+
+    roots = [s for s in spans if s['parentSpanId'] not in ids]
+    for s in sorted(roots, key=lambda c: int(c['startTimeUnixNano'])):
+        walk(s, 0)
+    return '\n'.join(lines)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Использование: python tracing.py <trace_id> [файл]")
+        return
+    print(format_trace(load_trace(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)))
+
+
+if __name__ == '__main__':
+    main()